@@ -0,0 +1,678 @@
+#!/usr/bin/env python
+
+"""
+Measure the throughput of the event daemon without a Shotgun site.
+
+A real L{shotgunEventDaemon.Engine} runs the shipped example plugins against
+an in-memory stand-in for Shotgun fed with generated events. Every call made
+to the stand-in can be slowed down to simulate the latency of a real site.
+
+For each scenario, the number of events processed per second, the median and
+99th percentile duration of each callback and the lag between the creation of
+events and the end of their processing are reported.
+
+Usage::
+
+    python benchmark.py [--events N] [--latency MS] [--rate N]
+                        [--dispatch-threads N] [--batch-size N]
+                        [--timeout S] [scenario ...]
+"""
+
+from __future__ import print_function
+
+import abc
+import argparse
+import copy
+import datetime
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import six
+
+import engineMetrics
+import shotgunConnections
+import shotgunEventDaemon
+
+
+EXAMPLE_PLUGINS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examplePlugins")
+
+CONFIG_TEMPLATE = """[daemon]
+pidFile: %(path)s/benchmark.pid
+eventIdFile: %(path)s/benchmark.id
+logMode: 1
+logPath: %(path)s/logs
+logFile: benchmark
+logging: 20
+timing_log: off
+conn_retry_sleep = 1
+max_conn_retries = 1
+fetch_interval = 0
+max_event_batch_size = %(batchSize)d
+prefetch_pages = 1
+dispatch_threads = %(dispatchThreads)d
+
+[shotgun]
+server: https://benchmark.shotgunstudio.com
+name: benchmark
+key: benchmark
+proxy_server:
+use_session_uuid: True
+
+[plugins]
+paths: %(path)s/plugins
+watcher = poll
+
+[emails]
+server:
+from:
+to:
+subject:
+"""
+
+
+class FakeSite(object):
+    """
+    The entities of an in-memory Shotgun site, shared by every
+    L{FakeShotgun} connected to it.
+    """
+
+    def __init__(self, latency=0.0):
+        """
+        @param latency: The number of seconds every call to the site takes.
+        @type latency: I{float}
+        """
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.entities = {}
+        self.schema = {}
+        self.eventsRequested = threading.Event()
+        self._ids = {}
+
+    def create(self, entityType, data):
+        """
+        Add an entity to the site.
+
+        @param entityType: The type of the entity.
+        @type entityType: I{str}
+        @param data: The fields of the entity.
+        @type data: I{dict}
+
+        @return: The stored entity.
+        @rtype: I{dict}
+        """
+        with self.lock:
+            entityId = self._ids.get(entityType, 0) + 1
+            self._ids[entityType] = entityId
+            entity = dict(data, type=entityType, id=entityId)
+            self.entities.setdefault(entityType, {})[entityId] = entity
+            return entity
+
+    def getLastId(self, entityType):
+        with self.lock:
+            return self._ids.get(entityType, 0)
+
+    def getField(self, entity, field):
+        """
+        Get the value of a field of an entity, following links for dotted
+        field names like sg_task.Task.sg_status_list.
+        """
+        parts = field.split(".")
+        value = entity.get(parts[0])
+        while len(parts) >= 3 and value:
+            linked = self.entities.get(parts[1], {}).get(value.get("id"))
+            if linked is None:
+                return None
+            value = linked.get(parts[2])
+            parts = parts[2:]
+        return value
+
+    def matches(self, entity, filters, filterOperator="all"):
+        results = (self._matchesFilter(entity, f) for f in filters)
+        if filterOperator == "any":
+            return any(results)
+        return all(results)
+
+    def _matchesFilter(self, entity, condition):
+        if isinstance(condition, dict):
+            return self.matches(
+                entity, condition["filters"], condition.get("filter_operator", "all")
+            )
+
+        field, operator = condition[0], condition[1]
+        values = condition[2:]
+        if len(values) == 1:
+            values = values[0]
+        value = self.getField(entity, field)
+        if isinstance(value, dict) and not isinstance(values, dict):
+            value = value.get("id")
+        if isinstance(values, dict):
+            values = values.get("id")
+            if isinstance(value, dict):
+                value = value.get("id")
+
+        if operator == "is":
+            return value == values
+        if operator == "is_not":
+            return value != values
+        if operator == "in":
+            return value in values
+        if operator == "not_in":
+            return value not in values
+        if operator == "greater_than":
+            return value is not None and value > values
+        if operator == "less_than":
+            return value is not None and value < values
+        if operator == "between":
+            return value is not None and values[0] <= value <= values[1]
+        raise ValueError("Unsupported filter operator %s." % operator)
+
+
+class FakeShotgun(object):
+    """
+    A stand-in for L{shotgun_api3.Shotgun} working on a L{FakeSite}.
+
+    Only the parts of the API used by the daemon and the benchmarked plugins
+    are implemented.
+    """
+
+    def __init__(self, site, *args, **kwargs):
+        """
+        @param site: The site to work on.
+        @type site: L{FakeSite}
+
+        The other arguments are the ones of L{shotgun_api3.Shotgun} and are
+        ignored.
+        """
+        self._site = site
+        self.session_uuid = None
+
+    def set_session_uuid(self, sessionUuid):
+        self.session_uuid = sessionUuid
+
+    def close(self):
+        pass
+
+    def find(
+        self,
+        entity_type,
+        filters,
+        fields=None,
+        order=None,
+        filter_operator=None,
+        limit=0,
+        **kwargs
+    ):
+        self._wait()
+        if entity_type == "EventLogEntry":
+            self._site.eventsRequested.set()
+
+        with self._site.lock:
+            entities = [
+                entity
+                for entity in self._site.entities.get(entity_type, {}).values()
+                if self._site.matches(entity, filters, filter_operator or "all")
+            ]
+
+            for sort in reversed(order or [{"field_name": "id", "direction": "asc"}]):
+                name = sort.get("field_name", sort.get("column"))
+                entities.sort(
+                    key=lambda entity: self._site.getField(entity, name),
+                    reverse=sort.get("direction") == "desc",
+                )
+            if limit:
+                entities = entities[:limit]
+
+            return [self._project(entity, fields) for entity in entities]
+
+    def find_one(self, entity_type, filters, fields=None, order=None, filter_operator=None, **kwargs):
+        entities = self.find(entity_type, filters, fields, order, filter_operator, limit=1)
+        if entities:
+            return entities[0]
+        return None
+
+    def create(self, entity_type, data, return_fields=None):
+        self._wait()
+        with self._site.lock:
+            entity = self._site.create(entity_type, copy.deepcopy(data))
+            return self._project(entity, return_fields or list(data.keys()))
+
+    def update(self, entity_type, entity_id, data, **kwargs):
+        self._wait()
+        with self._site.lock:
+            entity = self._site.entities.get(entity_type, {}).get(entity_id)
+            if entity is None:
+                raise ValueError("%s %d does not exist." % (entity_type, entity_id))
+            entity.update(copy.deepcopy(data))
+            return self._project(entity, list(data.keys()))
+
+    def batch(self, requests):
+        results = []
+        for request in requests:
+            if request["request_type"] == "update":
+                results.append(
+                    self.update(request["entity_type"], request["entity_id"], request["data"])
+                )
+            elif request["request_type"] == "create":
+                results.append(
+                    self.create(request["entity_type"], request["data"], request.get("return_fields"))
+                )
+            else:
+                raise ValueError("Unsupported batch request %s." % request["request_type"])
+        return results
+
+    def schema_field_read(self, entity_type, field_name=None, project_entity=None):
+        self._wait()
+        fields = self._site.schema.get(entity_type, {})
+        if field_name is not None:
+            return {field_name: fields[field_name]}
+        return dict(fields)
+
+    def _wait(self):
+        if self._site.latency:
+            time.sleep(self._site.latency)
+
+    def _project(self, entity, fields):
+        result = {"type": entity["type"], "id": entity["id"]}
+        for field in fields or []:
+            result[field] = copy.deepcopy(self._site.getField(entity, field))
+        return result
+
+
+class FakeShotgunPool(shotgunConnections.ShotgunPool):
+    """
+    The L{shotgunConnections.ShotgunPool} of a L{BenchmarkEngine}, handing out
+    connections to a L{FakeSite}.
+    """
+
+    def __init__(self, site):
+        """
+        @param site: The site the connections work on.
+        @type site: L{FakeSite}
+        """
+        shotgunConnections.ShotgunPool.__init__(self, "https://benchmark", None)
+        self._site = site
+
+    def _createShotgun(self, scriptName, scriptKey):
+        return FakeShotgun(self._site, scriptName, scriptKey)
+
+
+class BenchmarkEngine(shotgunEventDaemon.Engine):
+    """
+    An engine connected to a L{FakeSite} instead of Shotgun.
+    """
+
+    def __init__(self, configPath, site):
+        """
+        @param configPath: The path of the config file.
+        @type configPath: I{str}
+        @param site: The site to work on.
+        @type site: L{FakeSite}
+        """
+        self._site = site
+        super(BenchmarkEngine, self).__init__(configPath)
+
+    def getInactivePlugins(self):
+        """
+        @return: The names of the loaded plugins that failed to load or were
+            deactivated since.
+        @rtype: I{list} of I{str}
+        """
+        return [
+            plugin.getName()
+            for collection in self._pluginCollections
+            for plugin in collection
+            if not plugin.isActive()
+        ]
+
+    def _createShotgun(self):
+        return FakeShotgun(self._site)
+
+    def _createShotgunPool(self):
+        return FakeShotgunPool(self._site)
+
+
+class BenchmarkError(Exception):
+    """
+    Raised when a scenario can't be run to the end.
+    """
+
+    pass
+
+
+@six.add_metaclass(abc.ABCMeta)
+class Scenario(object):
+    """
+    A set of example plugins and the site data and events they work on.
+    """
+
+    name = None
+    description = None
+    plugins = ()
+    environment = {}
+
+    def setUp(self, site):
+        """
+        Create the entities the plugins need.
+
+        @param site: The site to create them on.
+        @type site: L{FakeSite}
+        """
+        pass
+
+    @abc.abstractmethod
+    def makeEvent(self, site, index):
+        """
+        @param site: The site the event happens on.
+        @type site: L{FakeSite}
+        @param index: The number of events made before this one.
+        @type index: I{int}
+
+        @return: The fields of an EventLogEntry.
+        @rtype: I{dict}
+        """
+
+
+class LogArgsScenario(Scenario):
+    name = "logArgs"
+    description = "One callback logging every event, no Shotgun calls."
+    plugins = ("logArgs.py",)
+    environment = {"SGDAEMON_LOGARGS_NAME": "benchmark", "SGDAEMON_LOGARGS_KEY": "benchmark"}
+
+    EVENT_TYPES = ("Shotgun_Shot_Change", "Shotgun_Task_Change", "Shotgun_Version_New")
+
+    def makeEvent(self, site, index):
+        return _makeEvent(
+            self.EVENT_TYPES[index % len(self.EVENT_TYPES)],
+            "sg_status_list",
+            {"type": "Shot", "id": index % 50 + 1, "name": "shot_%d" % (index % 50 + 1)},
+        )
+
+
+class SharedStateScenario(LogArgsScenario):
+    name = "sharedState"
+    description = "Three plugins with three callbacks each sharing state, no Shotgun calls."
+    plugins = ("sharedStateA.py", "sharedStateB.py", "sharedStateC.py")
+    environment = dict(
+        ("SGDAEMON_SHAREDSTATE%s_%s" % (plugin, value), "benchmark")
+        for plugin, value in itertools.product("ABC", ("NAME", "KEY"))
+    )
+
+
+class VersionStatusScenario(Scenario):
+    name = "versionStatus"
+    description = "Version status changes updating their Task with find, schema and batch calls."
+    plugins = ("version_status_update_task_status.py",)
+    environment = {"SGDAEMON_VSUTS_NAME": "benchmark", "SGDAEMON_VSUTS_KEY": "benchmark"}
+
+    STATUSES = (("rev", "rev"), ("apr", "fin"), ("ip", "ip"), ("wtg", None))
+    NUM_VERSIONS = 200
+
+    def setUp(self, site):
+        for code, taskStatus in self.STATUSES:
+            site.create("Status", {"code": code, "sg_task_status_mapping": taskStatus})
+
+        site.schema["Task"] = {
+            "sg_status_list": {
+                "data_type": {"value": "status_list"},
+                "properties": {"valid_values": {"value": ["wtg", "ip", "rev", "fin"]}},
+            }
+        }
+        site.schema["Version"] = {"client_approved_at": {"data_type": {"value": "date_time"}}}
+
+        for index in range(self.NUM_VERSIONS):
+            task = site.create("Task", {"content": "task_%d" % index, "sg_status_list": "wtg"})
+            site.create(
+                "Version",
+                {
+                    "code": "version_%d" % index,
+                    "sg_status_list": "wtg",
+                    "sg_task": {"type": "Task", "id": task["id"]},
+                    "entity": None,
+                },
+            )
+
+    def makeEvent(self, site, index):
+        versionId = index % self.NUM_VERSIONS + 1
+        status = self.STATUSES[index % len(self.STATUSES)][0]
+        with site.lock:
+            site.entities["Version"][versionId]["sg_status_list"] = status
+
+        event = _makeEvent(
+            "Shotgun_Version_Change",
+            "sg_status_list",
+            {"type": "Version", "id": versionId, "name": "version_%d" % index},
+        )
+        event["meta"]["new_value"] = status
+        return event
+
+
+SCENARIOS = (LogArgsScenario, SharedStateScenario, VersionStatusScenario)
+
+
+def _makeEvent(eventType, attributeName, entity):
+    return {
+        "event_type": eventType,
+        "attribute_name": attributeName,
+        "entity": entity,
+        "meta": {
+            "type": "attribute_change",
+            "entity_type": entity["type"],
+            "entity_id": entity["id"],
+            "attribute_name": attributeName,
+        },
+        "user": {"type": "HumanUser", "id": 1, "name": "Benchmark"},
+        "project": {"type": "Project", "id": 1, "name": "Benchmark"},
+        "session_uuid": "benchmark",
+        "description": "Benchmark event",
+    }
+
+
+def _addEvent(site, scenario, index):
+    event = scenario.makeEvent(site, index)
+    event["created_at"] = datetime.datetime.now(shotgunEventDaemon.SG_TIMEZONE.local)
+    return site.create("EventLogEntry", event)
+
+
+def runScenario(scenario, numEvents, latency, rate, dispatchThreads, batchSize, timeout):
+    """
+    Run an engine on the events of a scenario until all of them are processed.
+
+    The engine is stopped early if a plugin fails to load or is deactivated,
+    or if the events aren't all processed within the timeout.
+
+    @param scenario: The scenario to run.
+    @type scenario: L{Scenario}
+    @param numEvents: The number of events to process.
+    @type numEvents: I{int}
+    @param latency: The number of seconds every Shotgun call takes.
+    @type latency: I{float}
+    @param rate: The number of events created per second while the engine
+        runs. If 0, all of them are created at once as a backlog to catch up
+        with.
+    @type rate: I{float}
+    @param dispatchThreads: The number of worker threads of the engine.
+    @type dispatchThreads: I{int}
+    @param batchSize: The maximum number of events fetched at once.
+    @type batchSize: I{int}
+    @param timeout: The number of seconds the engine may run for.
+    @type timeout: I{float}
+
+    @return: The elapsed time and the metrics of the engine, keeping every
+        callback duration and event lag.
+    @rtype: I{tuple} of I{float} and L{engineMetrics.EngineMetrics}
+
+    @raise BenchmarkError: If the engine was stopped early.
+    """
+    path = tempfile.mkdtemp(prefix="sgEventBenchmark")
+    # The plugins read their script names and keys from the environment.
+    environment = dict((name, os.environ.get(name)) for name in scenario.environment)
+    try:
+        os.makedirs(os.path.join(path, "plugins"))
+        os.makedirs(os.path.join(path, "logs"))
+        for plugin in scenario.plugins:
+            shutil.copy(os.path.join(EXAMPLE_PLUGINS_PATH, plugin), os.path.join(path, "plugins"))
+        os.environ.update(scenario.environment)
+
+        configPath = os.path.join(path, "benchmark.conf")
+        with open(configPath, "w") as fh:
+            fh.write(
+                CONFIG_TEMPLATE
+                % {"path": path, "batchSize": batchSize, "dispatchThreads": dispatchThreads}
+            )
+
+        site = FakeSite(latency)
+        scenario.setUp(site)
+        # The engine starts after the last event it finds on startup.
+        _addEvent(site, scenario, 0)
+
+        engine = BenchmarkEngine(configPath, site)
+        metrics = engine.metrics = engineMetrics.EngineMetrics(
+            engineMetrics.RecordingHistogram
+        )
+
+        def produce():
+            site.eventsRequested.wait()
+            if rate:
+                for index in range(1, numEvents + 1):
+                    _addEvent(site, scenario, index)
+                    time.sleep(1.0 / rate)
+            else:
+                with site.lock:
+                    for index in range(1, numEvents + 1):
+                        _addEvent(site, scenario, index)
+
+        failures = []
+
+        def stopWhenDone():
+            deadline = time.time() + timeout
+            while len(metrics.eventLag.getObserved()) < numEvents:
+                # Plugins are loaded once the engine looks for events.
+                inactivePlugins = site.eventsRequested.is_set() and engine.getInactivePlugins()
+                if inactivePlugins:
+                    failures.append(
+                        "Plugins %s failed to load or were deactivated."
+                        % ", ".join(inactivePlugins)
+                    )
+                    break
+                if time.time() > deadline:
+                    failures.append(
+                        "Only %d of %d events processed in %gs."
+                        % (len(metrics.eventLag.getObserved()), numEvents, timeout)
+                    )
+                    break
+                time.sleep(0.01)
+            engine.stop()
+
+        producer = threading.Thread(target=produce, name="producer")
+        producer.daemon = True
+        producer.start()
+        stopper = threading.Thread(target=stopWhenDone, name="stopper")
+        stopper.daemon = True
+        stopper.start()
+
+        site.eventsRequested.clear()
+        startTime = time.time()
+        engine.start()
+        elapsed = time.time() - startTime
+
+        if failures:
+            raise BenchmarkError(failures[0])
+        return elapsed, metrics
+    finally:
+        for name, value in environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def main():
+    """
+    Run the benchmark scenarios and print their results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        metavar="scenario",
+        help="Scenarios to run among %s. Defaults to all of them."
+        % ", ".join(s.name for s in SCENARIOS),
+    )
+    parser.add_argument("--events", type=int, default=2000, help="Events per scenario.")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Milliseconds every Shotgun call takes."
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0.0,
+        help="Events created per second while the engine runs. By default, all of them "
+        "are created at once and the engine catches up with them.",
+    )
+    parser.add_argument(
+        "--dispatch-threads", type=int, default=0, help="Worker threads of the engine."
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=500, help="Maximum number of events fetched at once."
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600.0,
+        help="Seconds after which a scenario is stopped and the benchmark fails.",
+    )
+    args = parser.parse_args()
+
+    scenarios = dict((s.name, s) for s in SCENARIOS)
+    names = args.scenarios or [s.name for s in SCENARIOS]
+    for name in names:
+        if name not in scenarios:
+            parser.error("Unknown scenario %s." % name)
+
+    for name in names:
+        scenario = scenarios[name]()
+        try:
+            elapsed, metrics = runScenario(
+                scenario,
+                args.events,
+                args.latency / 1000.0,
+                args.rate,
+                args.dispatch_threads,
+                args.batch_size,
+                args.timeout,
+            )
+        except BenchmarkError as err:
+            print("%s: %s" % (scenario.name, err), file=sys.stderr)
+            return 1
+
+        print("%s: %s" % (scenario.name, scenario.description))
+        print("  %d events in %.2fs, %.1f events/s" % (args.events, elapsed, args.events / elapsed))
+        lag = metrics.eventLag
+        print(
+            "  lag: p50 %.3fs, p99 %.3fs, max %.3fs"
+            % (lag.getPercentile(0.5), lag.getPercentile(0.99), lag.getPercentile(1))
+        )
+        durations = metrics.callbackDuration
+        for labels in durations.getLabels():
+            print(
+                "  %s.%s: %d calls, p50 %.2fms, p99 %.2fms"
+                % (
+                    labels[0],
+                    labels[1],
+                    len(durations.getObserved(labels)),
+                    durations.getPercentile(0.5, labels) * 1000,
+                    durations.getPercentile(0.99, labels) * 1000,
+                )
+            )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""
+Watching and profiling of the callbacks processing events.
+"""
+
+import cProfile
+import fnmatch
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import traceback
+
+
+class CallbackWatchdog(object):
+    """
+    Watch for callbacks taking longer than their timeout to process an event.
+
+    The stack of the thread running an overdue callback is logged to the
+    plugin's log. When the callback_timeout_action is abandon, the callback
+    and its plugin are also deactivated. With worker threads, the engine also
+    stops waiting for the callback so other plugins keep making progress.
+    Without them, the main loop can only go on once the callback returns.
+    """
+
+    # Number of seconds between two checks.
+    INTERVAL = 1
+
+    def __init__(self, engine):
+        """
+        @param engine: The engine running the callbacks.
+        @type engine: L{Engine}
+        """
+        self._engine = engine
+        self._lock = threading.Lock()
+        self._watches = {}
+        self._nextWatchId = 0
+        self._thread = None
+        self._stopEvent = threading.Event()
+
+    def start(self):
+        """
+        Start checking on callbacks in the background.
+        """
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target=self._run, name="watchdog")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopEvent.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def watch(self, callback, event):
+        """
+        Start watching a callback processing an event on the current thread.
+
+        @param callback: The callback processing the event.
+        @type callback: L{Callback}
+        @param event: The Shotgun event being processed.
+        @type event: I{dict}
+
+        @return: What to hand to L{unwatch} once the callback is done, None
+            if the callback has no timeout.
+        """
+        timeout = callback.getTimeout()
+        if not timeout:
+            return None
+
+        with self._lock:
+            watchId = self._nextWatchId
+            self._nextWatchId += 1
+            self._watches[watchId] = (
+                threading.current_thread().ident,
+                callback,
+                event,
+                time.time() + timeout,
+            )
+        return watchId
+
+    def unwatch(self, watchId):
+        """
+        Stop watching a callback that is done processing an event.
+        """
+        if watchId is None:
+            return
+        with self._lock:
+            self._watches.pop(watchId, None)
+
+    def _run(self):
+        while not self._stopEvent.wait(self.INTERVAL):
+            try:
+                self._check()
+            except:
+                self._engine.log.exception("Error checking on callbacks.")
+
+    def _check(self):
+        now = time.time()
+        with self._lock:
+            overdue = [
+                self._watches.pop(watchId)
+                for watchId, (_, _, _, deadline) in list(self._watches.items())
+                if deadline <= now
+            ]
+
+        frames = sys._current_frames()
+        abandon = self._engine.settings.callbackTimeoutAction == "abandon"
+        for threadId, callback, event, deadline in overdue:
+            timeout = callback.getTimeout()
+            frame = frames.get(threadId)
+            if frame is None:
+                stack = "The thread is gone."
+            else:
+                stack = "".join(traceback.format_stack(frame))
+
+            msg = "Callback %s has been processing event %d for more than its %d second timeout.%s\n\n%s"
+            note = ""
+            if abandon:
+                callback.abandon()
+                dispatcher = self._engine._dispatcher
+                if dispatcher is not None and dispatcher.abandon(threadId):
+                    note = " Abandoning it and deactivating its plugin."
+                else:
+                    note = " Deactivating its plugin once it returns."
+            callback.getLogger().error(msg, callback.getFullName(), event["id"], timeout, note, stack)
+            self._engine.metrics.callbackTimeouts.inc(
+                (callback._plugin.getName(), callback._name)
+            )
+
+
+class CallbackProfiler(object):
+    """
+    Profile a sampled fraction of the invocations of chosen callbacks.
+
+    The profiles of a callback are aggregated and written to a pstats file in
+    the profiling path every profiling interval. Only the most recent files
+    of each callback are kept. The settings are read on every invocation so
+    profiling can be turned on and off by reloading the config.
+    """
+
+    def __init__(self, engine):
+        """
+        @param engine: The engine whose settings say what to profile.
+        @type engine: L{Engine}
+        """
+        self._engine = engine
+        self._lock = threading.Lock()
+        self._profileLock = threading.Lock()
+        self._stats = {}
+        self._lastDumpTimes = {}
+
+    def getProfiledName(self, callback):
+        """
+        Should this invocation of a callback be profiled?
+
+        @param callback: The callback about to be invoked.
+        @type callback: L{Callback}
+
+        @return: The name the callback is profiled under, or None if it should
+            not be profiled this time.
+        @rtype: I{str} or L{None}
+        """
+        settings = self._engine.settings
+        if not settings.profileCallbacks:
+            return None
+        if random.random() >= settings.profileSampleRate:
+            return None
+
+        name = callback.getFullName()
+        for pattern in settings.profileCallbacks:
+            if fnmatch.fnmatchcase(name, pattern):
+                return name
+        return None
+
+    def runcall(self, name, func, *args):
+        """
+        Call a function, profiling it under a name. If another call is being
+        profiled, the function is only called.
+
+        @param name: The name of the profiled callback.
+        @type name: I{str}
+        @param func: The function to call.
+        @type func: A callable.
+
+        @return: What the function returned.
+        """
+        # Only one profiler can be active at a time.
+        if not self._profileLock.acquire(False):
+            return func(*args)
+
+        try:
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(func, *args)
+            finally:
+                self._addStats(name, profile)
+        finally:
+            self._profileLock.release()
+
+    def _addStats(self, name, profile):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                self._stats[name] = pstats.Stats(profile)
+                self._lastDumpTimes.setdefault(name, time.time())
+            else:
+                stats.add(profile)
+
+        if time.time() - self._lastDumpTimes[name] >= self._engine.settings.profileInterval:
+            self.dumpStats(name)
+
+    def dumpStats(self, name=None):
+        """
+        Write the aggregated profiles to pstats files.
+
+        @param name: The name of the callback to write the profiles of. All
+            of them if None.
+        @type name: I{str}
+        """
+        with self._lock:
+            if name is None:
+                names = list(self._stats.keys())
+            else:
+                names = [name]
+            dumps = [(n, self._stats.pop(n)) for n in names if n in self._stats]
+            for n, _ in dumps:
+                self._lastDumpTimes[n] = time.time()
+
+        settings = self._engine.settings
+        for name, stats in dumps:
+            try:
+                if not os.path.isdir(settings.profilePath):
+                    os.makedirs(settings.profilePath)
+                path = os.path.join(
+                    settings.profilePath,
+                    "%s.%s.pstats" % (name, time.strftime("%Y%m%d-%H%M%S")),
+                )
+                stats.dump_stats(path)
+                self._removeOldDumps(name, settings)
+            except (IOError, OSError):
+                self._engine.log.exception("Could not write the profile of %s.", name)
+
+    def _removeOldDumps(self, name, settings):
+        prefix = name + "."
+        dumps = sorted(
+            basename
+            for basename in os.listdir(settings.profilePath)
+            if basename.startswith(prefix)
+            and basename.endswith(".pstats")
+            and basename[len(prefix):-len(".pstats")].replace("-", "").isdigit()
+        )
+        for basename in dumps[: -settings.profileBackupCount]:
+            os.remove(os.path.join(settings.profilePath, basename))
+
@@ -0,0 +1,29 @@
+"""
+The errors raised by the Shotgun event daemon.
+"""
+
+
+class EventDaemonError(Exception):
+    """
+    Base error for the Shotgun event system.
+    """
+
+    pass
+
+
+class ConfigError(EventDaemonError):
+    """
+    Used when an error is detected in the config file.
+    """
+
+    pass
+
+
+class ReplayError(EventDaemonError):
+    """
+    Used when a replayed callback makes a Shotgun call no response was
+    recorded for.
+    """
+
+    pass
+
@@ -0,0 +1,428 @@
+"""
+Metrics of the processing of events, in the Prometheus text format.
+"""
+
+import bisect
+import datetime
+import threading
+import time
+
+from six.moves import BaseHTTPServer
+
+
+class Metric(object):
+    """
+    A value, or one value per set of labels, exposed in the Prometheus text
+    format.
+    """
+
+    TYPE = None
+
+    def __init__(self, name, description, labelNames=()):
+        """
+        @param name: The name of the metric.
+        @type name: I{str}
+        @param description: What the metric measures.
+        @type description: I{str}
+        @param labelNames: The names of the labels the values are kept by.
+        @type labelNames: I{tuple} of I{str}
+        """
+        self.name = name
+        self._description = description
+        self._labelNames = labelNames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def render(self):
+        """
+        @return: The lines of the metric in the Prometheus text format.
+        @rtype: I{list} of I{str}
+        """
+        lines = [
+            "# HELP %s %s" % (self.name, self._description),
+            "# TYPE %s %s" % (self.name, self.TYPE),
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+            for labels, value in items:
+                lines.extend(self._renderValue(labels, value))
+        return lines
+
+    def getValue(self, labels=()):
+        """
+        @param labels: The label values to get the value for.
+        @type labels: I{tuple} of I{str}
+
+        @return: The value kept for the label values, None if there is none.
+        """
+        with self._lock:
+            return self._values.get(labels)
+
+    def _renderValue(self, labels, value):
+        return ["%s%s %s" % (self.name, self._formatLabels(labels), _formatNumber(value))]
+
+    def _formatLabels(self, labels, extra=()):
+        pairs = list(zip(self._labelNames, labels)) + list(extra)
+        if not pairs:
+            return ""
+        return "{%s}" % ",".join(
+            '%s="%s"' % (name, _escapeLabelValue(value)) for name, value in pairs
+        )
+
+
+class Counter(Metric):
+    """
+    A count that only goes up.
+    """
+
+    TYPE = "counter"
+
+    def inc(self, labels=(), amount=1):
+        """
+        @param labels: The label values to count for.
+        @type labels: I{tuple} of I{str}
+        @param amount: How much to add to the count.
+        @type amount: I{int}
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down.
+    """
+
+    TYPE = "gauge"
+
+    def set(self, value, labels=()):
+        """
+        @param value: The current value.
+        @type value: I{float}
+        @param labels: The label values to set the value for.
+        @type labels: I{tuple} of I{str}
+        """
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values in buckets.
+    """
+
+    TYPE = "histogram"
+
+    def __init__(self, name, description, buckets, labelNames=()):
+        """
+        @param buckets: The upper bounds of the buckets, in increasing order.
+        @type buckets: I{tuple} of I{float}
+
+        See L{Metric} for the other parameters.
+        """
+        super(Histogram, self).__init__(name, description, labelNames)
+        self._buckets = buckets
+
+    def observe(self, value, labels=()):
+        """
+        @param value: The observed value.
+        @type value: I{float}
+        @param labels: The label values to observe the value for.
+        @type labels: I{tuple} of I{str}
+        """
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # One count per bucket, +Inf, then the sum.
+                counts = self._values[labels] = [0] * (len(self._buckets) + 1) + [0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def _renderValue(self, labels, counts):
+        lines = []
+        total = 0
+        for bound, count in zip(self._buckets + (float("inf"),), counts):
+            total += count
+            if bound == float("inf"):
+                le = "+Inf"
+            else:
+                le = _formatNumber(bound)
+            lines.append(
+                "%s_bucket%s %d"
+                % (self.name, self._formatLabels(labels, [("le", le)]), total)
+            )
+        lines.append(
+            "%s_sum%s %s" % (self.name, self._formatLabels(labels), _formatNumber(counts[-1]))
+        )
+        lines.append("%s_count%s %d" % (self.name, self._formatLabels(labels), total))
+        return lines
+
+
+class RecordingHistogram(Histogram):
+    """
+    A histogram also keeping every observed value, for exact percentiles.
+
+    Only meant for runs of a bounded length, like replays and benchmarks.
+    """
+
+    def __init__(self, name, description, buckets, labelNames=()):
+        super(RecordingHistogram, self).__init__(name, description, buckets, labelNames)
+        self._observed = {}
+
+    def observe(self, value, labels=()):
+        super(RecordingHistogram, self).observe(value, labels)
+        with self._lock:
+            self._observed.setdefault(labels, []).append(value)
+
+    def getLabels(self):
+        """
+        @return: The label values values were observed for.
+        @rtype: I{list} of I{tuple}
+        """
+        with self._lock:
+            return sorted(self._observed)
+
+    def getObserved(self, labels=()):
+        """
+        @param labels: The label values to get the observed values for.
+        @type labels: I{tuple} of I{str}
+
+        @return: The observed values, in the order they were observed in.
+        @rtype: I{list} of I{float}
+        """
+        with self._lock:
+            return list(self._observed.get(labels, ()))
+
+    def getPercentile(self, fraction, labels=()):
+        """
+        @param fraction: The fraction, between 0 and 1, of the observed values
+            to find the upper bound of.
+        @type fraction: I{float}
+        @param labels: The label values to look at the observed values of.
+        @type labels: I{tuple} of I{str}
+
+        @return: The observed value that fraction of the values are lower than
+            or equal to, 0 if no value was observed.
+        @rtype: I{float}
+        """
+        values = sorted(self.getObserved(labels))
+        if not values:
+            return 0.0
+        return values[int(round(fraction * (len(values) - 1)))]
+
+
+def _formatNumber(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escapeLabelValue(value):
+    return (
+        str(value).replace("\\", "\\\\").replace("\"", '\\"').replace("\n", "\\n")
+    )
+
+
+class EngineMetrics(object):
+    """
+    The measurements the engine keeps about its processing of events.
+    """
+
+    PREFIX = "shotgun_event_daemon_"
+    DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    SIZE_BUCKETS = (0, 1, 10, 50, 100, 250, 500, 1000, 5000)
+    LAG_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 86400)
+
+    def __init__(self, histogramClass=Histogram):
+        """
+        @param histogramClass: The class of the histograms.
+        @type histogramClass: L{Histogram} or a subclass of it
+        """
+        self.callbackDuration = histogramClass(
+            self.PREFIX + "callback_duration_seconds",
+            "Time taken by a callback to process an event.",
+            self.DURATION_BUCKETS,
+            ("plugin", "callback"),
+        )
+        self.callbackErrors = Counter(
+            self.PREFIX + "callback_errors_total",
+            "Events a callback failed to process.",
+            ("plugin", "callback"),
+        )
+        self.callbackTimeouts = Counter(
+            self.PREFIX + "callback_timeouts_total",
+            "Events a callback took longer than its timeout to process.",
+            ("plugin", "callback"),
+        )
+        self.eventsDispatched = Counter(
+            self.PREFIX + "events_dispatched_total",
+            "Events handed to at least one callback of a plugin.",
+            ("plugin",),
+        )
+        self.eventsSkipped = Counter(
+            self.PREFIX + "events_skipped_total",
+            "Events no callback of a plugin was registered for.",
+            ("plugin",),
+        )
+        self.fetchDuration = histogramClass(
+            self.PREFIX + "fetch_duration_seconds",
+            "Time taken to fetch a batch of events from Shotgun.",
+            self.DURATION_BUCKETS,
+        )
+        self.fetchSize = histogramClass(
+            self.PREFIX + "fetch_size_events",
+            "Number of events in a batch fetched from Shotgun.",
+            self.SIZE_BUCKETS,
+        )
+        self.eventLag = histogramClass(
+            self.PREFIX + "event_lag_seconds",
+            "Time between the creation of an event and the end of its processing.",
+            self.LAG_BUCKETS,
+        )
+        self.lastEventLag = Gauge(
+            self.PREFIX + "last_event_lag_seconds",
+            "Time between the creation of the last processed event and the end of its processing.",
+        )
+        self.lastEventId = Gauge(
+            self.PREFIX + "last_event_id",
+            "Id of the last processed event.",
+        )
+        self.shotgunCalls = Counter(
+            self.PREFIX + "sg_calls_total",
+            "Shotgun API calls made by a callback.",
+            ("plugin", "callback", "method"),
+        )
+        self.shotgunCallSeconds = Counter(
+            self.PREFIX + "sg_call_seconds_total",
+            "Time spent in Shotgun API calls made by a callback.",
+            ("plugin", "callback", "method"),
+        )
+        self.shotgunRecords = Counter(
+            self.PREFIX + "sg_records_total",
+            "Records returned by Shotgun API calls made by a callback.",
+            ("plugin", "callback", "method"),
+        )
+
+    def observeEventLag(self, event):
+        """
+        Account for an event all the plugins are done with.
+
+        @param event: The processed Shotgun event.
+        @type event: I{dict}
+        """
+        createdAt = event["created_at"]
+        lag = datetime.datetime.now(createdAt.tzinfo) - createdAt
+        lag = lag.total_seconds()
+        self.eventLag.observe(lag)
+        self.lastEventLag.set(lag)
+        self.lastEventId.set(event["id"])
+
+    def observeShotgunCalls(self, labels, calls):
+        """
+        Account for the Shotgun calls a callback made processing an event.
+
+        @param labels: The plugin and callback names.
+        @type labels: I{tuple} of I{str}
+        @param calls: The calls as returned by L{AccountedShotgun.getCalls}.
+        @type calls: I{dict}
+        """
+        for method, (count, seconds, records) in calls.items():
+            methodLabels = labels + (method,)
+            self.shotgunCalls.inc(methodLabels, count)
+            self.shotgunCallSeconds.inc(methodLabels, seconds)
+            self.shotgunRecords.inc(methodLabels, records)
+
+    def render(self):
+        """
+        @return: Every metric in the Prometheus text format.
+        @rtype: I{str}
+        """
+        lines = []
+        for metric in (
+            self.callbackDuration,
+            self.callbackErrors,
+            self.callbackTimeouts,
+            self.eventsDispatched,
+            self.eventsSkipped,
+            self.fetchDuration,
+            self.fetchSize,
+            self.eventLag,
+            self.lastEventLag,
+            self.lastEventId,
+            self.shotgunCalls,
+            self.shotgunCallSeconds,
+            self.shotgunRecords,
+        ):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class ReplayMetrics(EngineMetrics):
+    """
+    The metrics of a L{ReplayEngine}, keeping every observed value.
+
+    The lag of an event is measured from the time it was replayed at rather
+    than from its creation in Shotgun.
+    """
+
+    def __init__(self, releaseTimes):
+        """
+        @param releaseTimes: The times events were replayed at, keyed by id.
+        @type releaseTimes: I{dict}
+        """
+        super(ReplayMetrics, self).__init__(RecordingHistogram)
+        self._releaseTimes = releaseTimes
+
+    def observeEventLag(self, event):
+        lag = time.time() - self._releaseTimes.pop(event["id"])
+        self.eventLag.observe(lag)
+        self.lastEventLag.set(lag)
+        self.lastEventId.set(event["id"])
+
+
+class MetricsServer(object):
+    """
+    Serve metrics in the Prometheus text format over HTTP from a background
+    thread.
+    """
+
+    def __init__(self, metrics, address, port):
+        """
+        @param metrics: The metrics to serve.
+        @type metrics: L{EngineMetrics}
+        @param address: The address to listen on.
+        @type address: I{str}
+        @param port: The port to listen on.
+        @type port: I{int}
+
+        @raise socket.error: If the address can't be listened on.
+        """
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = BaseHTTPServer.HTTPServer((address, port), Handler)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="metrics-server"
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
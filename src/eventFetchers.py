@@ -0,0 +1,246 @@
+"""
+Fetching of event pages on background threads.
+"""
+
+import threading
+
+from six.moves import queue
+
+
+class EventPrefetcher(object):
+    """
+    Fetch the next pages of new events on a background thread while the
+    current one is processed.
+
+    Pages are fetched one after the other, as long as they are full, until
+    the look-ahead queue is full. Pages are only handed out for the exact
+    query they were fetched for, anything else cancels the prefetching.
+    """
+
+    def __init__(self, engine, shotgun, depth):
+        """
+        @param engine: The engine the events are fetched for.
+        @type engine: L{Engine}
+        @param shotgun: The connection used to fetch events.
+        @type shotgun: L{sg.Shotgun}
+        @param depth: The maximum number of pages fetched ahead.
+        @type depth: I{int}
+        """
+        self._engine = engine
+        self._shotgun = shotgun
+        self._queue = queue.Queue(depth)
+        self._generation = 0
+        self._thread = None
+        self._query = None
+        self._nextStartId = None
+
+    def prefetch(self, startId, eventFilters, fields, limit):
+        """
+        Start fetching the pages of events following an id unless they are
+        already being fetched.
+
+        @param startId: The id of the first event to fetch.
+        @type startId: I{int}
+        @param eventFilters: The filters applied to events on top of the ids.
+        @type eventFilters: I{list}
+        @param fields: The fields to fetch.
+        @type fields: I{list} of I{str}
+        @param limit: The number of events per page.
+        @type limit: I{int}
+        """
+        query = (eventFilters, fields, limit)
+        if (
+            self._thread is not None
+            and self._query == query
+            and self._nextStartId == startId
+        ):
+            return
+
+        self.cancel()
+        self._query = query
+        self._nextStartId = startId
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(self._generation, startId, eventFilters, fields, limit),
+            name="prefetcher",
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def take(self, startId, eventFilters, fields, limit):
+        """
+        Get the prefetched page of events starting at an id, waiting for it
+        if it is still being fetched.
+
+        @param startId: The id of the first event of the page.
+        @type startId: I{int}
+        @param eventFilters: The filters applied to events on top of the ids.
+        @type eventFilters: I{list}
+        @param fields: The fields to fetch.
+        @type fields: I{list} of I{str}
+        @param limit: The number of events per page.
+        @type limit: I{int}
+
+        @return: The page of events or None if it wasn't prefetched.
+        @rtype: I{list} of Shotgun event dictionaries or L{None}
+        """
+        if (
+            self._thread is None
+            or self._query != (eventFilters, fields, limit)
+            or self._nextStartId != startId
+        ):
+            self.cancel()
+            return None
+
+        while True:
+            try:
+                generation, pageStartId, events = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if not self._thread.is_alive() and self._queue.empty():
+                    self.cancel()
+                    return None
+                continue
+
+            if generation != self._generation:
+                continue
+            if pageStartId != startId:
+                self.cancel()
+                return None
+
+            if events:
+                self._nextStartId = events[-1]["id"] + 1
+            else:
+                self._nextStartId = None
+            return events
+
+    def cancel(self):
+        """
+        Stop prefetching and drop the pages fetched so far.
+        """
+        self._generation += 1
+        self._thread = None
+        self._query = None
+        self._nextStartId = None
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def _run(self, generation, startId, eventFilters, fields, limit):
+        while generation == self._generation:
+            events = self._engine._findEvents(
+                [["id", "greater_than", startId - 1]] + eventFilters,
+                fields,
+                limit,
+                self._shotgun,
+            )
+
+            while generation == self._generation:
+                try:
+                    self._queue.put((generation, startId, events), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+            if len(events) < limit:
+                return
+            startId = events[-1]["id"] + 1
+
+
+class EventRangeFetcher(object):
+    """
+    Fetch the events of an id range in chunks, on several threads with their
+    own connections, and hand the chunks out in order.
+
+    At most twice as many chunks as there are threads are fetched ahead of
+    the ones handed out.
+    """
+
+    def __init__(self, engine, fromId, toId, chunkSize, numThreads):
+        """
+        @param engine: The engine the events are fetched for.
+        @type engine: L{Engine}
+        @param fromId: The id of the first event of the range.
+        @type fromId: I{int}
+        @param toId: The id of the last event of the range.
+        @type toId: I{int}
+        @param chunkSize: The number of event ids in each chunk.
+        @type chunkSize: I{int}
+        @param numThreads: The number of threads fetching chunks.
+        @type numThreads: I{int}
+        """
+        self._engine = engine
+        self._chunks = [
+            (startId, min(startId + chunkSize - 1, toId))
+            for startId in range(fromId, toId + 1, chunkSize)
+        ]
+        self._numThreads = min(numThreads, len(self._chunks))
+        self._condition = threading.Condition()
+        self._slots = threading.Semaphore(2 * numThreads)
+        self._fetched = {}
+        self._nextFetchIndex = 0
+        self._nextTakeIndex = 0
+        self._cancelled = False
+
+    def start(self, eventFilters, fields):
+        """
+        @param eventFilters: The filters to add to the event queries.
+        @type eventFilters: I{list}
+        @param fields: The fields to fetch.
+        @type fields: I{list} of I{str}
+        """
+        for index in range(self._numThreads):
+            thread = threading.Thread(
+                target=self._run,
+                args=(self._engine._createShotgun(), eventFilters, fields),
+                name="EventRangeFetcher-%d" % index,
+            )
+            thread.daemon = True
+            thread.start()
+
+    def take(self):
+        """
+        Wait for the next chunk to be fetched.
+
+        @return: The events of the chunk, sorted by id, or None once every
+            chunk was handed out.
+        @rtype: I{list} of Shotgun event dictionaries.
+        """
+        with self._condition:
+            if self._nextTakeIndex >= len(self._chunks):
+                return None
+            while self._nextTakeIndex not in self._fetched:
+                self._condition.wait()
+            events = self._fetched.pop(self._nextTakeIndex)
+            self._nextTakeIndex += 1
+        self._slots.release()
+        return events
+
+    def cancel(self):
+        """
+        Make the threads stop once done with the chunks they are fetching.
+        """
+        with self._condition:
+            self._cancelled = True
+        for _ in range(self._numThreads):
+            self._slots.release()
+
+    def _run(self, shotgun, eventFilters, fields):
+        while True:
+            self._slots.acquire()
+            with self._condition:
+                if self._cancelled or self._nextFetchIndex >= len(self._chunks):
+                    return
+                index = self._nextFetchIndex
+                self._nextFetchIndex += 1
+
+            events = self._engine._findEvents(
+                [["id", "between", list(self._chunks[index])]] + eventFilters,
+                fields,
+                shotgun=shotgun,
+            )
+            with self._condition:
+                self._fetched[index] = events
+                self._condition.notify_all()
+
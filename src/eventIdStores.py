@@ -0,0 +1,444 @@
+"""
+The last processed event ids of the plugins, their backlog of events yet to
+show up, and the files they are kept in.
+"""
+
+import bisect
+import heapq
+import os
+import sys
+
+import six.moves.cPickle as pickle
+
+
+def _dumpPickleAtomically(obj, path):
+    """
+    Pickle an object to a file without ever leaving a partially written file
+    behind.
+
+    The data is written and synced to a temporary file next to the target
+    which is then renamed over it.
+
+    @param obj: The object to pickle.
+    @type obj: Any picklable object.
+    @param path: The path of the file to write.
+    @type path: I{str}
+    """
+    _dumpPicklesAtomically([obj], path)
+
+
+def _dumpPicklesAtomically(objs, path):
+    """
+    Pickle objects one after the other to a file, like
+    L{_dumpPickleAtomically}.
+
+    @param objs: The objects to pickle.
+    @type objs: I{list}
+    @param path: The path of the file to write.
+    @type path: I{str}
+    """
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "wb") as fh:
+        # Use protocol 2 so it can also be loaded in Python 2
+        for obj in objs:
+            pickle.dump(obj, fh, protocol=2)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+    if hasattr(os, "replace"):
+        os.replace(tmpPath, path)
+    else:
+        if sys.platform == "win32" and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmpPath, path)
+
+    # Make sure the rename itself is on disk.
+    if sys.platform != "win32":
+        dirFd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dirFd)
+        finally:
+            os.close(dirFd)
+
+
+class PickleEventIdStore(object):
+    """
+    Keeps the event id data in a single pickle file, rewritten on every save.
+    """
+
+    def __init__(self, path, logger):
+        """
+        @param path: The path of the event id file.
+        @type path: I{str}
+        @param logger: The logger to report problems to.
+        @type logger: A logging.Logger instance
+        """
+        self.path = path
+        self.log = logger
+
+    def load(self):
+        """
+        Load the event id data. A file written by L{JournalEventIdStore} is
+        read through it, the next save rewrites it as a single pickle.
+
+        @return: The state of every plugin collection keyed by path.
+        @rtype: I{dict}
+
+        @raise pickle.UnpicklingError: If the file isn't a pickle.
+        """
+        with open(self.path, "rb") as fh:
+            data = pickle.load(fh)
+        if data == JournalEventIdStore.HEADER:
+            self.log.info("Reading the event id journal %s.", self.path)
+            return JournalEventIdStore(self.path, self.log).load()
+        return data
+
+    def save(self, data):
+        """
+        Save the event id data.
+
+        @param data: The state of every plugin collection keyed by path.
+        @type data: I{dict}
+        """
+        _dumpPickleAtomically(data, self.path)
+
+
+class JournalEventIdStore(PickleEventIdStore):
+    """
+    Keeps the event id data in an append-only journal.
+
+    The journal starts with a header and a pickled snapshot of the data. Each
+    save appends a record for every plugin whose last event id changed, whose
+    backlog ranges were added or removed, or which was removed. Once enough
+    records were appended, the journal is compacted back into a single
+    snapshot.
+
+    Files in any other format, like the ones of L{PickleEventIdStore}, are
+    read as is and rewritten as a journal on the first save rather than
+    appended to.
+    """
+
+    # The first pickle of a journal file.
+    HEADER = ("shotgunEvents journal", 1)
+
+    def __init__(self, path, logger, compaction=10000):
+        """
+        @param path: The path of the journal file.
+        @type path: I{str}
+        @param logger: The logger to report problems to.
+        @type logger: A logging.Logger instance
+        @param compaction: The number of records after which the journal is
+            compacted.
+        @type compaction: I{int}
+        """
+        super(JournalEventIdStore, self).__init__(path, logger)
+        self._compaction = compaction
+        self._numRecords = 0
+        self._written = {}
+        self._isJournal = False
+        self._fh = None
+
+    def load(self):
+        """
+        Load the event id data by replaying the journal over its snapshot.
+
+        A record left partially written by a crash is dropped.
+
+        @return: The state of every plugin collection keyed by path.
+        @rtype: I{dict}
+
+        @raise pickle.UnpicklingError: If the file isn't a pickle.
+        """
+        self._close()
+        self._numRecords = 0
+
+        with open(self.path, "rb") as fh:
+            data = pickle.load(fh)
+            self._isJournal = data == self.HEADER
+            if self._isJournal:
+                data = pickle.load(fh)
+            goodOffset = fh.tell()
+            while True:
+                try:
+                    record = pickle.load(fh)
+                except EOFError:
+                    break
+                except Exception:
+                    self.log.warning(
+                        "Dropping a partially written record at the end of %s.",
+                        self.path,
+                    )
+                    break
+                self._applyRecord(data, record)
+                self._numRecords += 1
+                goodOffset = fh.tell()
+
+        if self._isJournal and os.path.getsize(self.path) != goodOffset:
+            with open(self.path, "r+b") as fh:
+                fh.truncate(goodOffset)
+
+        self._written = self._copyData(data)
+        return data
+
+    def save(self, data):
+        """
+        Append the changes made to the event id data since the last save.
+
+        @param data: The state of every plugin collection keyed by path.
+        @type data: I{dict}
+        """
+        if not self._isJournal:
+            # Never append to a file that isn't a journal.
+            self._compact(data)
+            return
+
+        records = []
+        for colPath, colState in data.items():
+            written = self._written.setdefault(colPath, {})
+            for pluginName, pluginState in colState.items():
+                lastEventId, backlog = self._splitState(pluginState)
+                oldLastEventId, oldBacklog = self._splitState(
+                    written.get(pluginName)
+                )
+                if lastEventId != oldLastEventId:
+                    records.append(("cursor", colPath, pluginName, lastEventId))
+                if backlog != oldBacklog:
+                    oldRanges = set(oldBacklog)
+                    ranges = set(backlog)
+                    records.append(
+                        (
+                            "backlog-delta",
+                            colPath,
+                            pluginName,
+                            sorted(oldRanges - ranges),
+                            sorted(ranges - oldRanges),
+                        )
+                    )
+                written[pluginName] = (lastEventId, backlog)
+
+        for colPath in list(self._written):
+            written = self._written[colPath]
+            colState = data.get(colPath, {})
+            for pluginName in sorted(set(written) - set(colState)):
+                records.append(("remove", colPath, pluginName))
+                del written[pluginName]
+            if colPath not in data:
+                del self._written[colPath]
+
+        if not records:
+            return
+
+        if self._numRecords + len(records) > self._compaction:
+            self._compact(data)
+            return
+
+        if self._fh is None:
+            self._fh = open(self.path, "ab")
+        for record in records:
+            pickle.dump(record, self._fh, protocol=2)
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._numRecords += len(records)
+
+    def _compact(self, data):
+        self._close()
+        _dumpPicklesAtomically([self.HEADER, data], self.path)
+        self._numRecords = 0
+        self._written = self._copyData(data)
+        self._isJournal = True
+
+    def _close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def _applyRecord(self, data, record):
+        recordType, colPath, pluginName = record[:3]
+        colState = data.setdefault(colPath, {})
+        lastEventId, backlog = self._splitState(colState.get(pluginName))
+        if recordType == "cursor":
+            colState[pluginName] = (record[3], backlog)
+        elif recordType == "backlog":
+            # Whole backlogs, as written by earlier versions.
+            colState[pluginName] = (lastEventId, record[3])
+        elif recordType == "backlog-delta":
+            ranges = set(backlog)
+            ranges.difference_update(record[3])
+            ranges.update(record[4])
+            colState[pluginName] = (lastEventId, sorted(ranges))
+        elif recordType == "remove":
+            colState.pop(pluginName, None)
+            if not colState:
+                del data[colPath]
+        else:
+            raise ValueError("Unknown journal record type: %s." % recordType)
+
+    def _copyData(self, data):
+        copy = {}
+        for colPath, colState in data.items():
+            copy[colPath] = {}
+            for pluginName, pluginState in colState.items():
+                copy[colPath][pluginName] = self._splitState(pluginState)
+        return copy
+
+    def _splitState(self, state):
+        if isinstance(state, tuple):
+            lastEventId, backlog = state
+        else:
+            lastEventId, backlog = state, None
+        return (lastEventId, EventIdBacklog.toState(backlog))
+
+
+class EventIdBacklog(object):
+    """
+    The ids of events a plugin is still waiting for, each with the time after
+    which it is considered the event will never show up.
+
+    Ids are kept as a sorted list of inclusive ranges sharing an expiration
+    so memory doesn't grow with the number of missing ids, and a heap of
+    expirations lets expired ranges be dropped without scanning them all.
+    """
+
+    def __init__(self, state=None):
+        """
+        @param state: A backlog as returned by L{getState} or, for backwards
+            compatibility, a I{dict} of expirations keyed by event id.
+        @type state: I{list} or I{dict}
+        """
+        self._starts = []
+        self._ranges = []
+        self._expirations = []
+
+        for start, end, expiration in self.toState(state):
+            self.add(start, end, expiration)
+
+    @staticmethod
+    def toState(backlog):
+        """
+        Convert any backlog representation to the one returned by
+        L{getState}.
+
+        @param backlog: A backlog as returned by L{getState}, a I{dict} of
+            expirations keyed by event id or None.
+        @type backlog: I{list}, I{dict} or L{None}
+
+        @return: The backlog as (first id, last id, expiration) ranges.
+        @rtype: I{list} of I{tuple}
+        """
+        if not backlog:
+            return []
+        if not isinstance(backlog, dict):
+            return backlog
+
+        ranges = []
+        for eventId in sorted(backlog):
+            expiration = backlog[eventId]
+            if ranges and ranges[-1][1] == eventId - 1 and ranges[-1][2] == expiration:
+                ranges[-1] = (ranges[-1][0], eventId, expiration)
+            else:
+                ranges.append((eventId, eventId, expiration))
+        return ranges
+
+    @staticmethod
+    def mergeRanges(ranges):
+        """
+        Merge overlapping and adjacent id ranges.
+
+        @param ranges: Inclusive (first id, last id) ranges.
+        @type ranges: I{list} of I{tuple}
+
+        @return: The merged ranges, sorted.
+        @rtype: I{list} of I{tuple}
+        """
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+            else:
+                merged.append((start, end))
+        return merged
+
+    def add(self, start, end, expiration):
+        """
+        Add a range of ids not already in the backlog.
+
+        @param start: The first id of the range.
+        @type start: I{int}
+        @param end: The last id of the range.
+        @type end: I{int}
+        @param expiration: When to give up on the range.
+        @type expiration: L{datetime.datetime}
+        """
+        index = bisect.bisect_left(self._starts, start)
+        self._starts.insert(index, start)
+        self._ranges.insert(index, (start, end, expiration))
+        heapq.heappush(self._expirations, (expiration, start))
+
+    def remove(self, eventId):
+        """
+        Remove an id from the backlog, splitting its range if needed.
+
+        @param eventId: The id to remove.
+        @type eventId: I{int}
+        """
+        index = self._find(eventId)
+        if index is None:
+            return
+
+        start, end, expiration = self._ranges[index]
+        del self._starts[index]
+        del self._ranges[index]
+        if start < eventId:
+            self._starts.insert(index, start)
+            self._ranges.insert(index, (start, eventId - 1, expiration))
+            index += 1
+        if eventId < end:
+            self._starts.insert(index, eventId + 1)
+            self._ranges.insert(index, (eventId + 1, end, expiration))
+            heapq.heappush(self._expirations, (expiration, eventId + 1))
+
+    def expire(self, now):
+        """
+        Drop the ranges whose expiration is past.
+
+        @param now: The current time.
+        @type now: L{datetime.datetime}
+        """
+        while self._expirations and self._expirations[0][0] < now:
+            expiration, start = heapq.heappop(self._expirations)
+            index = bisect.bisect_left(self._starts, start)
+            # Ranges removed or split since they were added leave stale
+            # entries behind.
+            if index < len(self._starts) and self._starts[index] == start:
+                if self._ranges[index][2] == expiration:
+                    del self._starts[index]
+                    del self._ranges[index]
+
+    def getRanges(self):
+        """
+        @return: The ids in the backlog as inclusive (first id, last id)
+            ranges, sorted.
+        @rtype: I{list} of I{tuple}
+        """
+        return [(start, end) for start, end, expiration in self._ranges]
+
+    def getState(self):
+        """
+        @return: The backlog as (first id, last id, expiration) ranges, in a
+            form that can be pickled.
+        @rtype: I{list} of I{tuple}
+        """
+        return list(self._ranges)
+
+    def _find(self, eventId):
+        index = bisect.bisect_right(self._starts, eventId) - 1
+        if index >= 0 and self._ranges[index][1] >= eventId:
+            return index
+        return None
+
+    def __contains__(self, eventId):
+        return self._find(eventId) is not None
+
+    def __len__(self):
+        return len(self._ranges)
+
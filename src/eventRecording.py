@@ -0,0 +1,288 @@
+"""
+Recording of the events processed and of the Shotgun responses
+callbacks get, and their replay.
+"""
+
+import copy
+import gzip
+import json
+import threading
+
+import six.moves.cPickle as pickle
+import shotgun_api3 as sg
+
+from daemonErrors import ReplayError
+from shotgunConnections import AccountedShotgun
+
+
+def _getCallKey(method, args, kwargs):
+    """
+    Identify a Shotgun API call by its method and arguments.
+
+    @return: The same key for calls with the same method and arguments.
+    @rtype: I{str}
+    """
+    return json.dumps([method, args, kwargs], sort_keys=True, default=str)
+
+
+class RecordingShotgun(object):
+    """
+    Wrap a Shotgun instance to record the responses to the calls made through
+    it while processing an event.
+    """
+
+    def __init__(self, shotgun, recorder, eventId):
+        """
+        @param shotgun: The Shotgun instance to record the responses of.
+        @type shotgun: L{sg.Shotgun}
+        @param recorder: The recorder to record the responses with.
+        @type recorder: L{EventRecorder}
+        @param eventId: The id of the event processed.
+        @type eventId: I{int}
+        """
+        self.__dict__["_shotgun"] = shotgun
+        self.__dict__["_recorder"] = recorder
+        self.__dict__["_eventId"] = eventId
+
+    def __getattr__(self, name):
+        attribute = getattr(self._shotgun, name)
+        if (
+            name.startswith("_")
+            or name in AccountedShotgun.UNACCOUNTED_METHODS
+            or not callable(attribute)
+        ):
+            return attribute
+
+        def recordedMethod(*args, **kwargs):
+            key = _getCallKey(name, args, kwargs)
+            try:
+                result = attribute(*args, **kwargs)
+            except Exception as err:
+                self._recorder.recordCall(self._eventId, key, None, err)
+                raise
+            self._recorder.recordCall(self._eventId, key, result, None)
+            return result
+
+        return recordedMethod
+
+    def __setattr__(self, name, value):
+        setattr(self._shotgun, name, value)
+
+
+class EventRecorder(object):
+    """
+    Append the events the engine fetches, and the Shotgun responses the
+    callbacks get processing them, to a gzip compressed journal for
+    L{ReplayEngine} to replay.
+
+    Every record is pickled on its own so a journal left partially written by
+    a crash can be read up to its last complete record. Recording again to an
+    existing journal appends to it.
+    """
+
+    def __init__(self, path, logger):
+        """
+        @param path: The path of the journal file.
+        @type path: I{str}
+        @param logger: The logger to report problems to.
+        @type logger: A logging.Logger instance
+        """
+        self.path = path
+        self.log = logger
+        self._lock = threading.Lock()
+        self._fh = None
+
+    def recordEvents(self, events):
+        """
+        @param events: Events fetched from Shotgun.
+        @type events: I{list} of Shotgun event dictionaries.
+        """
+        self._write(("events", events))
+
+    def recordCall(self, eventId, key, result, error):
+        """
+        @param eventId: The id of the event processed when the call was made.
+        @type eventId: I{int}
+        @param key: The method and arguments of the call, see
+            L{_getCallKey}.
+        @type key: I{str}
+        @param result: What the call returned.
+        @type result: Any picklable object.
+        @param error: What the call raised, None if it returned.
+        @type error: I{Exception}
+        """
+        if error is not None:
+            try:
+                pickle.dumps(error, protocol=2)
+            except Exception:
+                error = sg.ShotgunError("%s: %s" % (type(error).__name__, error))
+        self._write(("call", eventId, key, result, error))
+
+    def flush(self):
+        """
+        Make the records written so far readable, even if the daemon dies.
+        """
+        with self._lock:
+            if self._fh is not None:
+                self._fh.flush()
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+    def _write(self, record):
+        try:
+            # Pickle first so a record that can't be pickled isn't partially
+            # written.
+            data = pickle.dumps(record, protocol=2)
+            with self._lock:
+                if self._fh is None:
+                    self._fh = gzip.open(self.path, "ab")
+                self._fh.write(data)
+        except Exception as err:
+            self.log.error("Could not record to %s. %s", self.path, err)
+
+
+def _readEventJournal(path, logger):
+    """
+    Read a journal written by an L{EventRecorder}.
+
+    @param path: The path of the journal file.
+    @type path: I{str}
+    @param logger: The logger to report problems to.
+    @type logger: A logging.Logger instance
+
+    @return: The recorded events, sorted by id, and the recorded responses.
+    @rtype: I{tuple} of I{list} and L{RecordedResponses}
+    """
+    events = {}
+    responses = RecordedResponses()
+    with gzip.open(path, "rb") as fh:
+        while True:
+            try:
+                record = pickle.load(fh)
+            except EOFError:
+                break
+            except Exception:
+                logger.warning(
+                    "Dropping a partially written record at the end of %s.", path
+                )
+                break
+
+            if record[0] == "events":
+                for event in record[1]:
+                    events[event["id"]] = event
+            elif record[0] == "call":
+                responses.add(*record[1:])
+            else:
+                raise ValueError("Unknown journal record type: %s." % record[0])
+
+    return [events[eventId] for eventId in sorted(events)], responses
+
+
+class RecordedResponses(object):
+    """
+    The Shotgun responses recorded by an L{EventRecorder}, by event and call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._responses = {}
+        self._missing = 0
+
+    def add(self, eventId, key, result, error):
+        """
+        See L{EventRecorder.recordCall}.
+        """
+        self._responses.setdefault((eventId, key), []).append((result, error))
+
+    def take(self, eventId, key):
+        """
+        Get the response to a call made processing an event.
+
+        Responses to the same call are handed out in the order they were
+        recorded in, the last one is handed out again once they all were.
+
+        @param eventId: The id of the event processed.
+        @type eventId: I{int}
+        @param key: The method and arguments of the call, see
+            L{_getCallKey}.
+        @type key: I{str}
+
+        @return: A copy of what the call returned.
+
+        @raise ReplayError: If no response to the call was recorded.
+        @raise Exception: What the call raised, if it did.
+        """
+        with self._lock:
+            responses = self._responses.get((eventId, key))
+            if not responses:
+                self._missing += 1
+                raise ReplayError(
+                    "No response was recorded for %s processing event %d."
+                    % (key, eventId)
+                )
+            if len(responses) > 1:
+                result, error = responses.pop(0)
+            else:
+                result, error = responses[0]
+
+        if error is not None:
+            raise error
+        return copy.deepcopy(result)
+
+    def getMissingCount(self):
+        """
+        @return: The number of calls no response was recorded for.
+        @rtype: I{int}
+        """
+        with self._lock:
+            return self._missing
+
+
+class ReplayShotgun(object):
+    """
+    Stand in for a Shotgun instance answering calls with the responses
+    recorded while processing an event. No request is sent to Shotgun.
+    """
+
+    def __init__(self, responses, eventId):
+        """
+        @param responses: The recorded responses.
+        @type responses: L{RecordedResponses}
+        @param eventId: The id of the event processed.
+        @type eventId: I{int}
+        """
+        self._responses = responses
+        self._eventId = eventId
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        if name in AccountedShotgun.UNACCOUNTED_METHODS:
+            return lambda *args, **kwargs: None
+
+        def replayedMethod(*args, **kwargs):
+            return self._responses.take(self._eventId, _getCallKey(name, args, kwargs))
+
+        return replayedMethod
+
+
+class ReplayShotgunPool(object):
+    """
+    Stand in for the L{ShotgunPool} of a L{ReplayEngine}, no connection is
+    ever made.
+    """
+
+    def acquire(self, scriptName, scriptKey):
+        return None
+
+    def release(self, shotgun, scriptName, scriptKey):
+        pass
+
+    def retain(self, credentials):
+        pass
+
@@ -0,0 +1,706 @@
+"""
+Log handlers handing records over to background threads, and the log
+record arguments rendered there.
+"""
+
+import abc
+import collections
+import copy
+import datetime
+import itertools
+import logging
+import logging.handlers
+import smtplib
+import socket
+import threading
+import time
+import traceback
+
+import six
+from six.moves import queue
+from six.moves import reprlib
+
+try:
+    from sentry_sdk.integrations.logging import BreadcrumbHandler, EventHandler
+except ImportError:
+    BreadcrumbHandler = EventHandler = None
+
+
+@six.add_metaclass(abc.ABCMeta)
+class DeferredText(object):
+    """
+    Text rendered from an immutable snapshot the first time it is turned into
+    a string, by whichever thread formats the log record it's an argument of.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._text = None
+
+    def __str__(self):
+        with self._lock:
+            if self._text is None:
+                self._text = self._render()
+            return self._text
+
+    __repr__ = __str__
+
+    @abc.abstractmethod
+    def _render(self):
+        """
+        @return: The text.
+        @rtype: I{str}
+        """
+
+
+class _ReprText(str):
+    """
+    A representation computed ahead of time, returned as is by repr.
+    """
+
+    def __repr__(self):
+        return self
+
+
+class FrameLocals(DeferredText):
+    """
+    The local variables of a frame.
+
+    Plugins can hold huge data structures in their variables so their
+    representation is limited in depth, in number of items and in size.
+    Only the part of the variables that can be represented is copied when
+    the frame is captured, values changed afterwards are left out.
+    """
+
+    # Maximum number of characters of the formatted variables.
+    MAX_LENGTH = 20000
+
+    # Maximum depth of the containers represented.
+    MAX_LEVEL = 4
+
+    # Maximum number of items represented per container.
+    MAX_ITEMS = 20
+
+    # Maximum number of characters represented per string or other object.
+    MAX_OTHER = 500
+
+    def __init__(self, frame):
+        """
+        @param frame: The frame to get the local variables of.
+        @type frame: I{frame}
+        """
+        DeferredText.__init__(self)
+        self._repr = reprlib.Repr()
+        self._repr.maxlevel = self.MAX_LEVEL
+        self._repr.maxdict = self._repr.maxlist = self._repr.maxtuple = self.MAX_ITEMS
+        self._repr.maxset = self._repr.maxfrozenset = self.MAX_ITEMS
+        self._repr.maxdeque = self.MAX_ITEMS
+        self._repr.maxstring = self._repr.maxother = self.MAX_OTHER
+
+        # Every represented value takes at least a character.
+        self._budget = self.MAX_LENGTH
+        self._locals = []
+        for name in sorted(frame.f_locals):
+            if self._budget <= 0:
+                break
+            self._locals.append(
+                (name, self._snapshot(frame.f_locals[name], self.MAX_LEVEL))
+            )
+
+    def _snapshot(self, value, level):
+        """
+        Copy what the representation of a value shows.
+
+        @param value: The value to copy.
+        @param level: The remaining depth of containers represented.
+        @type level: I{int}
+
+        @return: The value itself if it can't change, a copy of the items of
+            a container represented, the representation of any other value.
+        """
+        self._budget -= 1
+        if isinstance(value, IMMUTABLE_LOG_ARG_TYPES):
+            return value
+
+        if isinstance(value, (dict, list, tuple, set, frozenset, collections.deque)):
+            if level <= 0 or self._budget <= 0:
+                return _ReprText(self._repr.repr1(value, 0))
+            if isinstance(value, dict):
+                return dict(
+                    (key, self._snapshot(item, level - 1))
+                    for key, item in itertools.islice(value.items(), self.MAX_ITEMS + 1)
+                )
+            items = [
+                self._snapshot(item, level - 1)
+                for item in itertools.islice(value, self.MAX_ITEMS + 1)
+            ]
+            if isinstance(value, list):
+                return items
+            if isinstance(value, tuple):
+                return tuple(items)
+            if isinstance(value, collections.deque):
+                return collections.deque(items)
+            if isinstance(value, frozenset):
+                return frozenset(items)
+            return set(items)
+
+        try:
+            return _ReprText(self._repr.repr(value))
+        except Exception:
+            return _ReprText("<unrepresentable %s>" % type(value).__name__)
+
+    def _render(self):
+        lines = ["{"]
+        length = 0
+        for name, value in self._locals:
+            line = " %r: %s," % (name, self._repr.repr(value))
+            length += len(line)
+            if length > self.MAX_LENGTH:
+                lines.append(" ...")
+                break
+            lines.append(line)
+        lines.append("}")
+
+        self._locals = None
+        return "\n".join(lines)
+
+
+class FormattedTraceback(DeferredText):
+    """
+    An exception and its traceback.
+
+    The frames and the message of the exception are captured as they are
+    when it's handled, without the source lines or local variables.
+    """
+
+    def __init__(self, excInfo):
+        """
+        @param excInfo: The exception as returned by sys.exc_info.
+        @type excInfo: I{tuple}
+        """
+        DeferredText.__init__(self)
+        if hasattr(traceback, "TracebackException"):
+            self._exception = traceback.TracebackException(
+                *excInfo, lookup_lines=False
+            )
+        else:
+            self._exception = (
+                traceback.extract_tb(excInfo[2]),
+                traceback.format_exception_only(*excInfo[:2]),
+            )
+
+    def _render(self):
+        if isinstance(self._exception, tuple):
+            frames, exception = self._exception
+            lines = ["Traceback (most recent call last):\n"]
+            lines.extend(traceback.format_list(frames))
+            lines.extend(exception)
+        else:
+            lines = self._exception.format()
+
+        self._exception = None
+        return "".join(lines)
+
+
+# The types of the log record arguments that can't change once the record is
+# emitted, so formatting the record can be left to a background thread.
+IMMUTABLE_LOG_ARG_TYPES = six.string_types + six.integer_types + (
+    DeferredText,
+    six.binary_type,
+    float,
+    type(None),
+    datetime.date,
+    datetime.time,
+    datetime.timedelta,
+)
+
+
+def _snapshotLogRecord(record, formatter=None):
+    """
+    Get a copy of a log record that can be formatted later, on another thread.
+
+    The arguments that could change in the meantime are merged into the
+    message right away and the exception is rendered to text. Formatting the
+    copy is left to the thread handling it.
+
+    @param record: The record emitted.
+    @type record: I{logging.LogRecord}
+    @param formatter: The formatter used to render the exception. Defaults to
+        the standard one.
+    @type formatter: I{logging.Formatter}
+
+    @return: The copy of the record.
+    @rtype: I{logging.LogRecord}
+    """
+    record = copy.copy(record)
+    if record.args and not (
+        isinstance(record.msg, six.string_types)
+        and isinstance(record.args, tuple)
+        and all(isinstance(arg, IMMUTABLE_LOG_ARG_TYPES) for arg in record.args)
+    ):
+        record.msg = record.getMessage()
+        record.args = None
+    if record.exc_info:
+        if not record.exc_text:
+            record.exc_text = (formatter or logging.Formatter()).formatException(
+                record.exc_info
+            )
+        record.exc_info = None
+    return record
+
+
+class QueuedLogHandler(logging.Handler):
+    """
+    Hand log records over to a L{LogWriter} that formats them and writes them
+    to a file on its own thread.
+
+    Only what could change before the writer gets to a record is rendered
+    when it is emitted, see L{_snapshotLogRecord}.
+    """
+
+    def __init__(self, writer, path, backupCount=10):
+        """
+        @param writer: The writer of the log files.
+        @type writer: L{LogWriter}
+        @param path: The path of the log file.
+        @type path: I{str}
+        @param backupCount: The number of rotated log files to keep.
+        @type backupCount: I{int}
+        """
+        logging.Handler.__init__(self)
+        self.path = path
+        self.backupCount = backupCount
+        self._writer = writer
+
+    def emit(self, record):
+        try:
+            self._writer.put(self, _snapshotLogRecord(record, self.formatter))
+        except Exception:
+            self.handleError(record)
+
+
+class LogWriter(object):
+    """
+    Format the records of every L{QueuedLogHandler} and write them to their
+    files from a single background thread.
+
+    Records waiting in the queue are written together and every file is only
+    flushed once per batch. Files are rotated every midnight, like the
+    synchronous handlers do, and only the most recently used ones are kept
+    open.
+    """
+
+    # Maximum number of records written in one batch.
+    BATCH_SIZE = 1000
+
+    def __init__(self, maxOpenFiles=64):
+        """
+        @param maxOpenFiles: The maximum number of log files kept open.
+        @type maxOpenFiles: I{int}
+        """
+        self._maxOpenFiles = maxOpenFiles
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._files = {}
+        self._openFiles = collections.OrderedDict()
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        """
+        Start writing queued records in the background.
+        """
+        self._thread = threading.Thread(target=self._run, name="log-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Write the queued records and close every file. Records handed over
+        afterwards are written right away.
+        """
+        self._stopped = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+        self._writeQueued()
+        with self._lock:
+            for fileHandler in self._openFiles.values():
+                fileHandler.close()
+            self._openFiles.clear()
+
+    def put(self, handler, record):
+        """
+        @param handler: The handler the record was emitted on.
+        @type handler: L{QueuedLogHandler}
+        @param record: The record to write, as snapshot by the handler.
+        @type record: I{logging.LogRecord}
+        """
+        if self._stopped:
+            self._write([(handler, record)])
+        else:
+            self._queue.put((handler, record))
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            while len(items) < self.BATCH_SIZE:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in items:
+                self._write([item for item in items if item is not None])
+                return
+            self._write(items)
+
+    def _writeQueued(self):
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                items.append(item)
+        self._write(items)
+
+    def _write(self, items):
+        with self._lock:
+            written = []
+            for handler, record in items:
+                try:
+                    line = handler.format(record)
+                    fileHandler = self._getFileHandler(handler.path, handler.backupCount)
+                    if fileHandler.shouldRollover(record):
+                        fileHandler.doRollover()
+                    if fileHandler.stream is None:
+                        fileHandler.stream = fileHandler._open()
+                    fileHandler.stream.write(line + "\n")
+                    if fileHandler not in written:
+                        written.append(fileHandler)
+                except Exception:
+                    handler.handleError(record)
+
+            for fileHandler in written:
+                if fileHandler.stream is not None:
+                    fileHandler.stream.flush()
+
+    def _getFileHandler(self, path, backupCount):
+        fileHandler = self._openFiles.pop(path, None)
+        if fileHandler is None:
+            # Close the least recently used files to stay under the limit.
+            while len(self._openFiles) >= self._maxOpenFiles:
+                self._openFiles.popitem(last=False)[1].close()
+
+            fileHandler = self._files.get(path)
+            if fileHandler is None:
+                fileHandler = logging.handlers.TimedRotatingFileHandler(
+                    path, "midnight", backupCount=backupCount, delay=True
+                )
+                self._files[path] = fileHandler
+        self._openFiles[path] = fileHandler
+        return fileHandler
+
+
+class SentryLogHandler(logging.Handler):
+    """
+    Hand log records over to Sentry from a background thread.
+
+    Sentry formats the records it reports and serializes their arguments.
+    Both are done on snapshots of the records, see L{_snapshotLogRecord},
+    off the thread logging them. Records holding an exception are handed
+    over right away since Sentry reports its live traceback.
+    """
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.INFO)
+        self._handlers = [
+            BreadcrumbHandler(level=logging.INFO),
+            EventHandler(level=logging.ERROR),
+        ]
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        """
+        Start handing queued records over in the background.
+        """
+        self._thread = threading.Thread(target=self._run, name="sentry")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Hand the queued records over. Records emitted afterwards are handed
+        over right away.
+        """
+        self._stopped = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not None:
+                self._handleRecord(record)
+
+    def emit(self, record):
+        if record.exc_info or self._stopped:
+            self._handleRecord(record)
+            return
+
+        try:
+            self._queue.put(_snapshotLogRecord(record))
+        except Exception:
+            self.handleError(record)
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            self._handleRecord(record)
+
+    def _handleRecord(self, record):
+        for handler in self._handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+class MailDigest(object):
+    """
+    The records a logger emitted on a mail handler, waiting to be sent in a
+    single email.
+    """
+
+    def __init__(self, handler, deadline, maxRecords):
+        """
+        @param handler: The handler the records were emitted on.
+        @type handler: L{CustomSMTPHandler}
+        @param deadline: When the digest is sent, in seconds since the epoch.
+        @type deadline: I{float}
+        @param maxRecords: The number of records kept, the others are only
+            counted.
+        @type maxRecords: I{int}
+        """
+        self.handler = handler
+        self.deadline = deadline
+        self._maxRecords = maxRecords
+        self._records = []
+        self._lastRecord = None
+        self._subjectRecord = None
+        self._dropped = 0
+
+    def add(self, record):
+        """
+        @param record: A record to send.
+        @type record: I{logging.LogRecord}
+        """
+        self._lastRecord = record
+        if (
+            self._subjectRecord is None
+            or record.levelno > self._subjectRecord.levelno
+        ):
+            self._subjectRecord = record
+
+        if len(self._records) < self._maxRecords:
+            self._records.append(record)
+        else:
+            self._dropped += 1
+
+    def getLastRecord(self):
+        return self._lastRecord
+
+    def getSubject(self):
+        """
+        @return: The subject of the handler for the most severe record,
+            followed by the number of records if there are several.
+        @rtype: I{str}
+        """
+        subject = self.handler.getSubject(self._subjectRecord)
+        count = len(self._records) + self._dropped
+        if count > 1:
+            subject += " (%d messages)" % count
+        return subject
+
+    def getBody(self):
+        """
+        @return: The formatted records, and how many more were dropped.
+        @rtype: I{str}
+        """
+        body = ("\n\n" + "-" * 72 + "\n\n").join(
+            self.handler.format(record) for record in self._records
+        )
+        if self._dropped:
+            body += "\n\n%d more messages were dropped." % self._dropped
+        return body
+
+
+class MailWorker(object):
+    """
+    Send the records of every L{CustomSMTPHandler} in digests from a
+    background thread.
+
+    Records a logger emits on a handler within a window of time are sent in a
+    single email, at most a fixed number of them, the others are only counted.
+    SMTP connections are reused until they have been idle for a while.
+    """
+
+    # Number of seconds an unused SMTP connection is kept open.
+    IDLE_TIMEOUT = 60
+
+    def __init__(self, window, maxRecords):
+        """
+        @param window: The number of seconds the records of a logger are
+            collected for before being sent.
+        @type window: I{int}
+        @param maxRecords: The maximum number of records in one email.
+        @type maxRecords: I{int}
+        """
+        self._window = window
+        self._maxRecords = maxRecords
+        self._condition = threading.Condition()
+        self._digests = collections.OrderedDict()
+        self._connections = {}
+        self._sendLock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        """
+        Start sending digests in the background.
+        """
+        self._thread = threading.Thread(target=self._run, name="mail-worker")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Send the pending digests and close the connections. Records handed
+        over afterwards are sent right away.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        else:
+            with self._condition:
+                digests = self._takeDigests()
+            self._sendDigests(digests)
+        self._closeConnections(0)
+
+    def put(self, handler, record):
+        """
+        @param handler: The handler the record was emitted on.
+        @type handler: L{CustomSMTPHandler}
+        @param record: The record to send, as snapshot by the handler.
+        @type record: I{logging.LogRecord}
+        """
+        key = (handler, record.name)
+        with self._condition:
+            digest = self._digests.get(key)
+            if digest is None:
+                digest = MailDigest(
+                    handler, time.time() + self._window, self._maxRecords
+                )
+                self._digests[key] = digest
+                self._condition.notify()
+            digest.add(record)
+
+            if not self._stopped:
+                return
+            del self._digests[key]
+
+        self._sendDigests([digest])
+        self._closeConnections(0)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    digests = self._takeDigests()
+                    if digests or self._stopped:
+                        break
+                    self._condition.wait(self._getTimeout())
+
+            self._sendDigests(digests)
+            self._closeConnections(self.IDLE_TIMEOUT)
+            if self._stopped and not digests:
+                return
+
+    def _getTimeout(self):
+        deadlines = [digest.deadline for digest in self._digests.values()]
+        with self._sendLock:
+            deadlines.extend(
+                lastUse + self.IDLE_TIMEOUT
+                for _, lastUse in self._connections.values()
+            )
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.time())
+
+    def _takeDigests(self):
+        now = time.time()
+        keys = [
+            key
+            for key, digest in self._digests.items()
+            if self._stopped or digest.deadline <= now
+        ]
+        return [self._digests.pop(key) for key in keys]
+
+    def _sendDigests(self, digests):
+        with self._sendLock:
+            for digest in digests:
+                self._sendDigest(digest)
+
+    def _sendDigest(self, digest):
+        handler = digest.handler
+        key = handler.getConnectionKey()
+        smtp = self._connections.pop(key, (None, None))[0]
+        try:
+            if smtp is not None:
+                try:
+                    handler.sendMail(smtp, digest.getSubject(), digest.getBody())
+                except (smtplib.SMTPServerDisconnected, socket.error):
+                    # The server closed the reused connection, use a new one.
+                    self._closeConnection(smtp)
+                    smtp = None
+
+            if smtp is None:
+                smtp = handler.connect()
+                handler.sendMail(smtp, digest.getSubject(), digest.getBody())
+            self._connections[key] = (smtp, time.time())
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self._closeConnection(smtp)
+            handler.handleError(digest.getLastRecord())
+
+    def _closeConnections(self, idleTimeout):
+        with self._sendLock:
+            now = time.time()
+            for key, (smtp, lastUse) in list(self._connections.items()):
+                if now - lastUse >= idleTimeout:
+                    del self._connections[key]
+                    self._closeConnection(smtp)
+
+    @staticmethod
+    def _closeConnection(smtp):
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
@@ -0,0 +1,393 @@
+"""
+Sharing of the plugins between the workers of a sharded daemon.
+"""
+
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import six.moves.cPickle as pickle
+
+
+class PluginLeaseStore(object):
+    """
+    The lease records of the plugins of a sharded daemon, in a SQLite
+    database shared by its workers.
+
+    A worker owns a plugin as long as it renews the lease of the plugin. The
+    last event id data of the plugin is kept along with the lease so the next
+    owner picks up where the previous one left off. Workers also record until
+    when they are known to be alive.
+
+    Leases are named after the path of the plugin file without its extension,
+    so plugins of the same name in different plugin paths are leased apart.
+    """
+
+    def __init__(self, path, timeout=10):
+        """
+        @param path: The path of the SQLite database.
+        @type path: I{str}
+        @param timeout: The number of seconds to wait for another worker to
+            be done writing.
+        @type timeout: I{float}
+        """
+        self.path = path
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._db = None
+
+    def heartbeat(self, worker, expires):
+        """
+        Record that a worker is alive and renew its leases.
+
+        @param worker: The number of the worker.
+        @type worker: I{int}
+        @param expires: The time the worker and its leases expire at.
+        @type expires: I{float}
+        """
+        with self._transaction() as cursor:
+            cursor.execute(
+                "INSERT OR REPLACE INTO workers (worker, expires) VALUES (?, ?)",
+                (worker, expires),
+            )
+            cursor.execute(
+                "UPDATE leases SET expires = ? WHERE owner = ?", (expires, worker)
+            )
+
+    def removeWorker(self, worker):
+        """
+        Record that a worker stopped and release its leases.
+
+        @param worker: The number of the worker.
+        @type worker: I{int}
+        """
+        with self._transaction() as cursor:
+            cursor.execute("DELETE FROM workers WHERE worker = ?", (worker,))
+            cursor.execute(
+                "UPDATE leases SET owner = NULL, expires = 0 WHERE owner = ?",
+                (worker,),
+            )
+
+    def getLiveWorkers(self, now):
+        """
+        @param now: The current time.
+        @type now: I{float}
+
+        @return: The numbers of the workers alive.
+        @rtype: I{set} of I{int}
+        """
+        with self._transaction() as cursor:
+            cursor.execute("SELECT worker FROM workers WHERE expires > ?", (now,))
+            return set(row[0] for row in cursor.fetchall())
+
+    def getOwnedPlugins(self, worker, now):
+        """
+        @param worker: The number of the worker.
+        @type worker: I{int}
+        @param now: The current time.
+        @type now: I{float}
+
+        @return: The names of the leases the worker holds.
+        @rtype: I{set} of I{str}
+        """
+        with self._transaction() as cursor:
+            cursor.execute(
+                "SELECT plugin FROM leases WHERE owner = ? AND expires > ?",
+                (worker, now),
+            )
+            return set(row[0] for row in cursor.fetchall())
+
+    def acquire(self, leaseName, worker, now, expires):
+        """
+        Take the lease of a plugin if no other worker holds it.
+
+        @param leaseName: The name of the lease of the plugin.
+        @type leaseName: I{str}
+        @param worker: The number of the worker taking the lease.
+        @type worker: I{int}
+        @param now: The current time.
+        @type now: I{float}
+        @param expires: The time the lease expires at.
+        @type expires: I{float}
+
+        @return: True and the last event id data recorded for the plugin, None
+            if there is none, if the lease was taken. False and None if
+            another worker holds it.
+        @rtype: I{tuple}
+        """
+        with self._transaction() as cursor:
+            cursor.execute(
+                "INSERT OR IGNORE INTO leases (plugin, owner, expires) VALUES (?, NULL, 0)",
+                (leaseName,),
+            )
+            cursor.execute(
+                "UPDATE leases SET owner = ?, expires = ? WHERE plugin = ?"
+                " AND (owner IS NULL OR owner = ? OR expires <= ?)",
+                (worker, expires, leaseName, worker, now),
+            )
+            if cursor.rowcount != 1:
+                return False, None
+            cursor.execute("SELECT state FROM leases WHERE plugin = ?", (leaseName,))
+            state = cursor.fetchone()[0]
+
+        if state is not None:
+            state = pickle.loads(bytes(state))
+        return True, state
+
+    def release(self, leaseName, worker, state):
+        """
+        Give up the lease of a plugin.
+
+        @param leaseName: The name of the lease of the plugin.
+        @type leaseName: I{str}
+        @param worker: The number of the worker holding the lease.
+        @type worker: I{int}
+        @param state: The last event id data of the plugin, None to keep the
+            recorded one.
+        @type state: I{tuple}
+        """
+        with self._transaction() as cursor:
+            if state is not None:
+                cursor.execute(
+                    "UPDATE leases SET state = ? WHERE plugin = ? AND owner = ?",
+                    (sqlite3.Binary(pickle.dumps(state, protocol=2)), leaseName, worker),
+                )
+            cursor.execute(
+                "UPDATE leases SET owner = NULL, expires = 0 WHERE plugin = ? AND owner = ?",
+                (leaseName, worker),
+            )
+
+    def saveStates(self, worker, states):
+        """
+        Record the last event id data of plugins a worker holds the leases
+        of.
+
+        @param worker: The number of the worker.
+        @type worker: I{int}
+        @param states: The last event id data keyed by lease name.
+        @type states: I{dict}
+        """
+        with self._transaction() as cursor:
+            for leaseName, state in states.items():
+                cursor.execute(
+                    "UPDATE leases SET state = ? WHERE plugin = ? AND owner = ?",
+                    (sqlite3.Binary(pickle.dumps(state, protocol=2)), leaseName, worker),
+                )
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            if self._db is None:
+                # Connect on first use, after the daemon forked.
+                self._db = sqlite3.connect(
+                    self.path,
+                    timeout=self._timeout,
+                    isolation_level=None,
+                    check_same_thread=False,
+                )
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS workers"
+                    " (worker INTEGER PRIMARY KEY, expires REAL NOT NULL)"
+                )
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS leases"
+                    " (plugin TEXT PRIMARY KEY, owner INTEGER, expires REAL NOT NULL, state BLOB)"
+                )
+
+            cursor = self._db.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class PluginShard(object):
+    """
+    Decide which worker of a sharded daemon runs which plugin.
+
+    Every plugin has a home worker, assigned in the config or picked by
+    hashing the plugin's name. A worker runs the plugins it's home to and,
+    while their home worker is down, a share of the orphaned plugins.
+    Ownership goes through the leases of a L{PluginLeaseStore}, renewed from
+    a background thread: once a worker dies, its leases expire and the
+    surviving workers take its plugins over. Plugins go back to their home
+    worker once it's alive again.
+    """
+
+    def __init__(self, store, worker, numWorkers, assignments, ttl, logger):
+        """
+        @param store: The lease records shared by the workers.
+        @type store: L{PluginLeaseStore}
+        @param worker: The number of this worker, from 1 to numWorkers.
+        @type worker: I{int}
+        @param numWorkers: The number of workers.
+        @type numWorkers: I{int}
+        @param assignments: The home worker of some plugins, keyed by plugin
+            name.
+        @type assignments: I{dict}
+        @param ttl: The number of seconds a lease lasts if not renewed.
+        @type ttl: I{int}
+        @param logger: The logger to report ownership changes to.
+        @type logger: A logging.Logger instance
+        """
+        self._store = store
+        self._worker = worker
+        self._numWorkers = numWorkers
+        self._assignments = assignments
+        self._ttl = ttl
+        self.log = logger
+        self._leasesExpire = 0
+        self._stopEvent = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._renewLeases()
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target=self._run, name="PluginShard")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, states):
+        """
+        Stop renewing the leases and release them for the other workers to
+        take the plugins over right away.
+
+        @param states: The last event id data of the plugins this worker
+            runs, keyed by plugin path and plugin name.
+        @type states: I{dict}
+        """
+        self._stopEvent.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self._store.saveStates(self._worker, self._getLeaseStates(states))
+            self._store.removeWorker(self._worker)
+        except sqlite3.Error as err:
+            self.log.error("Could not release the plugin leases. %s", err)
+        self._store.close()
+
+    def getHomeWorker(self, pluginName):
+        """
+        @param pluginName: The name of a plugin.
+        @type pluginName: I{str}
+
+        @return: The number of the worker meant to run the plugin.
+        @rtype: I{int}
+        """
+        worker = self._assignments.get(pluginName)
+        if worker is None:
+            worker = self._hash(pluginName) % self._numWorkers + 1
+        return worker
+
+    def holdsLeases(self):
+        """
+        Are this worker's leases known to still be valid? Once they can't be
+        renewed, other workers may take the plugins over when they expire.
+
+        @return: True if the leases were last renewed less than a lease ttl
+            ago, False otherwise.
+        @rtype: I{bool}
+        """
+        return time.time() < self._leasesExpire
+
+    def update(self, pluginKeys, states):
+        """
+        Take the leases of the plugins this worker should run and release
+        the others.
+
+        @param pluginKeys: The plugin path and plugin name of every plugin.
+        @type pluginKeys: I{set} of I{tuple}
+        @param states: The last event id data of the plugins this worker
+            runs, keyed by plugin path and plugin name.
+        @type states: I{dict}
+
+        @return: The plugin paths and plugin names of the plugins this worker
+            owns, and the last event id data recorded for the ones it just
+            took over, None for those none was recorded for.
+        @rtype: I{tuple} of I{set} and I{dict}
+        """
+        now = time.time()
+        live = self._store.getLiveWorkers(now)
+        live.add(self._worker)
+        owned = self._store.getOwnedPlugins(self._worker, now)
+        keys = dict((self._getLeaseName(key), key) for key in pluginKeys)
+        states = self._getLeaseStates(states)
+
+        acquired = {}
+        for leaseName in sorted(keys):
+            pluginName = keys[leaseName][1]
+            if self._getRunningWorker(pluginName, live) == self._worker:
+                if leaseName in owned:
+                    continue
+                success, state = self._store.acquire(
+                    leaseName, self._worker, now, now + self._ttl
+                )
+                if success:
+                    self.log.info("Running plugin %s.", leaseName)
+                    owned.add(leaseName)
+                    acquired[keys[leaseName]] = state
+            elif leaseName in owned:
+                self.log.info("Handing plugin %s over.", leaseName)
+                self._store.release(leaseName, self._worker, states.get(leaseName))
+                owned.discard(leaseName)
+
+        for leaseName in owned - set(keys):
+            # The plugin file is gone.
+            self._store.release(leaseName, self._worker, states.get(leaseName))
+            owned.discard(leaseName)
+
+        return set(keys[leaseName] for leaseName in owned), acquired
+
+    def saveStates(self, states):
+        """
+        @param states: The last event id data of the plugins this worker
+            runs, keyed by plugin path and plugin name.
+        @type states: I{dict}
+        """
+        self._store.saveStates(self._worker, self._getLeaseStates(states))
+
+    def _getLeaseName(self, key):
+        return os.path.join(*key)
+
+    def _getLeaseStates(self, states):
+        return dict(
+            (self._getLeaseName(key), state) for key, state in states.items()
+        )
+
+    def _renewLeases(self):
+        expires = time.time() + self._ttl
+        self._store.heartbeat(self._worker, expires)
+        self._leasesExpire = expires
+
+    def _getRunningWorker(self, pluginName, live):
+        home = self.getHomeWorker(pluginName)
+        if home in live:
+            return home
+        # Spread the orphaned plugins over the live workers.
+        live = sorted(live)
+        return live[self._hash(pluginName) % len(live)]
+
+    def _hash(self, pluginName):
+        return zlib.crc32(pluginName.encode("utf-8")) & 0xFFFFFFFF
+
+    def _run(self):
+        interval = self._ttl / 3.0
+        while not self._stopEvent.wait(interval):
+            try:
+                self._renewLeases()
+            except sqlite3.Error as err:
+                self.log.warning("Could not renew the plugin leases. %s", err)
+
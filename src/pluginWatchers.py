@@ -0,0 +1,215 @@
+"""
+Detection of the changes made to the plugin files.
+"""
+
+import abc
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+
+import six
+
+
+def _isPluginFile(basename):
+    return basename.endswith(".py") and not basename.startswith(".")
+
+
+@six.add_metaclass(abc.ABCMeta)
+class PluginWatcher(object):
+    """
+    Watch the plugin paths for plugin files being added, changed or removed.
+
+    Changes are found by L{_run} on a background thread and queued until the
+    main loop picks them up with L{getChanges}.
+    """
+
+    def __init__(self, paths):
+        """
+        @param paths: The plugin paths to watch.
+        @type paths: I{list} of I{str}
+        """
+        self._paths = paths
+        self._lock = threading.Lock()
+        self._changes = {}
+        self._thread = None
+        self._stopEvent = threading.Event()
+
+    def start(self):
+        """
+        Start watching.
+        """
+        self._thread = threading.Thread(
+            target=self._run, name=type(self).__name__
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop watching.
+        """
+        self._stopEvent.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def getChanges(self):
+        """
+        Get the changes found since the last call.
+
+        @return: The names of the changed plugin files keyed by plugin path.
+            A path mapped to None needs all of its plugin files rescanned.
+        @rtype: I{dict}
+        """
+        with self._lock:
+            changes = self._changes
+            self._changes = {}
+        return changes
+
+    def _queueChange(self, path, basename=None):
+        with self._lock:
+            if basename is None:
+                self._changes[path] = None
+            elif path not in self._changes:
+                self._changes[path] = set([basename])
+            elif self._changes[path] is not None:
+                self._changes[path].add(basename)
+
+    @abc.abstractmethod
+    def _run(self):
+        """
+        Queue the changes found with L{_queueChange} until L{stop} is called.
+        """
+
+
+class PollingPluginWatcher(PluginWatcher):
+    """
+    Find plugin changes by listing the plugin paths and comparing file
+    modification times at regular intervals.
+    """
+
+    def __init__(self, paths, interval):
+        """
+        @param paths: The plugin paths to watch.
+        @type paths: I{list} of I{str}
+        @param interval: The number of seconds between scans.
+        @type interval: I{int}
+        """
+        super(PollingPluginWatcher, self).__init__(paths)
+        self._interval = interval
+
+        # Changes are found against the files as they are when the watcher is
+        # created, even if it's only started later on.
+        self._mtimes = {}
+        for path in paths:
+            try:
+                self._mtimes[path] = self._scan(path)
+            except OSError:
+                self._mtimes[path] = {}
+
+    def _run(self):
+        while not self._stopEvent.wait(self._interval):
+            for path in self._paths:
+                try:
+                    newMtimes = self._scan(path)
+                except OSError:
+                    continue
+
+                oldMtimes = self._mtimes[path]
+                for basename in set(oldMtimes) | set(newMtimes):
+                    if oldMtimes.get(basename) != newMtimes.get(basename):
+                        self._queueChange(path, basename)
+                self._mtimes[path] = newMtimes
+
+    def _scan(self, path):
+        mtimes = {}
+        for basename in os.listdir(path):
+            if _isPluginFile(basename):
+                try:
+                    mtimes[basename] = os.path.getmtime(os.path.join(path, basename))
+                except OSError:
+                    pass
+        return mtimes
+
+
+class InotifyPluginWatcher(PluginWatcher):
+    """
+    Find plugin changes with Linux inotify notifications.
+
+    Changes made to a network file system by other hosts aren't notified, the
+    L{PollingPluginWatcher} should be used for such plugin paths.
+    """
+
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+
+    WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, paths):
+        """
+        @param paths: The plugin paths to watch.
+        @type paths: I{list} of I{str}
+
+        @raise OSError: If inotify is not available.
+        """
+        super(InotifyPluginWatcher, self).__init__(paths)
+
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux.")
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init"):
+            raise OSError("inotify is not supported by the C library.")
+
+        self._fd = libc.inotify_init()
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self._watches = {}
+        for path in paths:
+            wd = libc.inotify_add_watch(
+                self._fd, path.encode(sys.getfilesystemencoding()), self.WATCH_MASK
+            )
+            if wd < 0:
+                errno = ctypes.get_errno()
+                os.close(self._fd)
+                raise OSError(errno, "%s: %s" % (os.strerror(errno), path))
+            self._watches[wd] = path
+
+    def _run(self):
+        try:
+            while not self._stopEvent.is_set():
+                readable = select.select([self._fd], [], [], 1.0)[0]
+                if readable:
+                    self._readEvents(os.read(self._fd, 65536))
+        finally:
+            os.close(self._fd)
+
+    def _readEvents(self, data):
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were lost, rescan everything.
+                for path in self._paths:
+                    self._queueChange(path)
+            elif wd in self._watches and name:
+                self._queueChange(
+                    self._watches[wd], name.decode(sys.getfilesystemencoding())
+                )
+
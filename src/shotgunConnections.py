@@ -0,0 +1,199 @@
+"""
+The Shotgun connections handed to callbacks.
+"""
+
+import threading
+import time
+
+import shotgun_api3 as sg
+
+
+class AccountedShotgun(object):
+    """
+    Wrap a Shotgun instance to account for the calls made through it.
+
+    Every call to a public method is counted by method name, along with the
+    time it took and the number of records it returned.
+
+    Plugins get this proxy instead of the Shotgun instance itself, it is not
+    an instance of L{sg.Shotgun}. A wrapper is reused for the calls of a
+    callback on a thread, see L{wrap}, its accounted methods are built once.
+    """
+
+    # Methods that don't make requests to the server.
+    UNACCOUNTED_METHODS = frozenset(
+        ["set_session_uuid", "add_user_agent", "reset_user_agent", "close"]
+    )
+
+    def __init__(self, shotgun=None):
+        """
+        @param shotgun: The Shotgun instance to account for, if any yet.
+        @type shotgun: L{sg.Shotgun}
+        """
+        self.__dict__["_shotgun"] = None
+        self.__dict__["_calls"] = {}
+        self.wrap(shotgun)
+
+    def wrap(self, shotgun):
+        """
+        Account for the calls made to another Shotgun instance from now on,
+        the calls accounted so far are dropped.
+
+        @param shotgun: The Shotgun instance to account for, None to let go
+            of the current one.
+        @type shotgun: L{sg.Shotgun}
+        """
+        self.__dict__["_shotgun"] = shotgun
+        self.__dict__["_calls"] = {}
+
+    def __getattr__(self, name):
+        attribute = getattr(self._shotgun, name)
+        if (
+            name.startswith("_")
+            or name in self.UNACCOUNTED_METHODS
+            or not callable(attribute)
+        ):
+            return attribute
+
+        def accountedMethod(*args, **kwargs):
+            calls = self._calls
+            startTime = time.time()
+            try:
+                result = getattr(self._shotgun, name)(*args, **kwargs)
+            finally:
+                stats = calls.get(name)
+                if stats is None:
+                    stats = calls[name] = [0, 0.0, 0]
+                stats[0] += 1
+                stats[1] += time.time() - startTime
+
+            if isinstance(result, (list, tuple)):
+                stats[2] += len(result)
+            elif result is not None:
+                stats[2] += 1
+            return result
+
+        # Found by the normal lookup from now on, without calling __getattr__.
+        self.__dict__[name] = accountedMethod
+        return accountedMethod
+
+    def __setattr__(self, name, value):
+        setattr(self._shotgun, name, value)
+
+    def getShotgun(self):
+        """
+        @return: The wrapped Shotgun instance.
+        @rtype: L{sg.Shotgun}
+        """
+        return self._shotgun
+
+    def getCalls(self):
+        """
+        @return: The number of calls, their total duration in seconds and the
+            number of records they returned, keyed by method name.
+        @rtype: I{dict}
+        """
+        return self._calls
+
+    def getTotals(self):
+        """
+        @return: The number of calls, their total duration, the number of
+            records they returned and the number of calls per method as a
+            comma delimited list of method:count.
+        @rtype: I{tuple}
+        """
+        calls = duration = records = 0
+        for count, seconds, recordCount in self._calls.values():
+            calls += count
+            duration += seconds
+            records += recordCount
+        methods = ",".join(
+            "%s:%d" % (name, self._calls[name][0]) for name in sorted(self._calls)
+        )
+        return calls, duration, records, methods or "-"
+
+
+class ShotgunPool(object):
+    """
+    Shotgun connections shared by the callbacks of every plugin.
+
+    Callbacks borrow a connection for each call, see L{Callback.process}.
+    Connections are kept per script and handed to one thread at a time, so
+    callbacks running concurrently never share one. They outlive plugin
+    reloads and keep their HTTP connection to the server alive between
+    events, until no loaded plugin uses their script anymore.
+    """
+
+    def __init__(self, url, proxy):
+        """
+        @param url: The url of the Shotgun server.
+        @type url: I{str}
+        @param proxy: The proxy server used to connect to Shotgun, if any.
+        @type proxy: I{str}
+        """
+        self._url = url
+        self._proxy = proxy
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def acquire(self, scriptName, scriptKey):
+        """
+        Get a connection for a script, creating one if none is available.
+
+        Connections must be handed back with L{release} once done with.
+
+        @param scriptName: The script name to connect with.
+        @type scriptName: I{str}
+        @param scriptKey: The api key of the script.
+        @type scriptKey: I{str}
+
+        @return: A connection no other thread is using.
+        @rtype: L{sg.Shotgun}
+        """
+        with self._lock:
+            idle = self._idle.get(self._getKey(scriptName, scriptKey))
+            if idle:
+                return idle.pop()
+
+        return self._createShotgun(scriptName, scriptKey)
+
+    def release(self, shotgun, scriptName, scriptKey):
+        """
+        Hand back a connection acquired for a script.
+
+        @param shotgun: The connection to hand back.
+        @type shotgun: L{sg.Shotgun}
+        @param scriptName: The script name it was acquired for.
+        @type scriptName: I{str}
+        @param scriptKey: The api key of the script.
+        @type scriptKey: I{str}
+        """
+        with self._lock:
+            self._idle.setdefault(self._getKey(scriptName, scriptKey), []).append(
+                shotgun
+            )
+
+    def _createShotgun(self, scriptName, scriptKey):
+        """
+        @return: A new connection for a script.
+        @rtype: L{sg.Shotgun}
+        """
+        return sg.Shotgun(self._url, scriptName, scriptKey, http_proxy=self._proxy)
+
+    def retain(self, credentials):
+        """
+        Close the idle connections of the scripts no callback uses anymore.
+
+        @param credentials: The script names and api keys still used.
+        @type credentials: I{set} of I{tuple}
+        """
+        keys = set(self._getKey(*credential) for credential in credentials)
+        with self._lock:
+            for key in list(self._idle):
+                if key not in keys:
+                    for shotgun in self._idle.pop(key):
+                        shotgun.close()
+
+    def _getKey(self, scriptName, scriptKey):
+        return (self._url, scriptName, self._proxy, scriptKey)
+
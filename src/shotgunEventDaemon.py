@@ -35,17 +35,25 @@ with warnings.catch_warnings():
     warnings.filterwarnings("ignore", category=DeprecationWarning)
     import imp
 
+import abc
+import bisect
+import collections
 import datetime
+import functools
 import json
 import logging
 import logging.handlers
 import os
-import pprint
 import re
+import signal
+import smtplib
 import socket
+import sqlite3
 import sys
+import threading
 import time
 import traceback
+import six
 from six.moves import configparser
 import six.moves.cPickle as pickle
 
@@ -65,15 +73,71 @@ from shotgun_api3.lib.sgtimezone import SgTimezone
 
 try:
     import sentry_sdk
+    from sentry_sdk.integrations.logging import LoggingIntegration
 except ImportError:
     sentry_sdk = None
 
+from callbackMonitors import CallbackProfiler, CallbackWatchdog
+from daemonErrors import ConfigError, EventDaemonError
+from engineMetrics import (
+    EngineMetrics,
+    MetricsServer,
+    RecordingHistogram,
+    ReplayMetrics,
+)
+from eventFetchers import EventPrefetcher, EventRangeFetcher
+from eventIdStores import EventIdBacklog, JournalEventIdStore, PickleEventIdStore
+from eventRecording import (
+    EventRecorder,
+    RecordingShotgun,
+    ReplayShotgun,
+    ReplayShotgunPool,
+    _readEventJournal,
+)
+from logHandlers import (
+    FormattedTraceback,
+    FrameLocals,
+    LogWriter,
+    MailWorker,
+    QueuedLogHandler,
+    SentryLogHandler,
+    _snapshotLogRecord,
+)
+from pluginLeases import PluginLeaseStore, PluginShard
+from pluginWatchers import InotifyPluginWatcher, PollingPluginWatcher, _isPluginFile
+from shotgunConnections import AccountedShotgun, ShotgunPool
+
 
 SG_TIMEZONE = SgTimezone()
 CURRENT_PYTHON_VERSION = StrictVersion(sys.version.split()[0])
 PYTHON_26 = StrictVersion("2.6")
 PYTHON_27 = StrictVersion("2.7")
 
+# The EventLogEntry fields fetched for callbacks that don't declare the ones
+# they use.
+EVENT_FIELDS = [
+    "id",
+    "event_type",
+    "attribute_name",
+    "meta",
+    "entity",
+    "user",
+    "project",
+    "session_uuid",
+    "created_at",
+]
+
+# The EventLogEntry fields the engine itself needs.
+ENGINE_EVENT_FIELDS = ["id", "event_type", "attribute_name", "created_at"]
+
+# Maximum number of backlog id ranges looked up one by one. Past that, the
+# whole span of the backlog is queried at once.
+MAX_BACKLOG_QUERY_RANGES = 50
+
+# Number of minutes after which an event id that was skipped is considered
+# to never happen.
+BACKLOG_TIMEOUT = 5
+
 EMAIL_FORMAT_STRING = """Time: %(asctime)s
 Logger: %(name)s
 Path: %(pathname)s
@@ -83,14 +147,19 @@ Line: %(lineno)d
 %(message)s"""
 
 
-def _setFilePathOnLogger(logger, path, backupCount=10):
+def _setFilePathOnLogger(logger, path, backupCount=10, writer=None):
     # Remove any previous handler.
-    _removeHandlersFromLogger(logger, logging.handlers.TimedRotatingFileHandler)
-
-    # Add the file handler
-    handler = logging.handlers.TimedRotatingFileHandler(
-        path, "midnight", backupCount=backupCount
+    _removeHandlersFromLogger(
+        logger, (logging.handlers.TimedRotatingFileHandler, QueuedLogHandler)
     )
+
+    # Add the file handler, writing through the background writer if any
+    if writer is not None:
+        handler = QueuedLogHandler(writer, path, backupCount)
+    else:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, "midnight", backupCount=backupCount
+        )
     handler.setFormatter(
         logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     )
@@ -123,6 +192,7 @@ def _addMailHandlerToLogger(
     username=None,
     password=None,
     secure=None,
+    mailWorker=None,
 ):
     """
     Configure a logger with a handler that sends emails to specified
@@ -137,10 +207,19 @@ def _addMailHandlerToLogger(
     @param toAddrs: The addresses to send the email to.
     @type toAddrs: A list of email addresses that will be passed on to the
         SMTPHandler.
+    @param mailWorker: The worker sending digests of the records in the
+        background. Records are sent one by one right away if None.
+    @type mailWorker: L{MailWorker}
     """
     if smtpServer and fromAddr and toAddrs and emailSubject:
         mailHandler = CustomSMTPHandler(
-            smtpServer, fromAddr, toAddrs, emailSubject, (username, password), secure
+            smtpServer,
+            fromAddr,
+            toAddrs,
+            emailSubject,
+            (username, password),
+            secure,
+            mailWorker,
         )
         mailHandler.setLevel(logging.ERROR)
         mailFormatter = logging.Formatter(EMAIL_FORMAT_STRING)
@@ -165,10 +244,92 @@ def _sentry_pre_send(event, hint):
     return event
 
 
+class _CachedValues(object):
+    """
+    Values resolved from slow remote services, kept in memory.
+
+    A value is fetched the first time it is asked for. Once older than the
+    ttl, the stale value keeps being returned while a background thread
+    fetches it again, so only the very first lookup waits on the service.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._refreshing = set()
+
+    def get(self, key, loader, ttl):
+        """
+        @param key: The name of the value.
+        @type key: I{str}
+        @param loader: Fetches the value from the remote service.
+        @type loader: A callable taking no arguments.
+        @param ttl: The number of seconds before the value is fetched again.
+            A negative ttl never fetches it again.
+        @type ttl: I{int}
+
+        @return: The value, possibly stale while it is being refreshed.
+        """
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None:
+                value, loadTime = entry
+                if (
+                    0 <= ttl <= time.time() - loadTime
+                    and key not in self._refreshing
+                ):
+                    self._refreshing.add(key)
+                    thread = threading.Thread(
+                        target=self._refresh, args=(key, loader), name="cache-refresh"
+                    )
+                    thread.daemon = True
+                    thread.start()
+                return value
+
+        value = loader()
+        with self._lock:
+            self._values[key] = (value, time.time())
+        return value
+
+    def _refresh(self, key, loader):
+        try:
+            value = loader()
+        except Exception:
+            # Keep the stale value, the next lookup tries again.
+            logging.getLogger("engine").warning(
+                "Could not refresh %s.\n\n%s", key, traceback.format_exc()
+            )
+            with self._lock:
+                self._refreshing.discard(key)
+            return
+
+        with self._lock:
+            self._values[key] = (value, time.time())
+            self._refreshing.discard(key)
+
+
+_aws_values = _CachedValues()
+
+# Sessions aren't thread safe, clients are created from the main thread and
+# from the refresh threads.
+_aws_session_lock = threading.Lock()
+
+
+def _get_aws_session():
+    # One session for every client, creating it reads the credentials chain.
+    return _aws_values.get("boto3 session", boto3.session.Session, -1)
+
+
+def _get_aws_client(service_name):
+    region_name = _get_instance_region()
+    session = _get_aws_session()
+    with _aws_session_lock:
+        return session.client(service_name=service_name, region_name=region_name)
+
+
 def _get_sg_secret(secret_name):
     # Create a Secrets Manager client
-    sec_session = boto3.session.Session()
-    client = sec_session.client(service_name="secretsmanager", region_name=_get_instance_region())
+    client = _get_aws_client("secretsmanager")
     get_secret_value_response = client.get_secret_value(SecretId=secret_name)
 
     formatted = json.loads(get_secret_value_response["SecretString"])
@@ -177,8 +338,7 @@ def _get_sg_secret(secret_name):
 
 def _get_sg_host():
     # Create a Secrets Manager client
-    sec_session = boto3.session.Session()
-    ssm_client = sec_session.client(service_name="ssm", region_name=_get_instance_region())
+    ssm_client = _get_aws_client("ssm")
     response = ssm_client.get_parameter(Name="AA-ShotgunHost")
     shotgun_host = response["Parameter"]["Value"]
 
@@ -189,10 +349,16 @@ def _get_instance_region():
     """
     Get ec2 region from the instance metadata by making an HTTP request.
 
+    An instance never changes region so the request is only made once.
+
     AWS doc - https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/instancedata-data-retrieval.html
 
     :return: str.
     """
+    return _aws_values.get("instance region", _fetch_instance_region, -1)
+
+
+def _fetch_instance_region():
     instance_identity_url = "http://169.254.169.254/latest/dynamic/instance-identity/document"
     response = requests.get(instance_identity_url)
     response_json = response.json()
@@ -201,131 +367,377 @@ def _get_instance_region():
 
 
 class Config(configparser.SafeConfigParser):
+    """
+    The parsed config file. The settings are read from it once, as a
+    L{ConfigSnapshot}.
+    """
+
     def __init__(self, path):
         configparser.SafeConfigParser.__init__(self, os.environ)
         self.read(path)
 
-    def getShotgunURL(self):
-        if self.has_option("shotgun", "server"):
-            server = self.get("shotgun", "server")
-            if server:
-                return server
-        return _get_sg_host()
+    def getOption(self, section, option, default=None):
+        """
+        @return: The value of an option with the surrounding whitespace
+            stripped, or the default if the option is missing or empty.
+        @rtype: I{str}
+        """
+        if self.has_option(section, option):
+            value = self.get(section, option).strip()
+            if value:
+                return value
+        return default
 
-    def getEngineScriptName(self):
-        return self.get("shotgun", "name")
+    def getListOption(self, section, option):
+        """
+        @return: The values of a comma delimited option, none if the option is
+            missing.
+        @rtype: I{list} of I{str}
+        """
+        values = self.getOption(section, option, "").split(",")
+        return [value.strip() for value in values if value.strip()]
 
-    def getEngineScriptKey(self):
-        if self.has_option("shotgun", "server"):
-            key = self.get("shotgun", "key")
-            if key:
-                return key
-            return _get_sg_secret(self.getEngineScriptName())
+    def getSnapshot(self):
+        """
+        Read and validate every setting at once.
+
+        @return: The current settings.
+        @rtype: L{ConfigSnapshot}
+
+        @raise ConfigError: If a setting is missing or invalid.
+        """
+        return ConfigSnapshot(self)
 
-    def getEngineProxyServer(self):
-        try:
-            proxy_server = self.get("shotgun", "proxy_server").strip()
-            if not proxy_server:
-                return None
-            return proxy_server
-        except configparser.NoOptionError:
-            return None
 
-    def getEventIdFile(self):
-        return self.get("daemon", "eventIdFile")
+class ConfigSnapshot(object):
+    """
+    The settings of a L{Config}, read once and validated.
+
+    The values are plain, read only attributes so the engine and plugins can
+    look them up as often as they need to. Reading the config again produces a
+    new snapshot, see L{Engine.reloadConfig}.
+    """
 
-    def getEnginePIDFile(self):
-        return self.get("daemon", "pidFile")
+    # Settings only taken into account when the daemon starts.
+    RESTART_SETTINGS = (
+        "shotgunUrl",
+        "engineScriptName",
+        "engineScriptKey",
+        "engineProxyServer",
+        "enginePidFile",
+        "eventIdFile",
+        "eventIdStore",
+        "journalCompaction",
+        "pluginPaths",
+        "pluginReloadInterval",
+        "pluginWatcher",
+        "logMode",
+        "logPath",
+        "logFile",
+        "timingLogFile",
+        "backupCount",
+        "logQueue",
+        "logMaxOpenFiles",
+        "prefetchPages",
+        "dispatchThreads",
+        "sentryDsn",
+        "digestWindow",
+        "metricsPort",
+        "metricsAddress",
+        "recordFile",
+        "shardWorkers",
+        "leaseStore",
+        "leaseTtl",
+        "shardAssignments",
+    )
+
+    def __init__(self, config):
+        """
+        @param config: The config to read the settings from.
+        @type config: L{Config}
+
+        @raise ConfigError: If a setting is missing or invalid.
+        """
+        try:
+            values = self._read(config)
+        except (configparser.Error, ValueError) as err:
+            raise ConfigError("Invalid config: %s" % err)
+
+        if values["logPath"] is not None:
+            if not os.path.exists(values["logPath"]):
+                os.makedirs(values["logPath"])
+            elif not os.path.isdir(values["logPath"]):
+                raise ConfigError(
+                    "The logPath value in the config should point to a directory."
+                )
 
-    def getPluginPaths(self):
-        return [s.strip() for s in self.get("plugins", "paths").split(",")]
+        for name in (
+            "maxEventBatchSize",
+            "checkpointEvents",
+            "journalCompaction",
+            "pluginReloadInterval",
+            "logMaxOpenFiles",
+            "digestMaxRecords",
+            "profileBackupCount",
+            "backfillFetchThreads",
+            "shardWorkers",
+            "leaseTtl",
+        ):
+            if values[name] < 1:
+                raise ConfigError("The %s setting must be at least 1." % name)
+        for name in (
+            "maxConnRetries",
+            "connRetrySleep",
+            "fetchInterval",
+            "prefetchPages",
+            "checkpointInterval",
+            "dispatchThreads",
+            "backupCount",
+            "digestWindow",
+            "metricsPort",
+            "profileInterval",
+            "callbackTimeout",
+            "backfillThreads",
+        ):
+            if values[name] < 0:
+                raise ConfigError("The %s setting can't be negative." % name)
+        if not 0 <= values["profileSampleRate"] <= 1:
+            raise ConfigError("The profiling sample_rate must be between 0 and 1.")
+        if values["callbackTimeoutAction"] not in ("log", "abandon"):
+            raise ConfigError(
+                "Unknown callback_timeout_action value in the config: %s."
+                % values["callbackTimeoutAction"]
+            )
+        for pluginName, worker in values["shardAssignments"]:
+            if not 1 <= worker <= values["shardWorkers"]:
+                raise ConfigError(
+                    "The %s plugin is assigned to worker %d, there are %d workers."
+                    % (pluginName, worker, values["shardWorkers"])
+                )
+        if values["logMode"] not in (0, 1):
+            raise ConfigError("The logMode setting must be 0 or 1.")
+        if values["eventIdStore"] not in ("pickle", "journal"):
+            raise ConfigError(
+                "Unknown event_id_store value in the config: %s."
+                % values["eventIdStore"]
+            )
+        if values["pluginWatcher"] not in ("auto", "inotify", "poll"):
+            raise ConfigError(
+                "Unknown plugin watcher in the config: %s." % values["pluginWatcher"]
+            )
 
-    def getSMTPServer(self):
-        return self.get("emails", "server")
+        self.__dict__.update(values)
 
-    def getSMTPPort(self):
-        if self.has_option("emails", "port"):
-            return self.getint("emails", "port")
-        return 25
+    @staticmethod
+    def _read(config):
+        """
+        @param config: The config to read the settings from.
+        @type config: L{Config}
 
-    def getFromAddr(self):
-        return self.get("emails", "from")
+        @return: The settings, keyed by name.
+        @rtype: I{dict}
 
-    def getToAddrs(self):
-        return [s.strip() for s in self.get("emails", "to").split(",")]
+        @raise configparser.Error: If a required option is missing.
+        @raise ValueError: If an option has an invalid value.
+        """
+        values = {}
+
+        # The url and the key of the script are looked up in AWS unless set.
+        awsCacheTtl = int(config.getOption("shotgun", "aws_cache_ttl", 3600))
+        values["engineScriptName"] = config.get("shotgun", "name")
+        values["shotgunUrl"] = config.getOption("shotgun", "server")
+        if values["shotgunUrl"] is None:
+            values["shotgunUrl"] = _aws_values.get(
+                "shotgun host", _get_sg_host, awsCacheTtl
+            )
+        values["engineScriptKey"] = None
+        if config.has_option("shotgun", "server"):
+            values["engineScriptKey"] = config.getOption("shotgun", "key")
+            if values["engineScriptKey"] is None:
+                scriptName = values["engineScriptName"]
+                values["engineScriptKey"] = _aws_values.get(
+                    "secret " + scriptName,
+                    functools.partial(_get_sg_secret, scriptName),
+                    awsCacheTtl,
+                )
+        values["engineProxyServer"] = config.getOption("shotgun", "proxy_server")
+        values["useSessionUuid"] = config.getboolean("shotgun", "use_session_uuid")
+
+        values.update(
+            enginePidFile=config.get("daemon", "pidFile"),
+            eventIdFile=config.get("daemon", "eventIdFile"),
+            eventIdStore=config.getOption("daemon", "event_id_store", "pickle"),
+            journalCompaction=int(config.getOption("daemon", "journal_compaction", 10000)),
+            logMode=config.getint("daemon", "logMode"),
+            logLevel=config.getint("daemon", "logging"),
+            logPath=config.getOption("daemon", "logPath"),
+            backupCount=int(config.getOption("daemon", "backup_count", 10)),
+            logQueue=config.getOption("daemon", "log_queue") == "on",
+            logMaxOpenFiles=int(config.getOption("daemon", "log_max_open_files", 64)),
+            maxConnRetries=config.getint("daemon", "max_conn_retries"),
+            connRetrySleep=config.getint("daemon", "conn_retry_sleep"),
+            fetchInterval=config.getint("daemon", "fetch_interval"),
+            maxEventBatchSize=int(config.getOption("daemon", "max_event_batch_size", 500)),
+            prefetchPages=int(config.getOption("daemon", "prefetch_pages", 1)),
+            serverSideFiltering=config.getOption("daemon", "server_side_filtering", "on")
+            == "on",
+            checkpointEvents=int(config.getOption("daemon", "checkpoint_events", 100)),
+            checkpointInterval=int(config.getOption("daemon", "checkpoint_interval", 1000))
+            / 1000.0,
+            dispatchThreads=int(config.getOption("daemon", "dispatch_threads", 0)),
+            metricsPort=int(config.getOption("daemon", "metrics_port", 0)),
+            metricsAddress=config.getOption("daemon", "metrics_address", "127.0.0.1"),
+            callbackTimeout=int(config.getOption("daemon", "callback_timeout", 0)),
+            callbackTimeoutAction=config.getOption(
+                "daemon", "callback_timeout_action", "log"
+            ),
+            shotgunCallAccounting=config.getOption("daemon", "sg_call_accounting")
+            == "on",
+            recordFile=config.getOption("daemon", "record_file"),
+            backfillThreads=int(config.getOption("daemon", "backfill_threads", 4)),
+            backfillFetchThreads=int(
+                config.getOption("daemon", "backfill_fetch_threads", 4)
+            ),
+        )
 
-    def getEmailSubject(self):
-        return self.get("emails", "subject")
+        values["logFile"] = config.get("daemon", "logFile")
+        if values["logPath"] is not None:
+            values["logFile"] = os.path.join(values["logPath"], values["logFile"])
+        values["timingLogFile"] = None
+        if config.getOption("daemon", "timing_log") == "on":
+            values["timingLogFile"] = values["logFile"] + ".timing"
+
+        values.update(
+            pluginPaths=tuple(config.getListOption("plugins", "paths")),
+            pluginReloadInterval=int(config.getOption("plugins", "reload_interval", 30)),
+            pluginWatcher=config.getOption("plugins", "watcher", "auto"),
+            sentryDsn=config.getOption("sentry", "sentry_dsn"),
+            smtpServer=config.get("emails", "server"),
+            smtpPort=int(config.getOption("emails", "port", 25)),
+            fromAddr=config.get("emails", "from"),
+            toAddrs=tuple(config.getListOption("emails", "to")),
+            emailSubject=config.get("emails", "subject"),
+            emailUsername=config.getOption("emails", "username"),
+            emailPassword=config.getOption("emails", "password"),
+            secureSMTP=config.has_option("emails", "useTLS")
+            and config.getboolean("emails", "useTLS"),
+            digestWindow=int(config.getOption("emails", "digest_window", 0)),
+            digestMaxRecords=int(config.getOption("emails", "digest_max_records", 20)),
+            profileCallbacks=tuple(config.getListOption("profiling", "callbacks")),
+            profileSampleRate=float(config.getOption("profiling", "sample_rate", 0.01)),
+            profilePath=config.getOption(
+                "profiling",
+                "path",
+                os.path.join(values["logPath"] or "", "profiles"),
+            ),
+            profileInterval=int(config.getOption("profiling", "interval", 300)),
+            profileBackupCount=int(config.getOption("profiling", "backup_count", 10)),
+            shardWorkers=int(config.getOption("sharding", "workers", 1)),
+            leaseStore=config.getOption(
+                "sharding", "lease_store", values["eventIdFile"] + ".leases"
+            ),
+            leaseTtl=int(config.getOption("sharding", "lease_ttl", 10)),
+        )
 
-    def getEmailUsername(self):
-        if self.has_option("emails", "username"):
-            return self.get("emails", "username")
-        return None
+        assignments = []
+        for assignment in config.getListOption("sharding", "assignments"):
+            pluginName, _, worker = assignment.partition(":")
+            assignments.append((pluginName.strip(), int(worker)))
+        values["shardAssignments"] = tuple(assignments)
+        return values
 
-    def getEmailPassword(self):
-        if self.has_option("emails", "password"):
-            return self.get("emails", "password")
-        return None
+    def __setattr__(self, name, value):
+        raise AttributeError("The config snapshot is read only.")
 
-    def getSecureSMTP(self):
-        if self.has_option("emails", "useTLS"):
-            return self.getboolean("emails", "useTLS") or False
-        return False
+    def __delattr__(self, name):
+        raise AttributeError("The config snapshot is read only.")
 
-    def getLogMode(self):
-        return self.getint("daemon", "logMode")
+    def update(self, newer):
+        """
+        Get the settings of a newer snapshot that can change while the daemon
+        runs, keeping the current value of the others.
 
-    def getLogLevel(self):
-        return self.getint("daemon", "logging")
+        @param newer: The snapshot of the config read again.
+        @type newer: L{ConfigSnapshot}
 
-    def getMaxEventBatchSize(self):
-        if self.has_option("daemon", "max_event_batch_size"):
-            return self.getint("daemon", "max_event_batch_size")
-        return 500
+        @return: The updated snapshot and the names of the settings that
+            changed but need a restart.
+        @rtype: I{tuple} of L{ConfigSnapshot} and I{list} of I{str}
+        """
+        values = dict(newer.__dict__)
+        ignored = []
+        for name in self.RESTART_SETTINGS:
+            if values[name] != self.__dict__[name]:
+                ignored.append(name)
+            values[name] = self.__dict__[name]
+
+        snapshot = object.__new__(ConfigSnapshot)
+        snapshot.__dict__.update(values)
+        return snapshot, ignored
+
+    def getWorkerSnapshot(self, worker):
+        """
+        Get the settings of a worker of a sharded daemon. Each worker has its
+        own pid file, event id file and engine log file, named after the
+        configured ones with the worker number appended.
 
-    def getLogFile(self, filename=None):
-        if filename is None:
-            if self.has_option("daemon", "logFile"):
-                filename = self.get("daemon", "logFile")
-            else:
-                raise ConfigError("The config file has no logFile option.")
+        @param worker: The number of the worker, from 1 to the number of
+            workers.
+        @type worker: I{int}
 
-        if self.has_option("daemon", "logPath"):
-            path = self.get("daemon", "logPath")
+        @return: The settings of the worker.
+        @rtype: L{ConfigSnapshot}
 
-            if not os.path.exists(path):
-                os.makedirs(path)
-            elif not os.path.isdir(path):
-                raise ConfigError(
-                    "The logPath value in the config should point to a directory."
-                )
+        @raise ConfigError: If the daemon isn't sharded or has no such worker.
+        """
+        if self.shardWorkers == 1:
+            raise ConfigError("The daemon isn't sharded, it has no workers.")
+        if not 1 <= worker <= self.shardWorkers:
+            raise ConfigError(
+                "There is no worker %d, the daemon runs as %d workers."
+                % (worker, self.shardWorkers)
+            )
 
-            path = os.path.join(path, filename)
+        values = dict(self.__dict__)
+        suffix = ".%d" % worker
+        for name in ("enginePidFile", "eventIdFile", "logFile"):
+            values[name] += suffix
+        if values["timingLogFile"]:
+            values["timingLogFile"] = values["logFile"] + ".timing"
 
-        else:
-            path = filename
+        snapshot = object.__new__(ConfigSnapshot)
+        snapshot.__dict__.update(values)
+        return snapshot
 
-        return path
+    def getDetachedSnapshot(self):
+        """
+        Get the settings of an engine processing events next to the daemon,
+        see L{DetachedEngine}. Metrics, callback profiling and callback
+        timeouts are turned off so the engine doesn't clash with the daemon.
 
-    def getTimingLogFile(self):
-        if (
-            not self.has_option("daemon", "timing_log")
-            or self.get("daemon", "timing_log") != "on"
-        ):
-            return None
+        @return: The settings of the detached engine.
+        @rtype: L{ConfigSnapshot}
+        """
+        values = dict(self.__dict__)
+        values.update(
+            metricsPort=0, profileCallbacks=(), callbackTimeout=0, recordFile=None
+        )
 
-        return self.getLogFile() + ".timing"
+        snapshot = object.__new__(ConfigSnapshot)
+        snapshot.__dict__.update(values)
+        return snapshot
 
-    def getSentryDsn(self):
-        if self.has_option('sentry', 'sentry_dsn') and self.get('sentry', 'sentry_dsn'):
-            return self.get('sentry', 'sentry_dsn')
-        else:
-            return None
+    def getLogFile(self, filename):
+        """
+        @param filename: The name of a log file.
+        @type filename: I{str}
 
-    def getBackupCount(self):
-        if self.has_option("daemon", "backup_count"):
-            return self.getint("daemon", "backup_count")
-        return 10
+        @return: The path of the log file in the log directory.
+        @rtype: I{str}
+        """
+        if self.logPath is None:
+            return filename
+        return os.path.join(self.logPath, filename)
 
 
 class Engine(object):
@@ -333,39 +745,63 @@ class Engine(object):
     The engine holds the main loop of event processing.
     """
 
-    def __init__(self, configPath):
+    def __init__(self, configPath, worker=None):
         """
+        @param configPath: The path of the config file.
+        @type configPath: I{str}
+        @param worker: The number of the worker to run, if the daemon is
+            sharded across several workers.
+        @type worker: I{int}
         """
         self._continue = True
         self._eventIdData = {}
+        self._uncheckpointedEvents = 0
+        self._lastCheckpointTime = time.time()
+        self._fetchedFullBatch = False
+        self._missingEventIdRanges = None
 
         # Read/parse the config
+        self._configPath = configPath
+        self._reloadConfigRequested = False
         self.config = Config(configPath)
+        self.settings = self.config.getSnapshot()
+        if worker is not None:
+            self.settings = self.settings.getWorkerSnapshot(worker)
 
+        self._sentryHandler = None
         self.set_sentry_notification()
 
         # Get config values
         self._pluginCollections = [
-            PluginCollection(self, s) for s in self.config.getPluginPaths()
+            PluginCollection(self, s) for s in self.settings.pluginPaths
         ]
-        self._sg = sg.Shotgun(
-            self.config.getShotgunURL(),
-            self.config.getEngineScriptName(),
-            self.config.getEngineScriptKey(),
-            http_proxy=self.config.getEngineProxyServer(),
-        )
-        self._max_conn_retries = self.config.getint("daemon", "max_conn_retries")
-        self._conn_retry_sleep = self.config.getint("daemon", "conn_retry_sleep")
-        self._fetch_interval = self.config.getint("daemon", "fetch_interval")
-        self._use_session_uuid = self.config.getboolean("shotgun", "use_session_uuid")
+        self._sg = self._createShotgun()
+        self._shotgunPool = self._createShotgunPool()
+        self._pluginWatcher = None
+
+        # Setup the background writer of the log files. Its thread is only
+        # started along with the engine so it survives daemonization.
+        if self.settings.logQueue:
+            self._logWriter = LogWriter(self.settings.logMaxOpenFiles)
+        else:
+            self._logWriter = None
+
+        # Setup the background sending of email digests. Its thread is only
+        # started along with the engine so it survives daemonization.
+        if self.settings.digestWindow > 0:
+            self._mailWorker = MailWorker(
+                self.settings.digestWindow, self.settings.digestMaxRecords
+            )
+        else:
+            self._mailWorker = None
 
         # Setup the loggers for the main engine
-        if self.config.getLogMode() == 0:
+        if self.settings.logMode == 0:
             # Set the root logger for file output.
             rootLogger = logging.getLogger()
             rootLogger.config = self.config
-            _setFilePathOnLogger(rootLogger, self.config.getLogFile(), self.config.getBackupCount())
-            print(self.config.getLogFile())
+            self._setLogFile(rootLogger, self.settings.logFile)
+            print(self.settings.logFile)
 
             # Set the engine logger for email output.
             self.log = logging.getLogger("engine")
@@ -374,22 +810,164 @@ class Engine(object):
             # Set the engine logger for file and email output.
             self.log = logging.getLogger("engine")
             self.log.config = self.config
-            _setFilePathOnLogger(self.log, self.config.getLogFile(), self.config.getBackupCount())
+            self._setLogFile(self.log, self.settings.logFile)
             self.setEmailsOnLogger(self.log, True)
 
-        self.log.setLevel(self.config.getLogLevel())
+        self.log.setLevel(self.settings.logLevel)
 
         # Setup the timing log file
-        timing_log_filename = self.config.getTimingLogFile()
+        timing_log_filename = self.settings.timingLogFile
         if timing_log_filename:
             self.timing_logger = logging.getLogger("timing")
-            self.timing_logger.setLevel(self.config.getLogLevel())
-            _setFilePathOnLogger(self.timing_logger, timing_log_filename, self.config.getBackupCount())
+            self.timing_logger.setLevel(self.settings.logLevel)
+            self._setLogFile(self.timing_logger, timing_log_filename)
         else:
             self.timing_logger = None
 
+        # Setup the table routing events to the callbacks registered for them
+        self._router = EventRouter()
+
+        # Setup the sharing of the plugins with the other workers. Plugins are
+        # only loaded once their lease is taken.
+        self._shard = self._createPluginShard(worker)
+        if self._shard:
+            for collection in self._pluginCollections:
+                collection.setBasenames(set())
+
+        # Setup the metrics, served over HTTP if a port is configured. The
+        # server is only started along with the engine.
+        self.metrics = EngineMetrics()
+        self._metricsServer = None
+
+        # Setup the profiling of sampled callback invocations
+        self.profiler = CallbackProfiler(self)
+
+        # Setup the watchdog of slow callbacks. Its thread is only started
+        # along with the engine so it survives daemonization.
+        self.watchdog = CallbackWatchdog(self)
+
+        # Setup the prefetching of event pages, which needs its own connection
+        prefetchPages = self.settings.prefetchPages
+        if prefetchPages > 0:
+            self._prefetcher = EventPrefetcher(
+                self, self._createShotgun(), prefetchPages
+            )
+        else:
+            self._prefetcher = None
+
+        # Setup the recording of the events and of the Shotgun responses the
+        # callbacks get, for them to be replayed later on.
+        if self.settings.recordFile:
+            self._recorder = EventRecorder(self.settings.recordFile, self.log)
+        else:
+            self._recorder = None
+
+        # Setup the persistent storage of the event id data
+        self._eventIdStore = self._createEventIdStore()
+
+        # Setup the concurrent dispatcher. Its worker threads are only started
+        # along with the main loop so they survive daemonization.
+        dispatchThreads = self.settings.dispatchThreads
+        if dispatchThreads > 0:
+            self._dispatcher = EventDispatcher(self, dispatchThreads)
+        else:
+            self._dispatcher = None
+
         super(Engine, self).__init__()
 
+    def _setLogFile(self, logger, path):
+        """
+        Make a logger write to a log file, rotated at midnight.
+
+        @param logger: The logger to setup.
+        @type logger: L{logging.Logger}
+        @param path: The path of the log file.
+        @type path: I{str}
+        """
+        _setFilePathOnLogger(
+            logger, path, self.settings.backupCount, self._logWriter
+        )
+
+    def _createShotgun(self):
+        """
+        @return: A new connection with the engine's credentials.
+        @rtype: L{sg.Shotgun}
+        """
+        return sg.Shotgun(
+            self.settings.shotgunUrl,
+            self.settings.engineScriptName,
+            self.settings.engineScriptKey,
+            http_proxy=self.settings.engineProxyServer,
+        )
+
+    def _createShotgunPool(self):
+        """
+        @return: The pool of the connections used by the callbacks.
+        @rtype: L{ShotgunPool}
+        """
+        return ShotgunPool(self.settings.shotgunUrl, self.settings.engineProxyServer)
+
+    def _wrapCallbackShotgun(self, shotgun, event):
+        """
+        Get the connection a callback processes an event with.
+
+        @param shotgun: The connection taken from the pool.
+        @type shotgun: L{sg.Shotgun}
+        @param event: The event the callback processes.
+        @type event: I{dict}
+
+        @return: The connection itself, or a wrapper recording the responses
+            it gets if recording is on.
+        @rtype: L{sg.Shotgun} or L{RecordingShotgun}
+        """
+        if self._recorder:
+            return RecordingShotgun(shotgun, self._recorder, event["id"])
+        return shotgun
+
+    def _createPluginShard(self, worker):
+        """
+        @param worker: The number of the worker to run, if any.
+        @type worker: I{int}
+
+        @return: What decides which plugins the worker runs, None if the
+            daemon isn't sharded.
+        @rtype: L{PluginShard}
+
+        @raise ConfigError: If the daemon is sharded but no worker was given.
+        """
+        numWorkers = self.settings.shardWorkers
+        if numWorkers == 1:
+            return None
+        if worker is None:
+            raise ConfigError(
+                "The daemon runs as %d workers, start each of them with its number."
+                % numWorkers
+            )
+        return PluginShard(
+            PluginLeaseStore(self.settings.leaseStore),
+            worker,
+            numWorkers,
+            dict(self.settings.shardAssignments),
+            self.settings.leaseTtl,
+            self.log,
+        )
+
+    def _createEventIdStore(self):
+        eventIdFile = self.settings.eventIdFile
+        if eventIdFile is None:
+            return None
+
+        storeType = self.settings.eventIdStore
+        if storeType == "pickle":
+            return PickleEventIdStore(eventIdFile, self.log)
+        elif storeType == "journal":
+            return JournalEventIdStore(
+                eventIdFile, self.log, self.settings.journalCompaction
+            )
+        raise ConfigError(
+            "Unknown event_id_store value in the config: %s." % storeType
+        )
+
     def setEmailsOnLogger(self, logger, emails):
         # Configure the logger for email output
         _removeHandlersFromLogger(logger, logging.handlers.SMTPHandler)
@@ -397,19 +975,19 @@ class Engine(object):
         if emails is False:
             return
 
-        smtpServer = self.config.getSMTPServer()
-        smtpPort = self.config.getSMTPPort()
-        fromAddr = self.config.getFromAddr()
-        emailSubject = self.config.getEmailSubject()
-        username = self.config.getEmailUsername()
-        password = self.config.getEmailPassword()
-        if self.config.getSecureSMTP():
+        smtpServer = self.settings.smtpServer
+        smtpPort = self.settings.smtpPort
+        fromAddr = self.settings.fromAddr
+        emailSubject = self.settings.emailSubject
+        username = self.settings.emailUsername
+        password = self.settings.emailPassword
+        if self.settings.secureSMTP:
             secure = (None, None)
         else:
             secure = None
 
         if emails is True:
-            toAddrs = self.config.getToAddrs()
+            toAddrs = list(self.settings.toAddrs)
         elif isinstance(emails, (list, tuple)):
             toAddrs = emails
         else:
@@ -425,15 +1003,25 @@ class Engine(object):
             username,
             password,
             secure,
+            self._mailWorker,
         )
 
     def set_sentry_notification(self):
-        sentry_dsn = self.config.getSentryDsn()
+        sentry_dsn = self.settings.sentryDsn
         if sentry_dsn:
-            sentry_sdk.init(dsn=sentry_dsn, ignore_errors=[KeyboardInterrupt], before_send=_sentry_pre_send)
+            # Records are handed over to Sentry from a background thread
+            # rather than by its logging integration.
+            sentry_sdk.init(
+                dsn=sentry_dsn,
+                ignore_errors=[KeyboardInterrupt],
+                before_send=_sentry_pre_send,
+                integrations=[LoggingIntegration(level=None, event_level=None)],
+            )
+            self._sentryHandler = SentryLogHandler()
+            logging.getLogger().addHandler(self._sentryHandler)
             with sentry_sdk.configure_scope() as scope:
                 shotgun_account_name = re.match('.*://(.*).(shotgunstudio|shotgrid.autodesk).com',
-                                                self.config.getShotgunURL()).group(1)
+                                                self.settings.shotgunUrl).group(1)
                 scope.set_tag("shotgun_account", shotgun_account_name)
                 scope.level = 'fatal'
 
@@ -447,21 +1035,131 @@ class Engine(object):
         # TODO: Take value from config
         socket.setdefaulttimeout(60)
 
+        if self._logWriter:
+            self._logWriter.start()
+        if self._mailWorker:
+            self._mailWorker.start()
+        if self._sentryHandler:
+            self._sentryHandler.start()
+        self._startMonitoring()
+
         # Notify which version of shotgun api we are using
         self.log.info("Using SG Python API version %s" % sg.__version__)
 
+        # Read the config again on SIGHUP, between two batches of events
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self._requestConfigReload)
+
         try:
+            # Watch the plugin paths before loading the plugins so changes
+            # made in the meantime are picked up by the main loop.
+            self._pluginWatcher = self._createPluginWatcher()
+
             for collection in self._pluginCollections:
                 collection.load()
+            self._updatePlugins()
 
             self._loadEventIdData()
 
+            if self._shard:
+                self._shard.start()
+                self._updatePluginLeases()
+
+            if self._pluginWatcher:
+                self._pluginWatcher.start()
+
             self._mainLoop()
         except KeyboardInterrupt:
             self.log.warning("Keyboard interrupt. Cleaning up...")
+            if self._uncheckpointedEvents:
+                self._saveEventIdData()
         except Exception as err:
             msg = "Crash!!!!! Unexpected error (%s) in main loop.\n\n%s"
             self.log.critical(msg, type(err), traceback.format_exc(err))
+        finally:
+            if self._shard:
+                self._shard.stop(self._getPluginStates())
+            self._stopMonitoring()
+            if self._recorder:
+                self._recorder.close()
+            if self._mailWorker:
+                self._mailWorker.stop()
+            if self._sentryHandler:
+                self._sentryHandler.stop()
+            if self._logWriter:
+                self._logWriter.stop()
+
+    def _startMonitoring(self):
+        """
+        Start watching for slow callbacks and serving the metrics.
+        """
+        self.watchdog.start()
+        if self.settings.metricsPort:
+            try:
+                self._metricsServer = MetricsServer(
+                    self.metrics, self.settings.metricsAddress, self.settings.metricsPort
+                )
+                self._metricsServer.start()
+            except socket.error as err:
+                self.log.error(
+                    "Could not serve metrics on %s:%d. %s",
+                    self.settings.metricsAddress,
+                    self.settings.metricsPort,
+                    err,
+                )
+
+    def _stopMonitoring(self):
+        """
+        Stop watching for slow callbacks and serving the metrics, and write
+        the pending callback profiles.
+        """
+        self.watchdog.stop()
+        self.profiler.dumpStats()
+        if self._metricsServer:
+            self._metricsServer.stop()
+
+    def _requestConfigReload(self, signum, frame):
+        self._reloadConfigRequested = True
+
+    def reloadConfig(self):
+        """
+        Read the config file again and use the new settings.
+
+        Settings listed in L{ConfigSnapshot.RESTART_SETTINGS} keep their
+        current value until the daemon is restarted. If the config is invalid,
+        the current settings are kept.
+
+        @return: True if the config was reloaded, False otherwise.
+        @rtype: I{bool}
+        """
+        self._reloadConfigRequested = False
+        # The values looked up in AWS were cached when the daemon started, they
+        # are refreshed in the background.
+        try:
+            config = Config(self._configPath)
+            settings, ignored = self.settings.update(config.getSnapshot())
+        except (ConfigError, configparser.Error) as err:
+            self.log.error(
+                "Could not reload the config, keeping the current one. %s", err
+            )
+            return False
+
+        for name in ignored:
+            self.log.warning("The %s setting changes on the next restart.", name)
+
+        self.config = config
+        self.settings = settings
+
+        self.log.config = config
+        self.log.setLevel(settings.logLevel)
+        if self.timing_logger:
+            self.timing_logger.setLevel(settings.logLevel)
+        for collection in self._pluginCollections:
+            for plugin in collection:
+                plugin.setConfig(config)
+
+        self.log.info("Reloaded the config from %s.", self._configPath)
+        return True
 
     def _loadEventIdData(self):
         """
@@ -472,13 +1170,12 @@ class Engine(object):
         contacting Shotgun to get the latest event's id and we'll start
         processing from there.
         """
-        eventIdFile = self.config.getEventIdFile()
+        eventIdFile = self.settings.eventIdFile
 
         if eventIdFile and os.path.exists(eventIdFile):
             try:
-                fh = open(eventIdFile, "rb")
                 try:
-                    self._eventIdData = pickle.load(fh)
+                    self._eventIdData = self._eventIdStore.load()
 
                     # Provide event id info to the plugin collections. Once
                     # they've figured out what to do with it, ask them for their
@@ -518,12 +1215,10 @@ class Engine(object):
                             collection.setState(state)
 
                 except pickle.UnpicklingError:
-                    fh.close()
-
                     # Backwards compatibility:
                     # Reopen the file to try to read an old-style int
-                    fh = open(eventIdFile, "rb")
-                    line = fh.readline().strip()
+                    with open(eventIdFile, "rb") as fh:
+                        line = fh.readline().strip()
                     if line.isdigit():
                         # The _loadEventIdData got an old-style id file containing a single
                         # int which is the last id properly processed.
@@ -533,7 +1228,6 @@ class Engine(object):
                         )
                         for collection in self._pluginCollections:
                             collection.setState(lastEventId)
-                fh.close()
             except OSError as err:
                 raise EventDaemonError(
                     "Could not load event id from file.\n\n%s"
@@ -575,15 +1269,17 @@ class Engine(object):
         Run the event processing loop.
 
         General behavior:
-        - Load plugins from disk - see L{load} method.
         - Get new events from Shotgun
         - Loop through events
         - Loop through each plugin
         - Loop through each callback
         - Send the callback an event
-        - Once all callbacks are done in all plugins, save the eventId
+        - Once all callbacks are done in all plugins, checkpoint the eventId
         - Go to the next event
-        - Once all events are processed, wait for the defined fetch interval time and start over.
+        - Once all events are processed, save the eventId
+        - Wait for the defined fetch interval time
+        - Reload the plugins the plugin watcher found changes for - see
+          L{PluginCollection.reload} method - and start over.
 
         Caveats:
         - If a plugin is deemed "inactive" (an error occured during
@@ -593,28 +1289,233 @@ class Engine(object):
         - Each time through the loop, if the pidFile is gone, stop.
         """
         self.log.debug("Starting the event processing loop.")
+        if self._dispatcher:
+            self._dispatcher.start()
+
         while self._continue:
-            # Process events
-            events = self._getNewEvents()
-            for event in events:
-                for collection in self._pluginCollections:
-                    collection.process(event)
+            # Process events, unless the plugin leases may have been taken
+            # over by another worker since they were last renewed.
+            if self._shard and not self._shard.holdsLeases():
+                self.log.warning(
+                    "The plugin leases could not be renewed, waiting to process events."
+                )
+                events = []
+                self._fetchedFullBatch = False
+            else:
+                events = self._getNewEvents()
+            if self._recorder and events:
+                self._recorder.recordEvents(events)
+            if self._dispatcher:
+                self._dispatchEvents(events)
+            else:
+                for event in events:
+                    routes = self._router.route(event)
+                    for collection in self._pluginCollections:
+                        collection.process(event, routes)
+                    self.metrics.observeEventLag(event)
+                    self._checkpointEventIdData()
+
+            if self._uncheckpointedEvents:
                 self._saveEventIdData()
+            if self._recorder:
+                self._recorder.flush()
 
             # if we're lagging behind Shotgun, we received a full batch of events
             # skip the sleep() call in this case
-            if len(events) < self.config.getMaxEventBatchSize():
-                time.sleep(self._fetch_interval)
+            if not self._fetchedFullBatch:
+                time.sleep(self.settings.fetchInterval)
 
-            # Reload plugins
-            for collection in self._pluginCollections:
-                collection.load()
+            if self._reloadConfigRequested:
+                self.reloadConfig()
 
-            # Make sure that newly loaded events have proper state.
-            self._loadEventIdData()
+            # Reload plugins. The in-memory state stays authoritative, newly
+            # loaded plugins pick up their state from their collection.
+            self._reloadPlugins()
+
+            if self._shard:
+                self._updatePluginLeases()
+
+        if self._dispatcher:
+            self._dispatcher.stop()
+        if self._prefetcher:
+            self._prefetcher.cancel()
+        if self._pluginWatcher:
+            self._pluginWatcher.stop()
 
         self.log.debug("Shuting down event processing loop.")
 
+    def _createPluginWatcher(self):
+        """
+        @return: What finds the changes to the plugin files, None if plugins
+            aren't reloaded.
+        @rtype: L{PluginWatcher}
+        """
+        paths = [collection.path for collection in self._pluginCollections]
+        interval = self.settings.pluginReloadInterval
+        watcherType = self.settings.pluginWatcher
+
+        if watcherType in ("auto", "inotify"):
+            try:
+                return InotifyPluginWatcher(paths)
+            except OSError as err:
+                if watcherType == "inotify":
+                    raise
+                self.log.debug(
+                    "Can not watch plugins with inotify, polling instead: %s", err
+                )
+        elif watcherType != "poll":
+            raise ConfigError(
+                "Unknown watcher value in the config: %s." % watcherType
+            )
+
+        return PollingPluginWatcher(paths, interval)
+
+    def _reloadPlugins(self):
+        """
+        Reload the plugins the plugin watcher found changes for.
+
+        @return: True if any plugin was loaded, reloaded or removed, False
+            otherwise.
+        @rtype: I{bool}
+        """
+        if not self._pluginWatcher:
+            return False
+
+        changes = self._pluginWatcher.getChanges()
+        changed = False
+        for collection in self._pluginCollections:
+            if collection.path not in changes:
+                continue
+
+            basenames = changes[collection.path]
+            if basenames is None:
+                reloaded = collection.load()
+            else:
+                reloaded = collection.reload(basenames)
+            if reloaded:
+                changed = True
+
+        if changed:
+            self._updatePlugins()
+        return changed
+
+    def _updatePlugins(self):
+        """
+        Take the plugins loaded, reloaded or removed into account: route the
+        events to their callbacks and close the connections of the scripts
+        they don't use anymore.
+        """
+        self._router.compile(self._pluginCollections)
+        self._shotgunPool.retain(
+            set(
+                callback.getCredentials()
+                for collection in self._pluginCollections
+                for plugin in collection
+                for callback in plugin
+                if callback.getCredentials() is not None
+            )
+        )
+
+    def _updatePluginLeases(self):
+        """
+        Run the plugins this worker holds the leases of, see L{PluginShard}.
+
+        Plugins taken over from another worker start from the last event id
+        data recorded with their lease, or else from the one in this worker's
+        event id file, or else from the latest event in Shotgun.
+
+        @return: True if any plugin was loaded or unloaded, False otherwise.
+        @rtype: I{bool}
+        """
+        keys = set()
+        for collection in self._pluginCollections:
+            try:
+                pluginNames = collection.listPluginNames()
+            except OSError as err:
+                self.log.warning(
+                    "Could not list the plugins in %s, keeping the current leases. %s",
+                    collection.path,
+                    err,
+                )
+                return False
+            keys.update((collection.path, pluginName) for pluginName in pluginNames)
+
+        try:
+            owned, acquired = self._shard.update(keys, self._getPluginStates())
+        except sqlite3.Error as err:
+            self.log.warning("Could not update the plugin leases. %s", err)
+            return False
+
+        lastEventId = None
+        changed = False
+        for collection in self._pluginCollections:
+            collectionState = collection.getState()
+            for (path, pluginName), state in acquired.items():
+                if path != collection.path:
+                    continue
+                if state is None:
+                    state = collectionState.get(pluginName)
+                if state is None:
+                    if lastEventId is None:
+                        lastEventId = self._getLastEventIdFromDatabase()
+                    state = lastEventId
+                collection.setPluginState(pluginName, state)
+
+            basenames = set(
+                pluginName + ".py"
+                for path, pluginName in owned
+                if path == collection.path
+            )
+            if collection.setBasenames(basenames) and collection.load():
+                changed = True
+
+        if changed:
+            self._updatePlugins()
+        return changed
+
+    def _getPluginStates(self):
+        """
+        @return: The last event id data of the loaded plugins, keyed by
+            plugin path and plugin name.
+        @rtype: I{dict}
+        """
+        states = {}
+        for collection in self._pluginCollections:
+            for plugin in collection:
+                states[(collection.path, plugin.getName())] = plugin.getState()
+        return states
+
+    def _dispatchEvents(self, events):
+        """
+        Process a batch of events on the dispatcher's worker threads.
+
+        Every event is handed to the dispatcher for each plugin that wants it.
+        Results are then committed in event id order so a plugin's last event
+        id only moves forward once all of its earlier events are done.
+
+        @param events: The events to process, sorted by id.
+        @type events: I{list} of Shotgun event dictionaries.
+        """
+        pending = []
+        for event in events:
+            routes = self._router.route(event)
+            jobs = []
+            for collection in self._pluginCollections:
+                jobs.extend(collection.dispatch(event, self._dispatcher, routes))
+            pending.append((event, jobs))
+
+        failedPlugins = set()
+        for event, jobs in pending:
+            for job in jobs:
+                # Once a plugin fails on an event its last event id stays put,
+                # even if later events were processed in the meantime.
+                processed = job.wait() and job.plugin not in failedPlugins
+                if not processed:
+                    failedPlugins.add(job.plugin)
+                job.plugin.commitEvent(event, processed)
+            self.metrics.observeEventLag(event)
+            self._checkpointEventIdData()
+
     def stop(self):
         self._continue = False
 
@@ -622,58 +1523,288 @@ class Engine(object):
         """
         Fetch new events from Shotgun.
 
+        New events are fetched from the next event id that any plugin needs.
+        Events still missing from the plugins' backlogs are looked up by id in
+        a separate query so they don't make the daemon fetch the events that
+        follow them again.
+
+        While the daemon is lagging behind, the next page of new events is
+        prefetched in the background as the current one is processed.
+
+        When server side filtering is on, only events some active callback is
+        registered for are fetched. The ids of the gaps between them are then
+        looked up without the filter, so that only the ones of no event at
+        all are considered missing, see L{getMissingEventIdRanges}.
+
         @return: Recent events that need to be processed by the engine.
         @rtype: I{list} of Shotgun event dictionaries.
         """
         nextEventId = None
-        for newId in [
-            coll.getNextUnprocessedEventId() for coll in self._pluginCollections
-        ]:
+        backlogRanges = []
+        for coll in self._pluginCollections:
+            newId = coll.getNextNewEventId()
             if newId is not None and (nextEventId is None or newId < nextEventId):
                 nextEventId = newId
+            backlogRanges.extend(coll.getBacklogEventRanges())
+
+        maxEventBatchSize = self.settings.maxEventBatchSize
+        self._fetchedFullBatch = False
+        self._missingEventIdRanges = None
 
+        eventFilters = self._getEventFilters()
+        fields = self._getEventFields()
+
+        events = []
         if nextEventId is not None:
-            filters = [["id", "greater_than", nextEventId - 1]]
-            fields = [
-                "id",
-                "event_type",
-                "attribute_name",
-                "meta",
-                "entity",
-                "user",
-                "project",
-                "session_uuid",
-                "created_at",
-            ]
-            order = [{"column": "id", "direction": "asc"}]
+            events = None
+            if self._prefetcher:
+                events = self._prefetcher.take(
+                    nextEventId, eventFilters, fields, maxEventBatchSize
+                )
+            if events is None:
+                events = self._findEvents(
+                    [["id", "greater_than", nextEventId - 1]] + eventFilters,
+                    fields,
+                    maxEventBatchSize,
+                )
+            self._fetchedFullBatch = len(events) >= maxEventBatchSize
 
-            conn_attempts = 0
-            while True:
-                try:
-                    events = self._sg.find(
-                        "EventLogEntry",
-                        filters,
-                        fields,
-                        order,
-                        limit=self.config.getMaxEventBatchSize(),
-                    )
-                    if events:
-                        self.log.debug(
-                            "Got %d events: %d to %d.",
-                            len(events),
-                            events[0]["id"],
-                            events[-1]["id"],
-                        )
-                    return events
-                except (sg.ProtocolError, sg.ResponseError, socket.error) as err:
-                    conn_attempts = self._checkConnectionAttempts(
-                        conn_attempts, str(err)
+            if self._prefetcher and self._fetchedFullBatch:
+                self._prefetcher.prefetch(
+                    events[-1]["id"] + 1, eventFilters, fields, maxEventBatchSize
+                )
+
+            if eventFilters:
+                self._missingEventIdRanges = self._findMissingEventIds(
+                    nextEventId, events
+                )
+
+        if backlogRanges:
+            backlogEvents = self._findBacklogEvents(
+                EventIdBacklog.mergeRanges(backlogRanges),
+                eventFilters,
+                fields,
+                maxEventBatchSize,
+            )
+            if backlogEvents:
+                newIds = set(event["id"] for event in events)
+                events.extend(e for e in backlogEvents if e["id"] not in newIds)
+                events.sort(key=lambda event: event["id"])
+
+        return events
+
+    def _findMissingEventIds(self, firstId, events):
+        """
+        Find the ids of no event at all among the ones skipped by events
+        fetched with server side filtering.
+
+        Only the ids skipped by events newer than L{BACKLOG_TIMEOUT} are
+        looked up, older ones never happen if they are missing.
+
+        @param firstId: The id the events were fetched from.
+        @type firstId: I{int}
+        @param events: The events fetched, sorted by id.
+        @type events: I{list} of Shotgun event dictionaries.
+
+        @return: The missing ids as inclusive (first id, last id) ranges.
+        @rtype: I{list} of I{tuple}
+        """
+        recentDate = datetime.datetime.now() - datetime.timedelta(
+            minutes=BACKLOG_TIMEOUT
+        )
+        gaps = []
+        nextId = firstId
+        for event in events:
+            if (
+                event["id"] > nextId
+                and event["created_at"].replace(tzinfo=None) > recentDate
+            ):
+                gaps.append((nextId, event["id"] - 1))
+            nextId = event["id"] + 1
+        if not gaps:
+            return []
+
+        eventIds = [
+            event["id"]
+            for event in self._findEvents(
+                [["id", "between", [gaps[0][0], gaps[-1][1]]]], ["id"]
+            )
+        ]
+        missingRanges = []
+        for start, end in gaps:
+            nextId = start
+            first = bisect.bisect_left(eventIds, start)
+            last = bisect.bisect_right(eventIds, end)
+            for eventId in eventIds[first:last]:
+                if eventId > nextId:
+                    missingRanges.append((nextId, eventId - 1))
+                nextId = eventId + 1
+            if nextId <= end:
+                missingRanges.append((nextId, end))
+        return missingRanges
+
+    def getMissingEventIdRanges(self, firstId, lastId):
+        """
+        Get the ids of no event among ids skipped by the last events fetched.
+
+        Ids left out by server side filtering belong to events no plugin
+        wants and aren't missing, see L{_findMissingEventIds}.
+
+        @param firstId: The first id skipped.
+        @type firstId: I{int}
+        @param lastId: The last id skipped.
+        @type lastId: I{int}
+
+        @return: The missing ids as inclusive (first id, last id) ranges.
+        @rtype: I{list} of I{tuple}
+        """
+        if self._missingEventIdRanges is None:
+            return [(firstId, lastId)]
+        return [
+            (max(start, firstId), min(end, lastId))
+            for start, end in self._missingEventIdRanges
+            if start <= lastId and end >= firstId
+        ]
+
+    def _findBacklogEvents(self, backlogRanges, eventFilters, fields, limit):
+        """
+        Find the events of the plugins' backlogs.
+
+        Past L{MAX_BACKLOG_QUERY_RANGES} ranges, the whole span of the backlog
+        is queried at once. The span also holds events that were already
+        processed, which are left out, so it is walked by id one page at a
+        time for them not to use up the limit.
+
+        @param backlogRanges: The merged (first id, last id) backlog ranges.
+        @type backlogRanges: I{list} of I{tuple}
+        @param eventFilters: The filters limiting the events to fetch.
+        @type eventFilters: I{list}
+        @param fields: The fields to fetch.
+        @type fields: I{list} of I{str}
+        @param limit: The maximum number of events to fetch per query.
+        @type limit: I{int}
+
+        @return: The backlog events found, sorted by id.
+        @rtype: I{list} of Shotgun event dictionaries.
+        """
+        if len(backlogRanges) <= MAX_BACKLOG_QUERY_RANGES:
+            filters = [["id", "between", list(idRange)] for idRange in backlogRanges]
+            if len(filters) > 1:
+                filters = [{"filter_operator": "any", "filters": filters}]
+            return self._findEvents(filters + eventFilters, fields, limit)
+
+        starts = [start for start, end in backlogRanges]
+        lastId = backlogRanges[-1][1]
+        nextId = backlogRanges[0][0]
+        backlogEvents = []
+        while nextId <= lastId:
+            events = self._findEvents(
+                [["id", "between", [nextId, lastId]]] + eventFilters, fields, limit
+            )
+            for event in events:
+                index = bisect.bisect_right(starts, event["id"]) - 1
+                if index >= 0 and event["id"] <= backlogRanges[index][1]:
+                    backlogEvents.append(event)
+            if not limit or len(events) < limit:
+                break
+            nextId = events[-1]["id"] + 1
+        return backlogEvents
+
+    def _getEventFilters(self):
+        """
+        Get the filters limiting the events fetched to the ones some active
+        callback is registered for, if server side filtering is on.
+
+        @return: The filters to add to the event queries.
+        @rtype: I{list}
+        """
+        eventFilters = []
+        if self.settings.serverSideFiltering:
+            eventFilter = self._router.getEventFilter()
+            if eventFilter is not None:
+                eventFilters.append(eventFilter)
+        return eventFilters
+
+    def _getEventFields(self):
+        """
+        Get the EventLogEntry fields to fetch: the ones declared by the active
+        callbacks and the ones the engine needs.
+
+        @return: The field names.
+        @rtype: I{list} of I{str}
+        """
+        fields = self._router.getEventFields()
+        if fields is None or self._recorder:
+            # Recorded events are fetched whole for other plugins to be
+            # replayed on them.
+            return EVENT_FIELDS
+
+        fields.update(ENGINE_EVENT_FIELDS)
+        if self.settings.useSessionUuid:
+            fields.add("session_uuid")
+        if self._dispatcher:
+            # Needed to keep the events about an entity in order.
+            fields.add("entity")
+        return sorted(fields)
+
+    def _findEvents(self, filters, fields, limit=0, shotgun=None):
+        """
+        Find events in Shotgun, retrying until the query succeeds.
+
+        @param filters: The filters to find the events with.
+        @type filters: I{list}
+        @param fields: The fields to fetch.
+        @type fields: I{list} of I{str}
+        @param limit: The maximum number of events to return, 0 for no limit.
+        @type limit: I{int}
+        @param shotgun: The connection to use. Defaults to the engine's.
+        @type shotgun: L{sg.Shotgun}
+
+        @return: The events found, sorted by id.
+        @rtype: I{list} of Shotgun event dictionaries.
+        """
+        if shotgun is None:
+            shotgun = self._sg
+        order = [{"column": "id", "direction": "asc"}]
+
+        conn_attempts = 0
+        while True:
+            try:
+                startTime = time.time()
+                events = shotgun.find(
+                    "EventLogEntry", filters, fields, order, limit=limit
+                )
+                self.metrics.fetchDuration.observe(time.time() - startTime)
+                self.metrics.fetchSize.observe(len(events))
+                if events:
+                    self.log.debug(
+                        "Got %d events: %d to %d.",
+                        len(events),
+                        events[0]["id"],
+                        events[-1]["id"],
                     )
-                except Exception as err:
-                    msg = "Unknown error: %s" % str(err)
-                    conn_attempts = self._checkConnectionAttempts(conn_attempts, msg)
+                return events
+            except (sg.ProtocolError, sg.ResponseError, socket.error) as err:
+                conn_attempts = self._checkConnectionAttempts(conn_attempts, str(err))
+            except Exception as err:
+                msg = "Unknown error: %s" % str(err)
+                conn_attempts = self._checkConnectionAttempts(conn_attempts, msg)
+
+    def _checkpointEventIdData(self):
+        """
+        Account for a processed event and save the event id data once enough
+        events were processed or enough time went by since the last save.
 
-        return []
+        Events processed since the last save will be processed again if the
+        daemon dies before the next one.
+        """
+        self._uncheckpointedEvents += 1
+        if (
+            self._uncheckpointedEvents >= self.settings.checkpointEvents
+            or time.time() - self._lastCheckpointTime
+            >= self.settings.checkpointInterval
+        ):
+            self._saveEventIdData()
 
     def _saveEventIdData(self):
         """
@@ -682,7 +1813,10 @@ class Engine(object):
         Next time the engine is started it will try to read the event id from
         this location to know at which event it should start processing.
         """
-        eventIdFile = self.config.getEventIdFile()
+        self._uncheckpointedEvents = 0
+        self._lastCheckpointTime = time.time()
+
+        eventIdFile = self.settings.eventIdFile
 
         if eventIdFile is not None:
             for collection in self._pluginCollections:
@@ -691,9 +1825,7 @@ class Engine(object):
             for colPath, state in self._eventIdData.items():
                 if state:
                     try:
-                        with open(eventIdFile, "wb") as fh:
-                            # Use protocol 2 so it can also be loaded in Python 2
-                            pickle.dump(self._eventIdData, fh, protocol=2)
+                        self._eventIdStore.save(self._eventIdData)
                     except OSError as err:
                         self.log.error(
                             "Can not write event id data to %s.\n\n%s",
@@ -704,38 +1836,431 @@ class Engine(object):
             else:
                 self.log.warning("No state was found. Not saving to disk.")
 
+        if self._shard:
+            try:
+                self._shard.saveStates(self._getPluginStates())
+            except sqlite3.Error as err:
+                self.log.error("Could not record the plugins' event id data. %s", err)
+
     def _checkConnectionAttempts(self, conn_attempts, msg):
         conn_attempts += 1
-        if conn_attempts == self._max_conn_retries:
+        if conn_attempts == self.settings.maxConnRetries:
             self.log.error(
                 "Unable to connect to SG (attempt %s of %s): %s",
                 conn_attempts,
-                self._max_conn_retries,
+                self.settings.maxConnRetries,
                 msg,
             )
             conn_attempts = 0
-            time.sleep(self._conn_retry_sleep)
+            time.sleep(self.settings.connRetrySleep)
         else:
             self.log.warning(
                 "Unable to connect to SG (attempt %s of %s): %s",
                 conn_attempts,
-                self._max_conn_retries,
+                self.settings.maxConnRetries,
                 msg,
             )
         return conn_attempts
 
 
+@six.add_metaclass(abc.ABCMeta)
+class DetachedEngine(Engine):
+    """
+    An engine processing a bounded set of events next to the daemon.
+
+    The event id file is neither read nor written: the plugins start right
+    before the first event to process and the engine stops once done.
+    Nothing the daemon owns is touched either: the engine and plugins log to
+    stderr instead of the log files, no metrics are served, no callbacks are
+    profiled or watched and plugins aren't reloaded.
+    Subclasses implement L{_getFirstEventId} and L{_getNewEvents}.
+    """
+
+    def __init__(self, configPath):
+        super(DetachedEngine, self).__init__(configPath)
+        self.settings = self.settings.getDetachedSnapshot()
+        # Past events are processed, the ids between them that weren't
+        # fetched were left out by the filter or never happen.
+        self._missingEventIdRanges = []
+        self._recorder = None
+        self._prefetcher = None
+        self.metrics = EngineMetrics(RecordingHistogram)
+
+    def _setLogFile(self, logger, path):
+        _removeHandlersFromLogger(
+            logger, (logging.handlers.TimedRotatingFileHandler, QueuedLogHandler)
+        )
+        if not any(
+            isinstance(handler, logging.StreamHandler)
+            and handler.stream is sys.stderr
+            for handler in logger.handlers
+        ):
+            handler = logging.StreamHandler(sys.stderr)
+            handler.setFormatter(
+                logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+            )
+            logger.addHandler(handler)
+
+    def reloadConfig(self):
+        reloaded = super(DetachedEngine, self).reloadConfig()
+        if reloaded:
+            self.settings = self.settings.getDetachedSnapshot()
+        return reloaded
+
+    def _startMonitoring(self):
+        pass
+
+    def _stopMonitoring(self):
+        pass
+
+    def _createPluginWatcher(self):
+        return None
+
+    def _createEventIdStore(self):
+        return None
+
+    def _createPluginShard(self, worker):
+        return None
+
+    @abc.abstractmethod
+    def _getFirstEventId(self):
+        """
+        @return: The id of the first event to process, None if there is none.
+        @rtype: I{int}
+        """
+
+    @abc.abstractmethod
+    def _getNewEvents(self):
+        """
+        @return: The next events to process, the engine is stopped once there
+            are none left.
+        @rtype: I{list} of Shotgun event dictionaries.
+        """
+
+    def _loadEventIdData(self):
+        firstEventId = self._getFirstEventId()
+        if firstEventId is not None:
+            for collection in self._pluginCollections:
+                collection.setState(firstEventId - 1)
+
+    def _saveEventIdData(self):
+        self._uncheckpointedEvents = 0
+        self._lastCheckpointTime = time.time()
+
+    def _getCallbackReport(self):
+        """
+        @return: The number of invocations, errors and durations of every
+            callback, one line each.
+        @rtype: I{list} of I{str}
+        """
+        lines = []
+        durations = self.metrics.callbackDuration
+        for labels in durations.getLabels():
+            lines.append(
+                "%s.%s: %d calls, %d errors, p50 %.2fms, p99 %.2fms."
+                % (
+                    labels[0],
+                    labels[1],
+                    len(durations.getObserved(labels)),
+                    self.metrics.callbackErrors.getValue(labels) or 0,
+                    durations.getPercentile(0.5, labels) * 1000,
+                    durations.getPercentile(0.99, labels) * 1000,
+                )
+            )
+        return lines
+
+
+class ReplayEngine(DetachedEngine):
+    """
+    An engine processing the events of a journal written by an
+    L{EventRecorder} instead of the events in Shotgun.
+
+    Callbacks get the recorded Shotgun responses, nothing is sent to Shotgun.
+    The event id file is neither read nor written and neither emails nor
+    Sentry reports are sent. Event lags are measured from the time events are
+    replayed at.
+    """
+
+    def __init__(self, configPath, journalPath, speed=0):
+        """
+        @param configPath: The path of the config file.
+        @type configPath: I{str}
+        @param journalPath: The path of the journal to replay.
+        @type journalPath: I{str}
+        @param speed: How fast to replay the events compared to the pace they
+            were created at in Shotgun, 2 for twice as fast. Use 0 to replay
+            them as fast as they are processed.
+        @type speed: I{float}
+
+        @raise EventDaemonError: If the speed is negative.
+        @raise IOError: If the journal can't be read.
+        """
+        if speed < 0:
+            raise EventDaemonError("The replay speed can't be negative: %s." % speed)
+
+        self._journalPath = journalPath
+        self._speed = speed
+        self._nextEventIndex = 0
+        self._releaseTimes = {}
+        self._replayStartTime = None
+        self._replayEndTime = None
+
+        super(ReplayEngine, self).__init__(configPath)
+
+        self._events, self._responses = _readEventJournal(journalPath, self.log)
+        self.metrics = ReplayMetrics(self._releaseTimes)
+
+    def set_sentry_notification(self):
+        pass
+
+    def setEmailsOnLogger(self, logger, emails):
+        super(ReplayEngine, self).setEmailsOnLogger(logger, False)
+
+    def _createShotgun(self):
+        return None
+
+    def _createShotgunPool(self):
+        return ReplayShotgunPool()
+
+    def _wrapCallbackShotgun(self, shotgun, event):
+        return ReplayShotgun(self._responses, event["id"])
+
+    def _getFirstEventId(self):
+        if self._events:
+            return self._events[0]["id"]
+        return None
+
+    def _getNewEvents(self):
+        """
+        Take the next batch of events from the journal, waiting for them to
+        be due when replaying at a given speed. The engine is stopped once
+        every event was replayed.
+
+        @return: The events to process.
+        @rtype: I{list} of Shotgun event dictionaries.
+        """
+        now = time.time()
+        if self._replayStartTime is None:
+            self._replayStartTime = now
+
+        if self._nextEventIndex >= len(self._events):
+            if self._replayEndTime is None:
+                self._replayEndTime = now
+            self.stop()
+            return []
+
+        # Don't wait for the fetch interval between batches.
+        self._fetchedFullBatch = True
+
+        start = self._nextEventIndex
+        end = min(len(self._events), start + self.settings.maxEventBatchSize)
+        events = []
+        if self._speed:
+            dueTime = self._getDueTime(self._events[start])
+            if dueTime > now:
+                time.sleep(dueTime - now)
+            now = time.time()
+            for event in self._events[start:end]:
+                dueTime = self._getDueTime(event)
+                if dueTime > now:
+                    break
+                self._releaseTimes[event["id"]] = dueTime
+                events.append(event)
+        else:
+            for event in self._events[start:end]:
+                self._releaseTimes[event["id"]] = now
+                events.append(event)
+
+        self._nextEventIndex += len(events)
+        return events
+
+    def _getDueTime(self, event):
+        delay = event["created_at"] - self._events[0]["created_at"]
+        return self._replayStartTime + delay.total_seconds() / self._speed
+
+    def getReport(self):
+        """
+        @return: The throughput of the replay, the event latencies and the
+            durations of every callback, one line each.
+        @rtype: I{list} of I{str}
+        """
+        startTime = self._replayStartTime or time.time()
+        elapsed = max((self._replayEndTime or time.time()) - startTime, 1e-6)
+        lines = [
+            "Replayed %d of %d events from %s in %.2f seconds, %.1f events/s."
+            % (
+                self._nextEventIndex,
+                len(self._events),
+                self._journalPath,
+                elapsed,
+                self._nextEventIndex / elapsed,
+            )
+        ]
+
+        lag = self.metrics.eventLag
+        lines.append(
+            "Event latency: p50 %.3fs, p99 %.3fs, max %.3fs."
+            % (lag.getPercentile(0.5), lag.getPercentile(0.99), lag.getPercentile(1))
+        )
+
+        lines.extend(self._getCallbackReport())
+
+        missing = self._responses.getMissingCount()
+        if missing:
+            lines.append("%d Shotgun calls had no recorded response." % missing)
+        return lines
+
+
+class BackfillEngine(DetachedEngine):
+    """
+    An engine processing the past events of an id range again, with a single
+    plugin, next to the daemon.
+
+    The events are fetched in chunks by backfill_fetch_threads threads and
+    handed to the plugin's callbacks on backfill_threads worker threads.
+    """
+
+    def __init__(self, configPath, pluginName, fromId, toId):
+        """
+        @param configPath: The path of the config file.
+        @type configPath: I{str}
+        @param pluginName: The name of the plugin to process the events with.
+        @type pluginName: I{str}
+        @param fromId: The id of the first event to process.
+        @type fromId: I{int}
+        @param toId: The id of the last event to process.
+        @type toId: I{int}
+
+        @raise EventDaemonError: If the plugin is in none of the plugin paths.
+        """
+        self._pluginName = pluginName
+        self._fromId = fromId
+        self._toId = toId
+        self._fetcher = None
+        self._numEvents = 0
+        self._backfillStartTime = None
+        self._backfillEndTime = None
+
+        # Look for the plugin before connecting to Shotgun.
+        basename = pluginName + ".py"
+        paths = Config(configPath).getListOption("plugins", "paths")
+        if not any(os.path.isfile(os.path.join(path, basename)) for path in paths):
+            raise EventDaemonError(
+                "No %s plugin in %s." % (pluginName, ", ".join(paths))
+            )
+
+        super(BackfillEngine, self).__init__(configPath)
+
+        paths = self.settings.pluginPaths
+        self._pluginCollections = [
+            PluginCollection(self, path, [basename]) for path in paths
+        ]
+
+        backfillThreads = self.settings.backfillThreads
+        if backfillThreads > 0:
+            self._dispatcher = EventDispatcher(self, backfillThreads)
+        else:
+            self._dispatcher = None
+
+    def start(self):
+        try:
+            super(BackfillEngine, self).start()
+        finally:
+            if self._fetcher:
+                self._fetcher.cancel()
+
+    def _getFirstEventId(self):
+        return self._fromId
+
+    def _getNewEvents(self):
+        """
+        Take the next chunk of events of the range. The engine is stopped once
+        every chunk was processed or once the plugin was deactivated.
+
+        @return: The events to process.
+        @rtype: I{list} of Shotgun event dictionaries.
+        """
+        if self._fetcher is None:
+            self._backfillStartTime = time.time()
+            self._fetcher = EventRangeFetcher(
+                self,
+                self._fromId,
+                self._toId,
+                self.settings.maxEventBatchSize,
+                self.settings.backfillFetchThreads,
+            )
+            self._fetcher.start(self._getEventFilters(), self._getEventFields())
+
+        events = None
+        if any(plugin.isActive() for plugin in self._getPlugins()):
+            events = self._fetcher.take()
+        if events is None:
+            if self._backfillEndTime is None:
+                self._backfillEndTime = time.time()
+            self.stop()
+            return []
+
+        # Don't wait for the fetch interval between chunks.
+        self._fetchedFullBatch = True
+        self._numEvents += len(events)
+        return events
+
+    def _getPlugins(self):
+        return [plugin for collection in self._pluginCollections for plugin in collection]
+
+    def getReport(self):
+        """
+        @return: The throughput of the backfill, the durations of every
+            callback and the plugins deactivated by errors, one line each.
+        @rtype: I{list} of I{str}
+        """
+        startTime = self._backfillStartTime or time.time()
+        elapsed = max((self._backfillEndTime or time.time()) - startTime, 1e-6)
+        lines = [
+            "Backfilled events %d to %d with %s: %d events in %.2f seconds, %.1f events/s."
+            % (
+                self._fromId,
+                self._toId,
+                self._pluginName,
+                self._numEvents,
+                elapsed,
+                self._numEvents / elapsed,
+            )
+        ]
+        lines.extend(self._getCallbackReport())
+
+        for plugin in self._getPlugins():
+            if not plugin.isActive():
+                lines.append(
+                    "%s was deactivated, the last event it processed is %s."
+                    % (plugin.getName(), plugin.getState()[0])
+                )
+        return lines
+
+
 class PluginCollection(object):
     """
     A group of plugin files in a location on the disk.
     """
 
-    def __init__(self, engine, path):
+    def __init__(self, engine, path, basenames=None):
+        """
+        @param engine: The engine the plugins are loaded for.
+        @type engine: L{Engine}
+        @param path: The directory of the plugin files.
+        @type path: I{str}
+        @param basenames: The names of the only plugin files to load. Defaults
+            to None, every plugin file.
+        @type basenames: I{list} of I{str}
+
+        @raise ValueError: If the path is not a directory.
+        """
         if not os.path.isdir(path):
             raise ValueError("Invalid path: %s" % path)
 
         self._engine = engine
         self.path = path
+        self._basenames = basenames
         self._plugins = {}
         self._stateData = {}
 
@@ -756,24 +2281,71 @@ class PluginCollection(object):
             self._stateData[plugin.getName()] = plugin.getState()
         return self._stateData
 
-    def getNextUnprocessedEventId(self):
+    def getNextNewEventId(self):
         eId = None
         for plugin in self:
             if not plugin.isActive():
                 continue
 
-            newId = plugin.getNextUnprocessedEventId()
+            newId = plugin.getNextNewEventId()
             if newId is not None and (eId is None or newId < eId):
                 eId = newId
         return eId
 
-    def process(self, event):
+    def getBacklogEventRanges(self):
+        ranges = []
+        for plugin in self:
+            if plugin.isActive():
+                ranges.extend(plugin.getBacklogEventRanges())
+        return ranges
+
+    def process(self, event, routes=None):
+        """
+        Process an event with every plugin.
+
+        @param event: The Shotgun event to process.
+        @type event: I{dict}
+        @param routes: The callbacks matching the event keyed by plugin, as
+            returned by L{EventRouter.route}. If None, every callback checks
+            the event itself.
+        @type routes: I{dict}
+        """
         for plugin in self:
             if plugin.isActive():
-                plugin.process(event)
+                plugin.process(event, self._getRoutedCallbacks(plugin, routes))
             else:
                 plugin.logger.debug("Skipping: inactive.")
 
+    def dispatch(self, event, dispatcher, routes=None):
+        """
+        Hand an event to a dispatcher for every plugin that wants it.
+
+        @param event: The Shotgun event to process.
+        @type event: I{dict}
+        @param dispatcher: The dispatcher running the plugins' callbacks.
+        @type dispatcher: L{EventDispatcher}
+        @param routes: The callbacks matching the event keyed by plugin, as
+            returned by L{EventRouter.route}. If None, every callback checks
+            the event itself.
+        @type routes: I{dict}
+
+        @return: The jobs submitted to the dispatcher.
+        @rtype: I{list} of L{DispatchJob}
+        """
+        jobs = []
+        for plugin in self:
+            if not plugin.isActive():
+                plugin.logger.debug("Skipping: inactive.")
+            elif plugin.wantsEvent(event):
+                callbacks = self._getRoutedCallbacks(plugin, routes)
+                jobs.append(dispatcher.submit(plugin, event, callbacks))
+        return jobs
+
+    def _getRoutedCallbacks(self, plugin, routes):
+        if routes is None:
+            return None
+        return routes.get(plugin, [])
+
     def load(self):
         """
         Load plugins from disk.
@@ -782,24 +2354,121 @@ class PluginCollection(object):
         - Loop on all paths.
         - Find all valid .py plugin files.
         - Loop on all plugin files.
-        - For any new plugins, load them, otherwise, refresh them.
+        - For any new plugins, load them and give them the state known for
+          them, otherwise, refresh them.
+
+        @return: True if any plugin was loaded, reloaded or removed, False
+            otherwise.
+        @rtype: I{bool}
         """
         newPlugins = {}
+        changed = False
 
         for basename in os.listdir(self.path):
-            if not basename.endswith(".py") or basename.startswith("."):
+            if not self._isLoadedFile(basename):
                 continue
 
-            if basename in self._plugins:
-                newPlugins[basename] = self._plugins[basename]
-            else:
-                newPlugins[basename] = Plugin(
-                    self._engine, os.path.join(self.path, basename)
-                )
+            newPlugins[basename] = self._getPlugin(basename)
+            if newPlugins[basename].load():
+                changed = True
 
-            newPlugins[basename].load()
+        if set(newPlugins) != set(self._plugins):
+            changed = True
 
         self._plugins = newPlugins
+        return changed
+
+    def reload(self, basenames):
+        """
+        Load, reload or remove some plugins without looking at the rest of the
+        plugin files.
+
+        @param basenames: The names of the plugin files that changed.
+        @type basenames: I{set} of I{str}
+
+        @return: True if any plugin was loaded, reloaded or removed, False
+            otherwise.
+        @rtype: I{bool}
+        """
+        changed = False
+        for basename in sorted(basenames):
+            if not self._isLoadedFile(basename):
+                continue
+
+            try:
+                plugin = self._getPlugin(basename)
+                if plugin.load():
+                    changed = True
+                self._plugins[basename] = plugin
+            except (OSError, ValueError):
+                # The plugin file is gone.
+                if self._plugins.pop(basename, None) is not None:
+                    self._engine.log.info(
+                        "Removing plugin at %s", os.path.join(self.path, basename)
+                    )
+                    changed = True
+
+        return changed
+
+    def setBasenames(self, basenames):
+        """
+        Change the plugin files to load. Call L{load} for the change to take
+        effect.
+
+        @param basenames: The names of the only plugin files to load, None
+            for every plugin file.
+        @type basenames: I{set} of I{str}
+
+        @return: True if they changed, False otherwise.
+        @rtype: I{bool}
+        """
+        changed = basenames != self._basenames
+        self._basenames = basenames
+        return changed
+
+    def setPluginState(self, pluginName, state):
+        """
+        Set the last event id data of a single plugin, loaded or not.
+
+        @param pluginName: The name of the plugin.
+        @type pluginName: I{str}
+        @param state: The last event id data of the plugin.
+        @type state: I{int} or I{tuple}
+        """
+        self._stateData[pluginName] = state
+        for plugin in self:
+            if plugin.getName() == pluginName:
+                plugin.setState(state)
+
+    def listPluginNames(self):
+        """
+        @return: The names of every plugin file in the path, loaded or not.
+        @rtype: I{list} of I{str}
+        """
+        return [
+            os.path.splitext(basename)[0]
+            for basename in os.listdir(self.path)
+            if _isPluginFile(basename)
+        ]
+
+    def _isLoadedFile(self, basename):
+        return _isPluginFile(basename) and (
+            self._basenames is None or basename in self._basenames
+        )
+
+    def _getPlugin(self, basename):
+        """
+        Get the plugin for a file, creating it with the state known for it if
+        it isn't loaded yet.
+        """
+        if basename in self._plugins:
+            return self._plugins[basename]
+
+        plugin = Plugin(self._engine, os.path.join(self.path, basename))
+        pluginState = self._stateData.get(plugin.getName())
+        if pluginState:
+            plugin.setState(pluginState)
+        return plugin
 
     def __iter__(self):
         for basename in sorted(self._plugins.keys()):
@@ -829,52 +2498,72 @@ class Plugin(object):
 
         self._pluginName = os.path.splitext(os.path.split(self._path)[1])[0]
         self._active = True
+        # Callbacks of the plugin running on worker threads for different
+        # entities may be deactivated at the same time.
+        self._activeLock = threading.Lock()
         self._callbacks = []
         self._mtime = None
         self._lastEventId = None
-        self._backlog = {}
+        self._backlog = EventIdBacklog()
 
         # Setup the plugin's logger
         self.logger = logging.getLogger("plugin." + self.getName())
         self.logger.config = self._engine.config
         self._engine.setEmailsOnLogger(self.logger, True)
-        self.logger.setLevel(self._engine.config.getLogLevel())
-        if self._engine.config.getLogMode() == 1:
-            _setFilePathOnLogger(
-                self.logger, self._engine.config.getLogFile("plugin." + self.getName()),
-                self._engine.config.getBackupCount()
+        self.logger.setLevel(self._engine.settings.logLevel)
+        if self._engine.settings.logMode == 1:
+            self._engine._setLogFile(
+                self.logger, self._engine.settings.getLogFile("plugin." + self.getName())
             )
 
     def getName(self):
         return self._pluginName
 
+    def setConfig(self, config):
+        """
+        Update the plugin's loggers after the engine's config was reloaded.
+
+        @param config: The reloaded config.
+        @type config: L{Config}
+        """
+        self.logger.config = config
+        self.logger.setLevel(self._engine.settings.logLevel)
+        for callback in self._callbacks:
+            callback._logger.config = config
+
     def setState(self, state):
         if isinstance(state, int):
             self._lastEventId = state
         elif isinstance(state, tuple):
-            self._lastEventId, self._backlog = state
+            self._lastEventId, backlog = state
+            self._backlog = EventIdBacklog(backlog)
         else:
             raise ValueError("Unknown state type: %s." % type(state))
 
     def getState(self):
-        return (self._lastEventId, self._backlog)
+        return (self._lastEventId, self._backlog.getState())
+
+    def getNextNewEventId(self):
+        """
+        Get the id of the first event newer than the last processed one.
 
-    def getNextUnprocessedEventId(self):
+        @return: The event id or None if no event was processed yet.
+        @rtype: I{int} or L{None}
+        """
         if self._lastEventId:
-            nextId = self._lastEventId + 1
-        else:
-            nextId = None
+            return self._lastEventId + 1
+        return None
 
-        now = datetime.datetime.now()
-        for k in list(self._backlog):
-            v = self._backlog[k]
-            if v < now:
-                #self.logger.warning("Timeout elapsed on backlog event id %d.", k)
-                del self._backlog[k]
-            elif nextId is None or k < nextId:
-                nextId = k
+    def getBacklogEventRanges(self):
+        """
+        Get the ids of the backlog events that could still show up, dropping
+        the ones whose timeout elapsed.
 
-        return nextId
+        @return: The backlog event ids as inclusive (first id, last id) ranges.
+        @rtype: I{list} of I{tuple}
+        """
+        self._backlog.expire(datetime.datetime.now())
+        return self._backlog.getRanges()
 
     def isActive(self):
         """
@@ -910,6 +2599,10 @@ class Plugin(object):
 
         At every step along the way, if any error occurs the whole plugin will
         be deactivated and the function will return.
+
+        @return: True if the plugin was loaded or reloaded, False if it didn't
+            change on disk.
+        @rtype: I{bool}
         """
         # Check file mtime
         mtime = os.path.getmtime(self._path)
@@ -919,7 +2612,7 @@ class Plugin(object):
             self._engine.log.info("Reloading plugin at %s" % self._path)
         else:
             # The mtime of file is equal or older. We don't need to do anything.
-            return
+            return False
 
         # Reset values
         self._mtime = mtime
@@ -935,7 +2628,7 @@ class Plugin(object):
                 self._path,
                 traceback.format_exc(),
             )
-            return
+            return True
 
         regFunc = getattr(plugin, "registerCallbacks", None)
         if callable(regFunc):
@@ -954,6 +2647,8 @@ class Plugin(object):
             )
             self._active = False
 
+        return True
+
     def registerCallback(
         self,
         sgScriptName,
@@ -962,92 +2657,169 @@ class Plugin(object):
         matchEvents=None,
         args=None,
         stopOnError=True,
+        fields=None,
+        timeout=None,
     ):
         """
         Register a callback in the plugin.
+
+        The args are handed to every call of the callback as is. With
+        dispatch_threads, calls for different entities run at the same time
+        on worker threads and share them, so callbacks must not change them
+        without a lock of their own.
         """
-        global sg
-        sgConnection = sg.Shotgun(
-            self._engine.config.getShotgunURL(),
-            sgScriptName,
-            sgScriptKey,
-            http_proxy=self._engine.config.getEngineProxyServer(),
-        )
         self._callbacks.append(
             Callback(
                 callback,
                 self,
                 self._engine,
-                sgConnection,
+                (sgScriptName, sgScriptKey),
                 matchEvents,
                 args,
                 stopOnError,
+                fields,
+                timeout,
             )
         )
 
-    def process(self, event):
+    def process(self, event, callbacks=None):
+        """
+        Process an event with the plugin's callbacks.
+
+        @param event: The Shotgun event to process.
+        @type event: I{dict}
+        @param callbacks: The callbacks the event was routed to. If None,
+            every callback checks the event itself.
+        @type callbacks: I{list} of L{Callback}
+
+        @return: True if the plugin is still active, False otherwise.
+        @rtype: I{bool}
+        """
+        if self.wantsEvent(event):
+            self.commitEvent(event, self._process(event, callbacks))
+
+        return self._active
+
+    def wantsEvent(self, event):
+        """
+        Should an event be handed to this plugin's callbacks?
+
+        Events in the backlog and events newer than the last processed one are
+        wanted, anything else has already been processed.
+
+        @param event: The Shotgun event to check.
+        @type event: I{dict}
+
+        @return: True if the event should be processed, False otherwise.
+        @rtype: I{bool}
+        """
         if event["id"] in self._backlog:
-            if self._process(event):
-                #self.logger.info("Processed id %d from backlog." % event["id"])
-                del self._backlog[event["id"]]
-                self._updateLastEventId(event)
+            return True
         elif self._lastEventId is not None and event["id"] <= self._lastEventId:
             msg = "Event %d is too old. Last event processed was (%d)."
             #self.logger.debug(msg, event["id"], self._lastEventId)
+            return False
+        return True
+
+    def commitEvent(self, event, processed):
+        """
+        Record the outcome of processing a wanted event.
+
+        @param event: The Shotgun event that was handed to the callbacks.
+        @type event: I{dict}
+        @param processed: Did the callbacks process the event successfully?
+        @type processed: I{bool}
+        """
+        if not processed:
+            return
+
+        if event["id"] in self._backlog:
+            # Backlog events are older than the last processed one, which must
+            # not move back or the events after them would be processed again.
+            #self.logger.info("Processed id %d from backlog." % event["id"])
+            self._backlog.remove(event["id"])
         else:
-            if self._process(event):
-                self._updateLastEventId(event)
+            self._updateLastEventId(event)
 
-        return self._active
+    def _process(self, event, callbacks=None):
+        # Routed callbacks are already known to match the event.
+        routed = callbacks is not None
+        if not routed:
+            callbacks = self
 
-    def _process(self, event):
-        for callback in self:
+        dispatched = False
+        processed = True
+        for callback in callbacks:
             if callback.isActive():
-                if callback.canProcess(event):
+                if routed or callback.canProcess(event):
                     #msg = "Dispatching event %d to callback %s."
                     #self.logger.debug(msg, event["id"], str(callback))
+                    dispatched = True
                     if not callback.process(event):
                         # A callback in the plugin failed. Deactivate the whole
                         # plugin.
-                        self._active = False
+                        self.deactivate()
+                        processed = False
                         break
             else:
                 msg = "Skipping inactive callback %s in plugin."
                 self.logger.debug(msg, str(callback))
 
-        return self._active
+        if dispatched:
+            self._engine.metrics.eventsDispatched.inc((self.getName(),))
+        else:
+            self._engine.metrics.eventsSkipped.inc((self.getName(),))
+
+        # Other threads may deactivate the plugin meanwhile, only the
+        # callbacks run here decide whether this event was processed.
+        return processed
+
+    def deactivate(self, callback=None):
+        """
+        Stop running the plugin's callbacks.
+
+        @param callback: The callback of the plugin that failed, deactivated
+            along with the plugin, if any.
+        @type callback: L{Callback}
+        """
+        with self._activeLock:
+            if callback is not None:
+                callback._active = False
+            self._active = False
 
     def _updateLastEventId(self, event):
-        BACKLOG_TIMEOUT = (
-            5  # time in minutes after which we consider a pending event won't happen
-        )
         if self._lastEventId is not None and event["id"] > self._lastEventId + 1:
+            # Ids left out by server side filtering aren't missing.
+            missingRanges = self._engine.getMissingEventIdRanges(
+                self._lastEventId + 1, event["id"] - 1
+            )
             event_date = event["created_at"].replace(tzinfo=None)
-            if datetime.datetime.now() > (
-                event_date + datetime.timedelta(minutes=BACKLOG_TIMEOUT)
-            ):
-                # the event we've just processed happened more than BACKLOG_TIMEOUT minutes ago so any event
-                # with a lower id should have shown up in the EventLog by now if it actually happened
-                if event["id"] == self._lastEventId + 2:
-                    self.logger.info(
-                        "Event %d never happened - ignoring.", self._lastEventId + 1
-                    )
+            for start, end in missingRanges:
+                if datetime.datetime.now() > (
+                    event_date + datetime.timedelta(minutes=BACKLOG_TIMEOUT)
+                ):
+                    # the event we've just processed happened more than BACKLOG_TIMEOUT minutes ago so any event
+                    # with a lower id should have shown up in the EventLog by now if it actually happened
+                    if start == end:
+                        self.logger.info("Event %d never happened - ignoring.", start)
+                    else:
+                        self.logger.info(
+                            "Events %d-%d never happened - ignoring.", start, end
+                        )
                 else:
-                    self.logger.info(
-                        "Events %d-%d never happened - ignoring.",
-                        self._lastEventId + 1,
-                        event["id"] - 1,
+                    # in this case, we want to add the missing events to the backlog as they could show up in the
+                    # EventLog within BACKLOG_TIMEOUT minutes, during which we'll keep asking for the same range
+                    # them to show up until they expire
+                    expiration = datetime.datetime.now() + datetime.timedelta(
+                        minutes=BACKLOG_TIMEOUT
                     )
-            else:
-                # in this case, we want to add the missing events to the backlog as they could show up in the
-                # EventLog within BACKLOG_TIMEOUT minutes, during which we'll keep asking for the same range
-                # them to show up until they expire
-                expiration = datetime.datetime.now() + datetime.timedelta(
-                    minutes=BACKLOG_TIMEOUT
-                )
-                for skippedId in range(self._lastEventId + 1, event["id"]):
-                    self.logger.info("Adding event id %d to backlog.", skippedId)
-                    self._backlog[skippedId] = expiration
+                    if start == end:
+                        self.logger.info("Adding event id %d to backlog.", start)
+                    else:
+                        self.logger.info(
+                            "Adding event ids %d-%d to backlog.", start, end
+                        )
+                    self._backlog.add(start, end, expiration)
         self._lastEventId = event["id"]
 
     def __iter__(self):
@@ -1110,6 +2882,8 @@ class Callback(object):
         matchEvents=None,
         args=None,
         stopOnError=True,
+        fields=None,
+        timeout=None,
     ):
         """
         @param callback: The function to run when a Shotgun event occurs.
@@ -1117,13 +2891,23 @@ class Callback(object):
         @param engine: The engine that will dispatch to this callback.
         @type engine: L{Engine}.
         @param shotgun: The Shotgun instance that will be used to communicate
-            with your Shotgun server.
-        @type shotgun: L{sg.Shotgun}
+            with your Shotgun server, or the script name and api key to take
+            connections from the engine's pool with.
+        @type shotgun: L{sg.Shotgun} or I{tuple} of I{str}
         @param matchEvents: The event filter to match events against before invoking callback.
         @type matchEvents: dict
         @param args: Any datastructure you would like to be passed to your
-            callback function. Defaults to None.
+            callback function, shared by the calls running concurrently on
+            worker threads. Defaults to None.
         @type args: Any object.
+        @param fields: The event fields the callback uses. Only those are
+            fetched if every callback declares them. Defaults to None, all
+            the fields.
+        @type fields: I{list} of I{str}
+        @param timeout: The number of seconds the callback is expected to
+            process an event in, 0 for no limit. Defaults to None, the
+            callback_timeout of the config.
+        @type timeout: I{int}
 
         @raise TypeError: If the callback is not a callable object.
         """
@@ -1133,7 +2917,12 @@ class Callback(object):
             )
 
         self._name = None
-        self._shotgun = shotgun
+        if isinstance(shotgun, tuple):
+            self._shotgun = None
+            self._credentials = shotgun
+        else:
+            self._shotgun = shotgun
+            self._credentials = None
         self._plugin = plugin
         self._callback = callback
         self._engine = engine
@@ -1141,7 +2930,11 @@ class Callback(object):
         self._matchEvents = matchEvents
         self._args = args
         self._stopOnError = stopOnError
+        self._fields = fields
+        self._timeout = timeout
         self._active = True
+        # The AccountedShotgun of each thread calling the callback.
+        self._accounting = threading.local()
 
         # Find a name for this object
         if hasattr(callback, "__name__"):
@@ -1168,7 +2961,7 @@ class Callback(object):
             if eventType not in self._matchEvents:
                 return False
 
-        attributes = self._matchEvents[eventType]
+        attributes = self._getMatchedAttributes(eventType)
 
         if attributes is None or "*" in attributes:
             return True
@@ -1178,6 +2971,98 @@ class Callback(object):
 
         return False
 
+    def _getMatchedAttributes(self, eventType):
+        """
+        Get the attribute names matched for an event type, with a single
+        attribute name given as a string treated as a list of one.
+
+        @return: The attribute names, in registration order and without
+            duplicates, or None for any attribute.
+        @rtype: I{list} of I{str} or L{None}
+        """
+        attributes = self._matchEvents[eventType]
+        if attributes is None:
+            return None
+        if isinstance(attributes, six.string_types):
+            attributes = [attributes]
+
+        matched = []
+        for attribute in attributes:
+            if attribute not in matched:
+                matched.append(attribute)
+        return matched
+
+    def getTimeout(self):
+        """
+        @return: The number of seconds the callback is expected to process an
+            event in, 0 for no limit.
+        @rtype: I{int}
+        """
+        if self._timeout is None:
+            return self._engine.settings.callbackTimeout
+        return self._timeout
+
+    def getLogger(self):
+        return self._logger
+
+    def getCredentials(self):
+        """
+        @return: The script name and api key the callback borrows pooled
+            connections for, None if it was given a connection.
+        @rtype: I{tuple} of I{str}
+        """
+        return self._credentials
+
+    def abandon(self):
+        """
+        Deactivate the callback and its plugin because the callback didn't
+        process an event in time.
+        """
+        self._plugin.deactivate(self)
+
+    def getFullName(self):
+        """
+        @return: The names of the plugin and of the callback, separated by a
+            dot.
+        @rtype: I{str}
+        """
+        return "%s.%s" % (self._plugin.getName(), self._name)
+
+    def getFields(self):
+        """
+        @return: The event fields the callback declared it uses, or None if it
+            didn't.
+        @rtype: I{list} of I{str} or L{None}
+        """
+        return self._fields
+
+    def getRouteKeys(self):
+        """
+        Get the (event type, attribute name) pairs this callback matches,
+        where "*" matches any value. This mirrors L{canProcess}.
+
+        @return: The keys to route events to this callback with.
+        @rtype: I{list} of I{tuple}
+        """
+        if not self._matchEvents:
+            return [("*", "*")]
+
+        if "*" in self._matchEvents:
+            eventTypes = ["*"]
+        else:
+            eventTypes = self._matchEvents.keys()
+
+        keys = []
+        for eventType in eventTypes:
+            attributes = self._getMatchedAttributes(eventType)
+            if attributes is None or "*" in attributes:
+                keys.append((eventType, "*"))
+            else:
+                keys.extend(
+                    (eventType, attribute) for attribute in attributes if attribute
+                )
+        return keys
+
     def process(self, event):
         """
         Process an event with the callback object supplied on initialization.
@@ -1188,31 +3073,63 @@ class Callback(object):
         @param event: The Shotgun event to process.
         @type event: I{dict}
         """
+        # Connections are borrowed from the pool for the duration of the
+        # call, so the callbacks of a script share them.
+        pool = self._engine._shotgunPool
+        if self._shotgun is not None:
+            connection = self._shotgun
+            pooled = False
+        else:
+            connection = pool.acquire(*self._credentials)
+            pooled = True
+        shotgun = self._engine._wrapCallbackShotgun(connection, event)
+
         # set session_uuid for UI updates
-        if self._engine._use_session_uuid:
-            self._shotgun.set_session_uuid(event["session_uuid"])
+        if self._engine.settings.useSessionUuid:
+            shotgun.set_session_uuid(event["session_uuid"])
+
+        # Account for the Shotgun calls the callback makes
+        accounting = None
+        if self._engine.settings.shotgunCallAccounting:
+            accounting = getattr(self._accounting, "shotgun", None)
+            if accounting is None:
+                accounting = self._accounting.shotgun = AccountedShotgun()
+            accounting.wrap(shotgun)
+            shotgun = accounting
 
         if self._engine.timing_logger:
             start_time = datetime.datetime.now(SG_TIMEZONE.local)
+        startTime = time.time()
+        watch = self._engine.watchdog.watch(self, event)
 
         try:
-            self._callback(self._shotgun, self._logger, event, self._args)
+            profiledName = self._engine.profiler.getProfiledName(self)
+            if profiledName is None:
+                self._callback(shotgun, self._logger, event, self._args)
+            else:
+                self._engine.profiler.runcall(
+                    profiledName, self._callback, shotgun, self._logger, event, self._args
+                )
             error = False
         except:
             error = True
 
-            # Get the local variables of the frame of our plugin
+            # Get the traceback and the local variables of the outer most
+            # frame of our plugin. Snapshots of them are logged, formatted by
+            # the log writer, mail worker and Sentry threads when those are
+            # used. Frames of the daemon and of the profiler are left out.
             tb = sys.exc_info()[2]
             stack = []
             while tb:
-                stack.append(tb.tb_frame)
+                module = tb.tb_frame.f_globals.get("__name__")
+                if not stack or module not in (__name__, CallbackProfiler.__module__, "cProfile"):
+                    stack.append(tb.tb_frame)
                 tb = tb.tb_next
+            frameLocals = FrameLocals(stack[1] if len(stack) > 1 else stack[-1])
+            formattedTraceback = FormattedTraceback(sys.exc_info())
 
             msg = "An error occured processing an event.\n\n%s\n\nLocal variables at outer most frame in plugin:\n\n%s"
-            self._logger.critical(
-                msg, traceback.format_exc(), pprint.pformat(stack[1].f_locals)
-            )
-
+            _sen_extra = None
             if sentry_sdk is not None:
                 _sen_extra = {'plugin_name': self._plugin.getName(),
                               'event_id': str(event['id']),
@@ -1224,12 +3141,22 @@ class Callback(object):
                     msg += '\n\n%s\n\nLocal variables at outer most frame in plugin:\n\n%s'
                 else:
                     _sen_extra['level'] = 'warning'
-                self._logger.critical(msg, traceback.format_exc(), pprint.pformat(stack[1].f_locals), extra=_sen_extra)
-            else:
-                self._logger.critical(msg, traceback.format_exc(), pprint.pformat(stack[1].f_locals))
+            self._logger.critical(msg, formattedTraceback, frameLocals, extra=_sen_extra)
+            del stack, tb
 
             if self._stopOnError:
-                self._active = False
+                self._plugin.deactivate(self)
+        finally:
+            self._engine.watchdog.unwatch(watch)
+            if pooled:
+                pool.release(connection, *self._credentials)
+
+        labels = (self._plugin.getName(), self._name)
+        self._engine.metrics.callbackDuration.observe(time.time() - startTime, labels)
+        if error:
+            self._engine.metrics.callbackErrors.inc(labels)
+        if accounting is not None:
+            self._engine.metrics.observeShotgunCalls(labels, accounting.getCalls())
 
         if self._engine.timing_logger:
             callback_name = self._logger.name.replace("plugin.", "")
@@ -1247,8 +3174,14 @@ class Callback(object):
                 str(error),
                 delay,
             ]
+            if accounting is not None:
+                msg_format += " sg_calls=%d sg_duration=%.6f sg_records=%d sg_methods=%s"
+                data.extend(accounting.getTotals())
             self._engine.timing_logger.info(msg_format, *data)
 
+        if accounting is not None:
+            accounting.wrap(None)
+
         return self._active
 
     def _prettyTimeDeltaFormat(self, time_delta):
@@ -1283,6 +3216,373 @@ class Callback(object):
         return self._name
 
 
+class EventRouter(object):
+    """
+    A table of the callbacks registered for each event type and attribute
+    name, compiled whenever plugins are loaded, so events go straight to the
+    callbacks matching them.
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._order = {}
+
+    def compile(self, pluginCollections):
+        """
+        Build the table from the callbacks of every plugin.
+
+        @param pluginCollections: The plugin collections of the engine.
+        @type pluginCollections: I{list} of L{PluginCollection}
+        """
+        routes = {}
+        order = {}
+        for collection in pluginCollections:
+            for plugin in collection:
+                for callback in plugin:
+                    order[callback] = len(order)
+                    for key in callback.getRouteKeys():
+                        routes.setdefault(key, []).append(callback)
+
+        self._routes = routes
+        self._order = order
+
+    def route(self, event):
+        """
+        Find the callbacks an event should be handed to.
+
+        @param event: The Shotgun event to route.
+        @type event: I{dict}
+
+        @return: The matching callbacks, in registration order, keyed by
+            plugin. Plugins without any matching callback are left out.
+        @rtype: I{dict}
+        """
+        eventType = event["event_type"]
+        attributeName = event["attribute_name"]
+
+        keys = [(eventType, "*"), ("*", "*")]
+        if attributeName:
+            keys.extend([(eventType, attributeName), ("*", attributeName)])
+
+        callbacks = []
+        for key in keys:
+            callbacks.extend(self._routes.get(key, ()))
+        callbacks.sort(key=self._order.get)
+
+        routes = {}
+        for callback in callbacks:
+            routes.setdefault(callback._plugin, []).append(callback)
+        return routes
+
+    def getEventFields(self):
+        """
+        Get the event fields the active callbacks declared they use.
+
+        @return: The field names, or None if some active callback didn't
+            declare its fields.
+        @rtype: I{set} of I{str} or L{None}
+        """
+        fields = set()
+        for callback in self._order:
+            if not (callback.isActive() and callback._plugin.isActive()):
+                continue
+
+            callbackFields = callback.getFields()
+            if callbackFields is None:
+                return None
+            fields.update(callbackFields)
+        return fields
+
+    def getEventFilter(self):
+        """
+        Build a Shotgun filter matching the events active callbacks are
+        registered for.
+
+        @return: A filter on event types and attribute names, or None if some
+            active callback is registered for any event type.
+        @rtype: I{list}, I{dict} or L{None}
+        """
+        attributesByType = {}
+        for (eventType, attributeName), callbacks in self._routes.items():
+            if not any(
+                callback.isActive() and callback._plugin.isActive()
+                for callback in callbacks
+            ):
+                continue
+
+            if eventType == "*":
+                return None
+
+            if attributeName == "*":
+                attributesByType[eventType] = None
+            elif attributesByType.get(eventType, ()) is not None:
+                attributesByType.setdefault(eventType, set()).add(attributeName)
+
+        if not attributesByType:
+            return None
+
+        anyAttributeTypes = []
+        filters = []
+        for eventType in sorted(attributesByType):
+            attributes = attributesByType[eventType]
+            if attributes is None:
+                anyAttributeTypes.append(eventType)
+            else:
+                filters.append(
+                    {
+                        "filter_operator": "all",
+                        "filters": [
+                            ["event_type", "is", eventType],
+                            ["attribute_name", "in", sorted(attributes)],
+                        ],
+                    }
+                )
+        if anyAttributeTypes:
+            filters.insert(0, ["event_type", "in", anyAttributeTypes])
+
+        if len(filters) == 1:
+            return filters[0]
+        return {"filter_operator": "any", "filters": filters}
+
+
+def _getEntityKey(event):
+    """
+    Get a key identifying the entity an event is about.
+
+    @param event: The Shotgun event.
+    @type event: I{dict}
+
+    @return: An (entity type, entity id) tuple or None if the event isn't
+        about any entity.
+    @rtype: I{tuple} or L{None}
+    """
+    entity = event.get("entity")
+    if entity:
+        return (entity.get("type"), entity.get("id"))
+
+    meta = event.get("meta") or {}
+    if meta.get("entity_id") is not None:
+        return (meta.get("entity_type"), meta["entity_id"])
+
+    return None
+
+
+class DispatchJob(object):
+    """
+    A plugin processing an event on one of the dispatcher's worker threads.
+    """
+
+    def __init__(self, plugin, event, callbacks=None):
+        """
+        @param plugin: The plugin whose callbacks should process the event.
+        @type plugin: L{Plugin}
+        @param event: The Shotgun event to process.
+        @type event: I{dict}
+        @param callbacks: The callbacks the event was routed to. If None,
+            every callback checks the event itself.
+        @type callbacks: I{list} of L{Callback}
+        """
+        self.plugin = plugin
+        self.event = event
+        self.callbacks = callbacks
+        self.key = None
+        self.abandoned = False
+        self._result = False
+        self._done = threading.Event()
+
+    def run(self):
+        """
+        Run the plugin's callbacks on the event unless the plugin was
+        deactivated in the meantime.
+        """
+        try:
+            if self.plugin.isActive():
+                result = self.plugin._process(self.event, self.callbacks)
+                if not self.abandoned:
+                    self._result = result
+            else:
+                self.plugin.logger.debug("Skipping: inactive.")
+        except:
+            self.plugin.logger.critical(
+                "Unexpected error dispatching event %d.\n\n%s",
+                self.event["id"],
+                traceback.format_exc(),
+            )
+        finally:
+            self._done.set()
+
+    def isDone(self):
+        return self._done.is_set()
+
+    def abandon(self):
+        """
+        Stop waiting for the job, it fails.
+        """
+        self.abandoned = True
+        self._result = False
+        self._done.set()
+
+    def wait(self):
+        """
+        Wait for the job to be done.
+
+        @return: True if the plugin processed the event successfully, False
+            otherwise.
+        @rtype: I{bool}
+        """
+        self._done.wait()
+        return self._result
+
+
+class EventDispatcher(object):
+    """
+    Run plugins on events using a pool of worker threads.
+
+    Jobs are queued by plugin and entity. Jobs sharing a key run one at a time
+    in submission order, jobs with different keys run concurrently.
+    """
+
+    def __init__(self, engine, numThreads):
+        """
+        @param engine: The engine the dispatcher works for.
+        @type engine: L{Engine}
+        @param numThreads: The number of worker threads to run.
+        @type numThreads: I{int}
+        """
+        self._engine = engine
+        self._numThreads = numThreads
+        self._threads = []
+        self._condition = threading.Condition()
+        self._queues = {}
+        self._readyKeys = collections.deque()
+        self._currentJobs = {}
+        self._running = False
+
+    def start(self):
+        """
+        Start the worker threads.
+        """
+        with self._condition:
+            self._running = True
+
+        for index in range(self._numThreads):
+            self._startThread()
+
+    def _startThread(self):
+        thread = threading.Thread(target=self._work, name="dispatcher")
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self):
+        """
+        Stop the worker threads once the jobs they are running are done.
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def abandon(self, threadId):
+        """
+        Stop waiting for the job a worker thread is stuck in.
+
+        The job fails and a new worker thread takes over, so the jobs queued
+        after it for the same plugin and entity can run. The stuck thread
+        exits once the job returns.
+
+        @param threadId: The identifier of the worker thread.
+        @type threadId: I{int}
+
+        @return: True if the thread was running a job that was abandoned,
+            False otherwise.
+        @rtype: I{bool}
+        """
+        with self._condition:
+            job = self._currentJobs.pop(threadId, None)
+            if job is None or job.isDone():
+                return False
+
+            job.abandon()
+            self._releaseKey(job.key)
+            self._threads = [t for t in self._threads if t.ident != threadId]
+            if self._running:
+                self._startThread()
+        return True
+
+    def submit(self, plugin, event, callbacks=None):
+        """
+        Queue a plugin to process an event.
+
+        @param plugin: The plugin whose callbacks should process the event.
+        @type plugin: L{Plugin}
+        @param event: The Shotgun event to process.
+        @type event: I{dict}
+        @param callbacks: The callbacks the event was routed to. If None,
+            every callback checks the event itself.
+        @type callbacks: I{list} of L{Callback}
+
+        @return: The queued job.
+        @rtype: L{DispatchJob}
+        """
+        job = DispatchJob(plugin, event, callbacks)
+
+        # Nothing to wait for when the event wasn't routed to any callback.
+        if callbacks is not None and not callbacks:
+            job.run()
+            return job
+
+        # Events that aren't about an entity don't need to be kept in order.
+        entityKey = _getEntityKey(event)
+        if entityKey is None:
+            entityKey = event["id"]
+        key = (plugin._path, entityKey)
+        job.key = key
+
+        with self._condition:
+            if key in self._queues:
+                self._queues[key].append(job)
+            else:
+                self._queues[key] = collections.deque([job])
+                self._readyKeys.append(key)
+                self._condition.notify()
+
+        return job
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while self._running and not self._readyKeys:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                key = self._readyKeys.popleft()
+                job = self._queues[key][0]
+                threadId = threading.current_thread().ident
+                self._currentJobs[threadId] = job
+
+            job.run()
+
+            with self._condition:
+                # An abandoned job's key was released and the thread replaced.
+                if job.abandoned:
+                    return
+                del self._currentJobs[threadId]
+                self._releaseKey(key)
+
+    def _releaseKey(self, key):
+        queue = self._queues[key]
+        queue.popleft()
+        if queue:
+            self._readyKeys.append(key)
+            self._condition.notify()
+        else:
+            del self._queues[key]
+
+
 class CustomSMTPHandler(logging.handlers.SMTPHandler):
     """
     A custom SMTPHandler subclass that will adapt it's subject depending on the
@@ -1295,8 +3595,16 @@ class CustomSMTPHandler(logging.handlers.SMTPHandler):
     }
 
     def __init__(
-        self, smtpServer, fromAddr, toAddrs, emailSubject, credentials=None, secure=None
+        self,
+        smtpServer,
+        fromAddr,
+        toAddrs,
+        emailSubject,
+        credentials=None,
+        secure=None,
+        mailWorker=None,
     ):
+        self._mailWorker = mailWorker
         args = [smtpServer, fromAddr, toAddrs, emailSubject, credentials]
         if credentials:
             # Python 2.7 implemented the secure argument
@@ -1317,54 +3625,75 @@ class CustomSMTPHandler(logging.handlers.SMTPHandler):
         """
         Emit a record.
 
-        Format the record and send it to the specified addressees.
+        Format the record and send it to the specified addressees, or hand a
+        snapshot of it to the mail worker to be formatted and sent in a
+        digest, see L{_snapshotLogRecord}.
         """
+        if self._mailWorker is not None:
+            try:
+                self._mailWorker.put(self, _snapshotLogRecord(record, self.formatter))
+            except Exception:
+                self.handleError(record)
+            return
 
         # Mostly copied from Python 2.7 implementation.
         try:
-            import smtplib
-            from email.utils import formatdate
-
-            port = self.mailport
-            if not port:
-                port = smtplib.SMTP_PORT
-            smtp = smtplib.SMTP(self.mailhost, port)
-            msg = self.format(record)
-            msg = "From: %s\r\nTo: %s\r\nSubject: %s\r\nDate: %s\r\n\r\n%s" % (
-                self.fromaddr,
-                ",".join(self.toaddrs),
-                self.getSubject(record),
-                formatdate(),
-                msg,
-            )
-            if self.username:
-                if self.secure is not None:
-                    smtp.ehlo()
-                    smtp.starttls(*self.secure)
-                    smtp.ehlo()
-                smtp.login(self.username, self.password)
-            smtp.sendmail(self.fromaddr, self.toaddrs, msg)
+            smtp = self.connect()
+            self.sendMail(smtp, self.getSubject(record), self.format(record))
             smtp.close()
         except (KeyboardInterrupt, SystemExit):
             raise
         except:
             self.handleError(record)
 
+    def getConnectionKey(self):
+        """
+        @return: What identifies the connections this handler makes, which
+            can be reused to send its emails.
+        @rtype: I{tuple}
+        """
+        return (self.mailhost, self.mailport, self.username, self.secure)
 
-class EventDaemonError(Exception):
-    """
-    Base error for the Shotgun event system.
-    """
-
-    pass
-
-
-class ConfigError(EventDaemonError):
-    """
-    Used when an error is detected in the config file.
-    """
+    def connect(self):
+        """
+        Connect, and login if needed, to the SMTP server.
 
-    pass
+        @return: The connection.
+        @rtype: I{smtplib.SMTP}
+        """
+        port = self.mailport
+        if not port:
+            port = smtplib.SMTP_PORT
+        smtp = smtplib.SMTP(self.mailhost, port)
+        if self.username:
+            if self.secure is not None:
+                smtp.ehlo()
+                smtp.starttls(*self.secure)
+                smtp.ehlo()
+            smtp.login(self.username, self.password)
+        return smtp
+
+    def sendMail(self, smtp, subject, body):
+        """
+        Send an email to the handler's addressees.
+
+        @param smtp: The connection to send the email with.
+        @type smtp: I{smtplib.SMTP}
+        @param subject: The subject of the email.
+        @type subject: I{str}
+        @param body: The body of the email.
+        @type body: I{str}
+        """
+        from email.utils import formatdate
+
+        msg = "From: %s\r\nTo: %s\r\nSubject: %s\r\nDate: %s\r\n\r\n%s" % (
+            self.fromaddr,
+            ",".join(self.toaddrs),
+            subject,
+            formatdate(),
+            body,
+        )
+        smtp.sendmail(self.fromaddr, self.toaddrs, msg)
 
 
 if sys.platform == "win32":
@@ -1413,10 +3742,18 @@ class LinuxDaemon(daemonizer.Daemon):
     Linux Daemon wrapper or wrapper used for foreground operation on Windows
     """
 
-    def __init__(self):
-        self._engine = Engine(_getConfigPath())
+    def __init__(self, worker=None):
+        """
+        @param worker: The number of the worker to run, if the daemon is
+            sharded across several workers.
+        @type worker: I{int}
+        """
+        self._engine = Engine(_getConfigPath(), worker)
+        serviceName = "shotgunEvent"
+        if worker is not None:
+            serviceName += ".%d" % worker
         super(LinuxDaemon, self).__init__(
-            "shotgunEvent", self._engine.config.getEnginePIDFile()
+            serviceName, self._engine.settings.enginePidFile
         )
 
     def start(self, daemonize=True):
@@ -1453,12 +3790,41 @@ def main():
     if len(sys.argv) > 1:
         action = sys.argv[1]
 
-    if sys.platform == "win32" and action != "foreground":
+    if sys.platform == "win32" and action not in ("foreground", "replay", "backfill"):
         win32serviceutil.HandleCommandLine(WindowsService)
         return 0
 
-    if action:
-        daemon = LinuxDaemon()
+    if action == "replay" and len(sys.argv) in (3, 4):
+        try:
+            speed = float(sys.argv[3]) if len(sys.argv) == 4 else 0
+        except ValueError:
+            speed = -1
+        if len(sys.argv) == 4 and not speed > 0:
+            print("Invalid replay speed: %s" % sys.argv[3])
+        else:
+            try:
+                return replay(sys.argv[2], speed)
+            except (EventDaemonError, IOError) as err:
+                print("Could not replay %s: %s" % (sys.argv[2], err))
+    elif action == "backfill" and len(sys.argv) == 5:
+        try:
+            fromId, toId = int(sys.argv[3]), int(sys.argv[4])
+        except ValueError:
+            fromId = toId = 0
+        if not 0 < fromId <= toId:
+            print("Invalid event id range: %s to %s" % (sys.argv[3], sys.argv[4]))
+        else:
+            try:
+                return backfill(sys.argv[2], fromId, toId)
+            except EventDaemonError as err:
+                print("Could not backfill with %s: %s" % (sys.argv[2], err))
+    elif action and len(sys.argv) == 3 and not sys.argv[2].isdigit():
+        print("Invalid worker: %s" % sys.argv[2])
+    elif action and len(sys.argv) <= 3:
+        worker = None
+        if len(sys.argv) == 3:
+            worker = int(sys.argv[2])
+        daemon = LinuxDaemon(worker)
 
         # Find the function to call on the daemon and call it
         func = getattr(daemon, action, None)
@@ -1468,10 +3834,49 @@ def main():
 
         print("Unknown command: %s" % action)
 
-    print("usage: %s start|stop|restart|foreground" % sys.argv[0])
+    print("usage: %s start|stop|restart|foreground [worker]" % sys.argv[0])
+    print("       %s replay <journal> [speed > 0]" % sys.argv[0])
+    print("       %s backfill <plugin> <from_id> <to_id>" % sys.argv[0])
     return 2
 
 
+def replay(journalPath, speed=0):
+    """
+    Process the events of a journal recorded by the daemon, see the
+    record_file setting, and print how fast they were processed.
+
+    @param journalPath: The path of the journal to replay.
+    @type journalPath: I{str}
+    @param speed: How fast to replay the events compared to the pace they
+        were created at, 0 for as fast as they are processed.
+    @type speed: I{float}
+    """
+    engine = ReplayEngine(_getConfigPath(), journalPath, speed)
+    engine.start()
+    for line in engine.getReport():
+        print(line)
+    return 0
+
+
+def backfill(pluginName, fromId, toId):
+    """
+    Process the past events of an id range again with a plugin, next to the
+    daemon, and print how fast they were processed.
+
+    @param pluginName: The name of the plugin to process the events with.
+    @type pluginName: I{str}
+    @param fromId: The id of the first event to process.
+    @type fromId: I{int}
+    @param toId: The id of the last event to process.
+    @type toId: I{int}
+    """
+    engine = BackfillEngine(_getConfigPath(), pluginName, fromId, toId)
+    engine.start()
+    for line in engine.getReport():
+        print(line)
+    return 0
+
+
 def _getConfigPath():
     """
     Get the path of the shotgunEventDaemon configuration file.
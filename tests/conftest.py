@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The daemon isn't packaged, its modules are imported from the src folder.
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
@@ -0,0 +1,128 @@
+"""
+Stand-ins for the parts of the daemon the tested classes work with.
+"""
+
+import logging
+
+import callbackMonitors
+import engineMetrics
+import shotgunEventDaemon
+
+
+class FakeSettings(object):
+    """
+    The settings of a L{FakeEngine}, the defaults of the config.
+    """
+
+    logLevel = logging.INFO
+    logMode = 0
+    backupCount = 10
+    callbackTimeout = 0
+    callbackTimeoutAction = "log"
+    useSessionUuid = False
+    shotgunCallAccounting = False
+    sentryDsn = None
+    profileCallbacks = []
+    profileSampleRate = 1.0
+    profileInterval = 60
+    profilePath = None
+    profileBackupCount = 5
+
+
+class FakeEngine(object):
+    """
+    Stands in for the engine, finding events among the given ids.
+    """
+
+    config = None
+    timing_logger = None
+
+    def __init__(self, eventIds=(), shotgunPool=None):
+        self.settings = FakeSettings()
+        self.metrics = engineMetrics.EngineMetrics()
+        self.profiler = callbackMonitors.CallbackProfiler(self)
+        self.watchdog = callbackMonitors.CallbackWatchdog(self)
+        self.log = logging.getLogger("test.engine")
+        self.eventIds = list(eventIds)
+        self.queries = []
+        self._missingEventIdRanges = None
+        self._shotgunPool = shotgunPool
+        self._dispatcher = None
+
+    def setEmailsOnLogger(self, logger, emails):
+        pass
+
+    def getMissingEventIdRanges(self, firstId, lastId):
+        return shotgunEventDaemon.Engine.getMissingEventIdRanges(self, firstId, lastId)
+
+    def _wrapCallbackShotgun(self, shotgun, event):
+        return shotgun
+
+    def _createShotgun(self):
+        return None
+
+    def _findEvents(self, filters, fields, limit=0, shotgun=None):
+        self.queries.append(filters)
+        events = [
+            {"id": i}
+            for i in self.eventIds
+            if all(_matchesIdFilter(i, idFilter) for idFilter in filters)
+        ]
+        if limit:
+            events = events[:limit]
+        return events
+
+
+def _matchesIdFilter(eventId, idFilter):
+    """
+    @return: Whether an event id matches a filter on ids, other filters
+        match every id.
+    @rtype: I{bool}
+    """
+    if isinstance(idFilter, dict):
+        return any(_matchesIdFilter(eventId, f) for f in idFilter["filters"])
+    field, operator, value = idFilter
+    if field != "id":
+        return True
+    if operator == "between":
+        return value[0] <= eventId <= value[1]
+    if operator == "greater_than":
+        return eventId > value
+    raise ValueError("Unsupported operator %s." % operator)
+
+
+class FakePlugin(object):
+    """
+    Stands in for a plugin holding callbacks, always active.
+    """
+
+    def __init__(self, name):
+        self.logger = logging.getLogger("test.plugin." + name)
+        self.callbacks = []
+
+    def getName(self):
+        return self.logger.name
+
+    def isActive(self):
+        return True
+
+    def __iter__(self):
+        return iter(self.callbacks)
+
+
+def makeEvent(eventId, entityId=None, eventType="Shotgun_Task_Change"):
+    """
+    @return: An event about a task, or about no entity.
+    @rtype: I{dict}
+    """
+    event = {
+        "id": eventId,
+        "event_type": eventType,
+        "attribute_name": "sg_status_list",
+        "entity": None,
+        "meta": {},
+    }
+    if entityId is not None:
+        event["entity"] = {"type": "Task", "id": entityId}
+        event["meta"] = {"entity_type": "Task", "entity_id": entityId}
+    return event
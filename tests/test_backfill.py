@@ -0,0 +1,47 @@
+import unittest
+
+import eventFetchers
+import shotgunEventDaemon
+from helpers import FakeEngine
+
+
+class EventRangeFetcherTest(unittest.TestCase):
+    def test_chunks_are_handed_out_in_order(self):
+        engine = FakeEngine(range(1, 101))
+        fetcher = eventFetchers.EventRangeFetcher(engine, 5, 94, 20, 3)
+        fetcher.start([], ["id"])
+
+        chunks = []
+        events = fetcher.take()
+        while events is not None:
+            chunks.append([event["id"] for event in events])
+            events = fetcher.take()
+
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(chunks[0], list(range(5, 25)))
+        self.assertEqual(chunks[-1], list(range(85, 95)))
+        self.assertEqual(sum(chunks, []), list(range(5, 95)))
+        self.assertEqual(len(engine.queries), 5)
+
+    def test_cancel_stops_the_fetching(self):
+        engine = FakeEngine(range(1, 1001))
+        fetcher = eventFetchers.EventRangeFetcher(engine, 1, 1000, 10, 2)
+        fetcher.start([], ["id"])
+        self.assertEqual(len(fetcher.take()), 10)
+        fetcher.cancel()
+
+        # Only the chunks ahead of the ones handed out were fetched.
+        self.assertLessEqual(len(engine.queries), 1 + 2 * 2 + 2)
+
+
+class DetachedEngineTest(unittest.TestCase):
+    def test_subclasses_must_find_their_events(self):
+        class IncompleteEngine(shotgunEventDaemon.DetachedEngine):
+            def _getFirstEventId(self):
+                return 1
+
+        self.assertRaises(TypeError, IncompleteEngine, "shotgunEventDaemon.conf")
+
+
+if __name__ == "__main__":
+    unittest.main()
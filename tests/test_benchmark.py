@@ -0,0 +1,27 @@
+import os
+import unittest
+
+import benchmark
+
+
+class RunScenarioTest(unittest.TestCase):
+    def test_environment_is_restored(self):
+        scenario = benchmark.LogArgsScenario()
+        names = list(scenario.environment)
+        os.environ[names[0]] = "previous"
+        os.environ.pop(names[1], None)
+        try:
+            elapsed, metrics = benchmark.runScenario(scenario, 10, 0, 0, 0, 5, 30)
+        finally:
+            previous = os.environ.pop(names[0], None)
+
+        self.assertEqual(len(metrics.eventLag.getObserved()), 10)
+        self.assertEqual(previous, "previous")
+        self.assertNotIn(names[1], os.environ)
+
+    def test_scenarios_must_make_events(self):
+        self.assertRaises(TypeError, benchmark.Scenario)
+
+
+if __name__ == "__main__":
+    unittest.main()
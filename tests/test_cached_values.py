@@ -0,0 +1,57 @@
+import threading
+import unittest
+
+import shotgunEventDaemon
+
+
+class Loader(object):
+    """
+    Returns the number of times it was called, blocking once told to.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.allowed = threading.Event()
+        self.allowed.set()
+
+    def __call__(self):
+        self.allowed.wait(5)
+        self.calls += 1
+        if self.calls == 3:
+            raise RuntimeError("The service is down.")
+        return self.calls
+
+
+class CachedValuesTest(unittest.TestCase):
+    def setUp(self):
+        self.values = shotgunEventDaemon._CachedValues()
+        self.loader = Loader()
+
+    def _refresh(self):
+        # Return the stale value while refreshing it in the background.
+        self.loader.allowed.clear()
+        value = self.values.get("key", self.loader, 0)
+        self.loader.allowed.set()
+        for thread in threading.enumerate():
+            if thread.name == "cache-refresh":
+                thread.join(5)
+        return value
+
+    def test_value_is_only_loaded_once_within_its_ttl(self):
+        self.assertEqual(self.values.get("key", self.loader, 3600), 1)
+        self.assertEqual(self.values.get("key", self.loader, 3600), 1)
+        self.assertEqual(self.values.get("key", self.loader, -1), 1)
+        self.assertEqual(self.loader.calls, 1)
+
+    def test_stale_value_is_returned_while_refreshed(self):
+        self.assertEqual(self.values.get("key", self.loader, 0), 1)
+        self.assertEqual(self._refresh(), 1)
+
+        # A failed refresh keeps the stale value.
+        self.assertEqual(self._refresh(), 2)
+        self.assertEqual(self._refresh(), 2)
+        self.assertEqual(self.loader.calls, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+import shotgunEventDaemon
+from helpers import FakeEngine, FakePlugin, makeEvent
+
+
+def work(sg, logger, event, args):
+    return sum(range(1000))
+
+
+class CallbackProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.engine = FakeEngine()
+        self.engine.settings.profilePath = self.path
+        self.engine.settings.profileCallbacks = ["*.profiled.*"]
+        self.callback = shotgunEventDaemon.Callback(
+            work, FakePlugin("profiled"), self.engine, object()
+        )
+        self.profiler = self.engine.profiler
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_profiled_callbacks_are_sampled(self):
+        self.assertEqual(
+            self.profiler.getProfiledName(self.callback), "test.plugin.profiled.work"
+        )
+
+        self.engine.settings.profileSampleRate = 0
+        self.assertIsNone(self.profiler.getProfiledName(self.callback))
+
+        self.engine.settings.profileSampleRate = 1
+        self.engine.settings.profileCallbacks = ["*.other.*"]
+        self.assertIsNone(self.profiler.getProfiledName(self.callback))
+
+    def test_profiles_are_aggregated_and_dumped(self):
+        for eventId in range(3):
+            self.callback.process(makeEvent(eventId))
+        self.profiler.dumpStats()
+
+        dumps = os.listdir(self.path)
+        self.assertEqual(len(dumps), 1)
+        stats = pstats.Stats(os.path.join(self.path, dumps[0]))
+        calls = [
+            callCount
+            for (_, _, function), (_, callCount, _, _, _) in stats.stats.items()
+            if function == "work"
+        ]
+        self.assertEqual(calls, [3])
+
+    def test_only_the_latest_dumps_are_kept(self):
+        self.engine.settings.profileBackupCount = 2
+        for day in (1, 2, 3):
+            open(
+                os.path.join(self.path, "test.plugin.profiled.work.2020010%d-000000.pstats" % day),
+                "w",
+            ).close()
+        open(os.path.join(self.path, "other.pstats"), "w").close()
+
+        self.callback.process(makeEvent(1))
+        self.profiler.dumpStats()
+
+        dumps = sorted(os.listdir(self.path))
+        self.assertEqual(len(dumps), 3)
+        self.assertEqual(dumps[0], "other.pstats")
+        self.assertEqual(dumps[1], "test.plugin.profiled.work.20200103-000000.pstats")
+
+
+if __name__ == "__main__":
+    unittest.main()
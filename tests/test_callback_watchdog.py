@@ -0,0 +1,101 @@
+import logging
+import time
+import unittest
+
+from helpers import FakeEngine, FakePlugin, makeEvent
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class SlowCallback(object):
+    """
+    Stands in for a callback with a timeout of a few milliseconds.
+    """
+
+    def __init__(self):
+        self._plugin = FakePlugin("slow")
+        self._name = "callback"
+        self.logger = logging.getLogger("test.plugin.slow.callback")
+        self.abandoned = False
+
+    def getTimeout(self):
+        return 0.01
+
+    def getLogger(self):
+        return self.logger
+
+    def getFullName(self):
+        return "test.plugin.slow.callback"
+
+    def abandon(self):
+        self.abandoned = True
+
+
+class CallbackWatchdogTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = FakeEngine()
+        self.watchdog = self.engine.watchdog
+        self.callback = SlowCallback()
+        self.handler = RecordingHandler()
+        self.callback.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.callback.logger.removeHandler(self.handler)
+
+    def _checkOverdue(self):
+        watchId = self.watchdog.watch(self.callback, makeEvent(7))
+        time.sleep(0.02)
+        self.watchdog._check()
+        return watchId
+
+    def test_overdue_callbacks_are_logged_with_their_stack(self):
+        self._checkOverdue()
+
+        self.assertEqual(len(self.handler.records), 1)
+        message = self.handler.records[0].getMessage()
+        self.assertIn("processing event 7", message)
+        self.assertIn("_checkOverdue", message)
+        self.assertFalse(self.callback.abandoned)
+        self.assertEqual(
+            self.engine.metrics.callbackTimeouts.getValue(
+                (self.callback._plugin.getName(), "callback")
+            ),
+            1,
+        )
+
+        # Callbacks are only reported once.
+        self.watchdog._check()
+        self.assertEqual(len(self.handler.records), 1)
+
+    def test_overdue_callbacks_are_abandoned(self):
+        self.engine.settings.callbackTimeoutAction = "abandon"
+        self._checkOverdue()
+
+        self.assertTrue(self.callback.abandoned)
+        self.assertIn(
+            "Deactivating its plugin once it returns.",
+            self.handler.records[0].getMessage(),
+        )
+
+    def test_callbacks_done_in_time_are_left_alone(self):
+        watchId = self.watchdog.watch(self.callback, makeEvent(7))
+        self.watchdog.unwatch(watchId)
+        time.sleep(0.02)
+        self.watchdog._check()
+
+        self.assertEqual(self.handler.records, [])
+
+    def test_callbacks_without_timeout_are_not_watched(self):
+        self.callback.getTimeout = lambda: 0
+        self.assertIsNone(self.watchdog.watch(self.callback, makeEvent(7)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import eventIdStores
+import shotgunEventDaemon
+from helpers import FakeEngine
+from six.moves import cPickle as pickle
+
+
+class CheckpointingEngine(FakeEngine):
+    """
+    Counts the saves of the event id data instead of making them.
+    """
+
+    def __init__(self, checkpointEvents, checkpointInterval):
+        FakeEngine.__init__(self)
+        self.settings.checkpointEvents = checkpointEvents
+        self.settings.checkpointInterval = checkpointInterval
+        self._uncheckpointedEvents = 0
+        self._lastCheckpointTime = time.time()
+        self.saves = 0
+
+    def _saveEventIdData(self):
+        self.saves += 1
+        self._uncheckpointedEvents = 0
+        self._lastCheckpointTime = time.time()
+
+
+class CheckpointTest(unittest.TestCase):
+    def test_saves_are_grouped_by_number_of_events(self):
+        engine = CheckpointingEngine(10, 3600)
+        for _ in range(25):
+            shotgunEventDaemon.Engine._checkpointEventIdData(engine)
+
+        self.assertEqual(engine.saves, 2)
+        self.assertEqual(engine._uncheckpointedEvents, 5)
+
+    def test_saves_are_made_once_the_interval_went_by(self):
+        engine = CheckpointingEngine(1000, 3600)
+        shotgunEventDaemon.Engine._checkpointEventIdData(engine)
+        self.assertEqual(engine.saves, 0)
+
+        engine._lastCheckpointTime -= 3600
+        shotgunEventDaemon.Engine._checkpointEventIdData(engine)
+        self.assertEqual(engine.saves, 1)
+
+
+class DumpPickleAtomicallyTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempDir, "shotgunEventDaemon.id")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_file_is_replaced_whole(self):
+        eventIdStores._dumpPickleAtomically({"a": 1}, self.path)
+        eventIdStores._dumpPickleAtomically({"b": 2}, self.path)
+
+        with open(self.path, "rb") as fh:
+            self.assertEqual(pickle.load(fh), {"b": 2})
+        self.assertEqual(os.listdir(self.tempDir), ["shotgunEventDaemon.id"])
+
+    def test_failed_write_keeps_the_previous_file(self):
+        eventIdStores._dumpPickleAtomically({"a": 1}, self.path)
+        self.assertRaises(
+            Exception,
+            eventIdStores._dumpPickleAtomically,
+            {"b": lambda: None},
+            self.path,
+        )
+
+        with open(self.path, "rb") as fh:
+            self.assertEqual(pickle.load(fh), {"a": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
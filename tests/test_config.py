@@ -0,0 +1,124 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import daemonErrors
+import shotgunEventDaemon
+
+CONFIG = """
+[daemon]
+pidFile: /tmp/shotgunEventDaemon.pid
+eventIdFile: /tmp/shotgunEventDaemon.id
+logMode: 1
+logging: 20
+logPath: %(logPath)s
+logFile: shotgunEventDaemon
+max_conn_retries: 5
+conn_retry_sleep: 60
+fetch_interval: 5
+%(daemon)s
+
+[plugins]
+paths: /plugins/a, /plugins/b
+
+[shotgun]
+server: https://example.shotgunstudio.com
+name: eventDaemon
+key: secret
+use_session_uuid: True
+
+[emails]
+server: localhost
+from: daemon@example.com
+to: admin@example.com, other@example.com
+subject: Event daemon
+"""
+
+
+class ConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.configPath = os.path.join(self.path, "shotgunEventDaemon.conf")
+        self.logPath = os.path.join(self.path, "logs")
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _writeConfig(self, daemon=""):
+        with open(self.configPath, "w") as fh:
+            fh.write(CONFIG % {"logPath": self.logPath, "daemon": daemon})
+
+    def _getSnapshot(self, daemon=""):
+        self._writeConfig(daemon)
+        return shotgunEventDaemon.Config(self.configPath).getSnapshot()
+
+
+class ConfigSnapshotTest(ConfigTestCase):
+    def test_settings_are_read_with_their_defaults(self):
+        settings = self._getSnapshot("timing_log: on")
+
+        self.assertEqual(settings.shotgunUrl, "https://example.shotgunstudio.com")
+        self.assertEqual(settings.engineScriptKey, "secret")
+        self.assertIsNone(settings.engineProxyServer)
+        self.assertEqual(settings.pluginPaths, ("/plugins/a", "/plugins/b"))
+        self.assertEqual(settings.toAddrs, ("admin@example.com", "other@example.com"))
+        self.assertEqual(settings.maxEventBatchSize, 500)
+        self.assertEqual(settings.checkpointInterval, 1.0)
+        self.assertTrue(settings.serverSideFiltering)
+        self.assertFalse(settings.shotgunCallAccounting)
+        self.assertEqual(settings.eventIdStore, "pickle")
+        self.assertEqual(settings.leaseStore, "/tmp/shotgunEventDaemon.id.leases")
+        self.assertEqual(
+            settings.logFile, os.path.join(self.logPath, "shotgunEventDaemon")
+        )
+        self.assertEqual(settings.timingLogFile, settings.logFile + ".timing")
+        self.assertEqual(settings.profilePath, os.path.join(self.logPath, "profiles"))
+        self.assertTrue(os.path.isdir(self.logPath))
+
+    def test_invalid_settings_are_rejected(self):
+        for daemon in (
+            "max_event_batch_size: 0",
+            "prefetch_pages: many",
+            "callback_timeout_action: retry",
+        ):
+            self.assertRaises(
+                daemonErrors.ConfigError, self._getSnapshot, daemon
+            )
+
+    def test_snapshot_is_read_only(self):
+        settings = self._getSnapshot()
+        self.assertRaises(AttributeError, setattr, settings, "fetchInterval", 1)
+
+    def test_update_keeps_the_settings_needing_a_restart(self):
+        settings = self._getSnapshot("dispatch_threads: 2")
+        newer = self._getSnapshot("dispatch_threads: 4\nmax_event_batch_size: 50")
+
+        updated, ignored = settings.update(newer)
+
+        self.assertEqual(ignored, ["dispatchThreads"])
+        self.assertEqual(updated.dispatchThreads, 2)
+        self.assertEqual(updated.maxEventBatchSize, 50)
+
+
+class FakeReloadingEngine(object):
+    def __init__(self, configPath, settings):
+        self._configPath = configPath
+        self.settings = settings
+        self.log = logging.getLogger("test.engine")
+
+
+class ReloadConfigTest(ConfigTestCase):
+    def test_invalid_config_keeps_the_current_settings(self):
+        settings = self._getSnapshot()
+        engine = FakeReloadingEngine(self.configPath, settings)
+
+        for daemon in ("max_event_batch_size: 0", "[daemon"):
+            self._writeConfig(daemon)
+            self.assertFalse(shotgunEventDaemon.Engine.reloadConfig(engine))
+            self.assertIs(engine.settings, settings)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+import logging
+import sys
+import threading
+import unittest
+
+import logHandlers
+import shotgunEventDaemon
+
+
+class RecordingHandler(logging.Handler):
+    """
+    Keeps the messages of the records it handles and the threads it
+    formats them on.
+    """
+
+    def __init__(self, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.messages = []
+        self.threadNames = set()
+
+    def emit(self, record):
+        self.threadNames.add(threading.current_thread().name)
+        self.messages.append(record.getMessage())
+
+
+class FrameLocalsTest(unittest.TestCase):
+    def test_values_changed_after_capture_are_left_out(self):
+        ids = [1, 2]
+        entity = {"type": "Task", "ids": ids}
+        frameLocals = logHandlers.FrameLocals(sys._getframe())
+        ids.append(3)
+        entity["name"] = "changed"
+
+        text = str(frameLocals)
+        self.assertIn("'entity': {'ids': [1, 2], 'type': 'Task'},", text)
+        self.assertIn("'ids': [1, 2],", text)
+
+    def test_representation_is_bounded(self):
+        items = list(range(1000))
+        nested = [[[[[[1]]]]]]
+        longText = "x" * 10000
+        text = str(logHandlers.FrameLocals(sys._getframe()))
+
+        self.assertIn(" 'items': [0, 1, 2, 3, 4, 5,", text)
+        self.assertIn(" 19, ...],", text)
+        self.assertIn(" 'nested': [[[[[...]]]]],", text)
+        self.assertIn(" 'longText': 'xxx", text)
+        self.assertLess(len(text), 2000)
+
+    def test_other_objects_are_represented_when_captured(self):
+        class Counter(object):
+            count = 0
+
+            def __repr__(self):
+                return "Counter(%d)" % self.count
+
+        counter = Counter()
+        frameLocals = logHandlers.FrameLocals(sys._getframe())
+        counter.count = 1
+
+        self.assertIn("'counter': Counter(0),", str(frameLocals))
+
+
+class FormattedTracebackTest(unittest.TestCase):
+    def test_exception_is_formatted(self):
+        try:
+            raise ValueError("Bad value")
+        except ValueError:
+            formattedTraceback = logHandlers.FormattedTraceback(sys.exc_info())
+
+        lines = str(formattedTraceback).splitlines()
+        self.assertEqual(lines[0], "Traceback (most recent call last):")
+        self.assertIn("test_exception_is_formatted", str(formattedTraceback))
+        self.assertEqual(lines[-1], "ValueError: Bad value")
+
+
+class DeferredTextTest(unittest.TestCase):
+    def setUp(self):
+        self.writer = logHandlers.LogWriter()
+        self.logger = logging.getLogger("test.deferredText")
+        self.logger.propagate = False
+
+    def tearDown(self):
+        self.writer.stop()
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+
+    def test_snapshots_are_rendered_on_the_writer_thread(self):
+        rendered = []
+
+        class Text(logHandlers.DeferredText):
+            def _render(self):
+                rendered.append(threading.current_thread().name)
+                return "rendered"
+
+        handler = RecordingHandler()
+        queuedHandler = logHandlers.QueuedLogHandler(self.writer, "unused")
+        queuedHandler.format = handler.format
+        self.writer._write = lambda items: [
+            handler.handle(record) for _, record in items
+        ]
+        self.logger.addHandler(queuedHandler)
+
+        self.logger.critical("Failed: %s", Text())
+        self.assertEqual(rendered, [])
+        self.writer.start()
+        self.writer.stop()
+
+        self.assertEqual(handler.messages, ["Failed: rendered"])
+        self.assertEqual(rendered, ["log-writer"])
+
+
+@unittest.skipIf(shotgunEventDaemon.sentry_sdk is None, "sentry_sdk is not installed")
+class SentryLogHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = logHandlers.SentryLogHandler()
+        self.events = RecordingHandler(logging.ERROR)
+        self.breadcrumbs = RecordingHandler(logging.INFO)
+        self.handler._handlers = [self.breadcrumbs, self.events]
+        self.logger = logging.getLogger("test.sentry")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.handler.stop()
+
+    def test_records_are_handed_over_on_the_sentry_thread(self):
+        ids = [1]
+        self.handler.start()
+        self.logger.info("Processing %s", ids)
+        self.logger.error("Failed on %s", ids)
+        ids.append(2)
+        self.handler.stop()
+
+        self.assertEqual(self.breadcrumbs.messages, ["Processing [1]", "Failed on [1]"])
+        self.assertEqual(self.events.messages, ["Failed on [1]"])
+        self.assertEqual(self.events.threadNames, set(["sentry"]))
+
+    def test_exceptions_are_handed_over_right_away(self):
+        self.handler.start()
+        try:
+            raise ValueError("Bad value")
+        except ValueError:
+            self.logger.exception("Failed")
+
+        self.assertEqual(self.events.messages, ["Failed"])
+        self.assertEqual(self.events.threadNames, set(["MainThread"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import eventIdStores
+import shotgunEventDaemon
+from helpers import FakeEngine
+
+
+class FindBacklogEventsTest(unittest.TestCase):
+    def test_span_is_walked_past_processed_events(self):
+        # Every other id is a backlog range, the ones between were processed.
+        rangeCount = shotgunEventDaemon.MAX_BACKLOG_QUERY_RANGES + 10
+        backlogRanges = [(i * 2, i * 2) for i in range(rangeCount)]
+        engine = FakeEngine(range(rangeCount * 2))
+
+        events = shotgunEventDaemon.Engine._findBacklogEvents(
+            engine, backlogRanges, [], ["id"], 7
+        )
+
+        self.assertEqual(
+            [event["id"] for event in events], [i * 2 for i in range(rangeCount)]
+        )
+        self.assertGreater(len(engine.queries), 1)
+
+
+class FakeCollection(object):
+    def __init__(self, nextNewEventId, backlogRanges):
+        self.nextNewEventId = nextNewEventId
+        self.backlogRanges = backlogRanges
+
+    def getNextNewEventId(self):
+        return self.nextNewEventId
+
+    def getBacklogEventRanges(self):
+        return self.backlogRanges
+
+
+class FetchingEngine(FakeEngine):
+    def __init__(self, eventIds, collections):
+        FakeEngine.__init__(self, eventIds)
+        self.settings.maxEventBatchSize = 5
+        self._pluginCollections = collections
+        self._prefetcher = None
+
+    def _getEventFilters(self):
+        return []
+
+    def _getEventFields(self):
+        return ["id"]
+
+    def _findBacklogEvents(self, backlogRanges, eventFilters, fields, limit):
+        return shotgunEventDaemon.Engine._findBacklogEvents(
+            self, backlogRanges, eventFilters, fields, limit
+        )
+
+
+class GetNewEventsTest(unittest.TestCase):
+    def test_backlog_is_fetched_apart_from_new_events(self):
+        engine = FetchingEngine(
+            range(1, 101),
+            [FakeCollection(50, [(10, 10)]), FakeCollection(60, [(20, 21)])],
+        )
+
+        events = shotgunEventDaemon.Engine._getNewEvents(engine)
+
+        # New events start from the high-water mark, the backlog doesn't make
+        # the events that follow it be fetched again.
+        self.assertEqual(
+            [event["id"] for event in events], [10, 20, 21, 50, 51, 52, 53, 54]
+        )
+        self.assertEqual(engine.queries[0], [["id", "greater_than", 49]])
+        self.assertEqual(len(engine.queries), 2)
+        self.assertTrue(engine._fetchedFullBatch)
+
+    def test_backlog_is_fetched_without_new_events(self):
+        engine = FetchingEngine(range(1, 101), [FakeCollection(None, [(7, 8)])])
+
+        events = shotgunEventDaemon.Engine._getNewEvents(engine)
+
+        self.assertEqual([event["id"] for event in events], [7, 8])
+        self.assertEqual(engine.queries, [[["id", "between", [7, 8]]]])
+
+
+def _makeEvent(eventId, minutesAgo=0):
+    return {
+        "id": eventId,
+        "created_at": datetime.datetime.now()
+        - datetime.timedelta(minutes=minutesAgo),
+    }
+
+
+class FindMissingEventIdsTest(unittest.TestCase):
+    def test_ids_left_out_by_the_filter_are_not_missing(self):
+        # Ids 5 and 6 are of no event, the others were left out by the filter.
+        engine = FakeEngine([1, 2, 3, 4, 7, 8, 9, 10])
+        events = [_makeEvent(3), _makeEvent(7), _makeEvent(10)]
+
+        missingRanges = shotgunEventDaemon.Engine._findMissingEventIds(
+            engine, 1, events
+        )
+
+        self.assertEqual(missingRanges, [(5, 6)])
+        self.assertEqual(engine.queries, [[["id", "between", [1, 9]]]])
+
+    def test_ids_skipped_by_old_events_are_not_looked_up(self):
+        engine = FakeEngine([1, 2, 3])
+        events = [_makeEvent(3, minutesAgo=shotgunEventDaemon.BACKLOG_TIMEOUT + 1)]
+
+        missingRanges = shotgunEventDaemon.Engine._findMissingEventIds(
+            engine, 1, events
+        )
+
+        self.assertEqual(missingRanges, [])
+        self.assertEqual(engine.queries, [])
+
+
+class PluginBacklogTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        pluginPath = os.path.join(self.path, "plugin.py")
+        with open(pluginPath, "w") as fh:
+            fh.write("")
+        self.engine = FakeEngine()
+        self.plugin = shotgunEventDaemon.Plugin(self.engine, pluginPath)
+        self.plugin.setState(1)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_skipped_ids_are_backlogged(self):
+        self.plugin.commitEvent(_makeEvent(10), True)
+
+        self.assertEqual(self.plugin.getBacklogEventRanges(), [(2, 9)])
+
+    def test_ids_left_out_by_the_filter_are_not_backlogged(self):
+        self.engine._missingEventIdRanges = [(5, 6)]
+        self.plugin.commitEvent(_makeEvent(10), True)
+
+        self.assertEqual(self.plugin.getBacklogEventRanges(), [(5, 6)])
+
+
+class EventIdBacklogTest(unittest.TestCase):
+    def setUp(self):
+        self.expiration = datetime.datetime(2020, 1, 1)
+
+    def test_remove_splits_range(self):
+        backlog = eventIdStores.EventIdBacklog()
+        backlog.add(10, 20, self.expiration)
+        backlog.remove(15)
+
+        self.assertNotIn(15, backlog)
+        self.assertIn(14, backlog)
+        self.assertIn(16, backlog)
+        self.assertEqual(backlog.getRanges(), [(10, 14), (16, 20)])
+
+    def test_expire_drops_ranges(self):
+        backlog = eventIdStores.EventIdBacklog()
+        backlog.add(1, 3, self.expiration)
+        backlog.add(5, 5, self.expiration + datetime.timedelta(minutes=10))
+        backlog.expire(self.expiration + datetime.timedelta(minutes=1))
+
+        self.assertEqual(backlog.getRanges(), [(5, 5)])
+
+    def test_merge_ranges(self):
+        self.assertEqual(
+            eventIdStores.EventIdBacklog.mergeRanges([(5, 6), (1, 2), (3, 4)]),
+            [(1, 6)],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
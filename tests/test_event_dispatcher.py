@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import shotgunEventDaemon
+from helpers import FakeEngine, makeEvent
+
+
+class FakeCallback(object):
+    """
+    A callback processing events once allowed to, failing for some entities.
+    """
+
+    def __init__(self, failingEntityIds=()):
+        self.failingEntityIds = failingEntityIds
+        self.lock = threading.Lock()
+        self.started = {}
+        self.allowed = {}
+
+    def _getEvent(self, events, event):
+        with self.lock:
+            return events.setdefault(event["id"], threading.Event())
+
+    def waitStarted(self, event):
+        return self._getEvent(self.started, event).wait(5)
+
+    def allow(self, event):
+        self._getEvent(self.allowed, event).set()
+
+    def isActive(self):
+        return True
+
+    def process(self, event):
+        self._getEvent(self.started, event).set()
+        self._getEvent(self.allowed, event).wait(5)
+        return event["entity"]["id"] not in self.failingEntityIds
+
+
+class EventDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        pluginPath = os.path.join(self.path, "plugin.py")
+        with open(pluginPath, "w") as fh:
+            fh.write("")
+        self.engine = FakeEngine()
+        self.plugin = shotgunEventDaemon.Plugin(self.engine, pluginPath)
+        self.dispatcher = shotgunEventDaemon.EventDispatcher(self.engine, 2)
+        self.dispatcher.start()
+
+    def tearDown(self):
+        self.dispatcher.stop()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_failure_for_one_entity_keeps_the_others_processed(self):
+        callback = FakeCallback(failingEntityIds=(1,))
+        failing = makeEvent(1, 1)
+        succeeding = makeEvent(2, 2)
+        failingJob = self.dispatcher.submit(self.plugin, failing, [callback])
+        succeedingJob = self.dispatcher.submit(self.plugin, succeeding, [callback])
+
+        # The callback fails for the first entity while it still runs for
+        # the second one.
+        self.assertTrue(callback.waitStarted(succeeding))
+        callback.allow(failing)
+        self.assertFalse(failingJob.wait())
+        callback.allow(succeeding)
+        self.assertTrue(succeedingJob.wait())
+        self.assertFalse(self.plugin.isActive())
+
+    def test_abandon_deactivates_the_callback_and_its_plugin(self):
+        callback = shotgunEventDaemon.Callback(
+            lambda sg, logger, event, args: None,
+            self.plugin,
+            self.engine,
+            ("script", "key"),
+        )
+        callback.abandon()
+        self.assertFalse(callback.isActive())
+        self.assertFalse(self.plugin.isActive())
+
+
+if __name__ == "__main__":
+    unittest.main()
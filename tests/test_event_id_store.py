@@ -0,0 +1,72 @@
+import datetime
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import eventIdStores
+from six.moves import cPickle as pickle
+
+
+class JournalEventIdStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempDir, "shotgunEventDaemon.id")
+        self.log = logging.getLogger("test.store")
+        self.expiration = datetime.datetime(2020, 1, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def _createStore(self):
+        return eventIdStores.JournalEventIdStore(self.path, self.log)
+
+    def test_changes_are_replayed(self):
+        store = self._createStore()
+        store.save({"/plugins": {"a": (10, []), "b": (5, [])}})
+        store.save(
+            {"/plugins": {"a": (20, [(12, 15, self.expiration)]), "b": (5, [])}}
+        )
+        store.save({"/plugins": {"a": (21, [(12, 13, self.expiration)])}})
+        store._close()
+
+        self.assertEqual(
+            self._createStore().load(),
+            {"/plugins": {"a": (21, [(12, 13, self.expiration)])}},
+        )
+
+    def test_backlog_changes_are_deltas(self):
+        store = self._createStore()
+        ranges = [(i * 10, i * 10 + 5, self.expiration) for i in range(100)]
+        store.save({"/plugins": {"a": (1000, ranges)}})
+        size = os.path.getsize(self.path)
+
+        store.save({"/plugins": {"a": (1001, ranges[1:])}})
+        store._close()
+
+        self.assertLess(os.path.getsize(self.path) - size, 200)
+        self.assertEqual(
+            self._createStore().load(), {"/plugins": {"a": (1001, ranges[1:])}}
+        )
+
+    def test_pickle_file_is_rewritten_not_appended_to(self):
+        eventIdStores.PickleEventIdStore(self.path, self.log).save(
+            {"/plugins": {"a": (10, [])}}
+        )
+
+        store = self._createStore()
+        store.load()
+        store.save({"/plugins": {"a": (11, [])}})
+        store._close()
+
+        with open(self.path, "rb") as fh:
+            self.assertEqual(pickle.load(fh), eventIdStores.JournalEventIdStore.HEADER)
+        self.assertEqual(
+            eventIdStores.PickleEventIdStore(self.path, self.log).load(),
+            {"/plugins": {"a": (11, [])}},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
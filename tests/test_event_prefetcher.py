@@ -0,0 +1,51 @@
+import unittest
+
+import eventFetchers
+from helpers import FakeEngine
+
+
+class EventPrefetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = FakeEngine(range(1, 21))
+        self.prefetcher = eventFetchers.EventPrefetcher(self.engine, None, 2)
+
+    def tearDown(self):
+        self.prefetcher.cancel()
+
+    def _take(self, startId, fields=("id",)):
+        events = self.prefetcher.take(startId, [], list(fields), 5)
+        if events is None:
+            return None
+        return [event["id"] for event in events]
+
+    def test_pages_are_handed_out_in_order(self):
+        self.prefetcher.prefetch(6, [], ["id"], 5)
+
+        self.assertEqual(self._take(6), [6, 7, 8, 9, 10])
+        self.assertEqual(self._take(11), [11, 12, 13, 14, 15])
+        self.assertEqual(self._take(16), [16, 17, 18, 19, 20])
+        # The last page isn't full, nothing is fetched past it.
+        self.assertEqual(self._take(21), [])
+        self.assertIsNone(self._take(21))
+        self.assertEqual(len(self.engine.queries), 4)
+
+    def test_prefetching_again_from_the_next_page_keeps_going(self):
+        self.prefetcher.prefetch(1, [], ["id"], 5)
+        self.assertEqual(self._take(1), [1, 2, 3, 4, 5])
+        self.prefetcher.prefetch(6, [], ["id"], 5)
+
+        self.assertEqual(self._take(6), [6, 7, 8, 9, 10])
+
+    def test_other_queries_cancel_the_prefetching(self):
+        self.prefetcher.prefetch(1, [], ["id"], 5)
+
+        self.assertIsNone(self._take(1, fields=("id", "meta")))
+        self.assertIsNone(self._take(1))
+
+    def test_nothing_is_handed_out_unless_prefetched(self):
+        self.assertIsNone(self._take(1))
+        self.assertEqual(self.engine.queries, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
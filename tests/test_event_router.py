@@ -0,0 +1,135 @@
+import unittest
+
+import shotgunEventDaemon
+from helpers import FakeEngine, FakePlugin
+
+
+def noop(sg, logger, event, args):
+    pass
+
+
+MATCH_EVENTS = [
+    None,
+    {"*": None},
+    {"*": "*"},
+    {"*": ["sg_status_list"]},
+    {"Shotgun_Task_Change": None},
+    {"Shotgun_Task_Change": "*"},
+    {"Shotgun_Task_Change": ["*"]},
+    {"Shotgun_Task_Change": "task_assignees"},
+    {"Shotgun_Task_Change": ["task_assignees", "sg_status_list"]},
+    {"Shotgun_Task_Change": ["sg_status_list", "sg_status_list"]},
+    {"Shotgun_Task_Change": "sg_status_list", "Shotgun_Shot_New": None},
+]
+
+EVENTS = [
+    {"event_type": "Shotgun_Task_Change", "attribute_name": "task_assignees"},
+    {"event_type": "Shotgun_Task_Change", "attribute_name": "sg_status_list"},
+    {"event_type": "Shotgun_Task_Change", "attribute_name": "content"},
+    {"event_type": "Shotgun_Task_Change", "attribute_name": None},
+    {"event_type": "Shotgun_Shot_New", "attribute_name": None},
+    {"event_type": "Shotgun_Shot_Change", "attribute_name": "sg_status_list"},
+]
+
+
+class RouterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.plugin = FakePlugin("router")
+        self.router = shotgunEventDaemon.EventRouter()
+
+    def _addCallback(self, matchEvents, fields=None):
+        callback = shotgunEventDaemon.Callback(
+            noop,
+            self.plugin,
+            FakeEngine(),
+            ("script", "key"),
+            matchEvents,
+            fields=fields,
+        )
+        self.plugin.callbacks.append(callback)
+        return callback
+
+
+class EventRouterTest(RouterTestCase):
+    def test_route_matches_can_process(self):
+        for matchEvents in MATCH_EVENTS:
+            self._addCallback(matchEvents)
+        self.router.compile([[self.plugin]])
+
+        for event in EVENTS:
+            expected = [c for c in self.plugin.callbacks if c.canProcess(event)]
+            routed = self.router.route(event).get(self.plugin, [])
+            self.assertEqual(routed, expected, event)
+
+    def test_string_attribute_is_one_name(self):
+        callback = self._addCallback({"Shotgun_Task_Change": "task_assignees"})
+        self.router.compile([[self.plugin]])
+
+        self.assertEqual(
+            callback.getRouteKeys(), [("Shotgun_Task_Change", "task_assignees")]
+        )
+        self.assertEqual(
+            self.router.getEventFilter(),
+            {
+                "filter_operator": "all",
+                "filters": [
+                    ["event_type", "is", "Shotgun_Task_Change"],
+                    ["attribute_name", "in", ["task_assignees"]],
+                ],
+            },
+        )
+
+    def test_duplicate_attributes_route_once(self):
+        callback = self._addCallback({"T": ["a", "a"]})
+        self.router.compile([[self.plugin]])
+
+        routed = self.router.route({"event_type": "T", "attribute_name": "a"})
+        self.assertEqual(routed, {self.plugin: [callback]})
+
+
+    def test_fields_are_the_ones_of_active_callbacks(self):
+        self._addCallback(None, ["meta"])
+        self._addCallback(None, ["meta", "entity"])
+        inactive = self._addCallback(None)
+        inactive._active = False
+        self.router.compile([[self.plugin]])
+
+        self.assertEqual(self.router.getEventFields(), set(["meta", "entity"]))
+
+    def test_fields_are_unknown_if_a_callback_declares_none(self):
+        self._addCallback(None, ["meta"])
+        self._addCallback(None)
+        self.router.compile([[self.plugin]])
+
+        self.assertIsNone(self.router.getEventFields())
+
+
+class FieldsEngine(FakeEngine):
+    def __init__(self, router):
+        FakeEngine.__init__(self)
+        self._router = router
+        self._recorder = None
+
+
+class GetEventFieldsTest(RouterTestCase):
+    def _getEventFields(self):
+        return shotgunEventDaemon.Engine._getEventFields(FieldsEngine(self.router))
+
+    def test_engine_fields_are_added(self):
+        self._addCallback(None, ["meta"])
+        self.router.compile([[self.plugin]])
+
+        self.assertEqual(
+            self._getEventFields(),
+            sorted(set(["meta"] + shotgunEventDaemon.ENGINE_EVENT_FIELDS)),
+        )
+
+    def test_every_field_is_fetched_without_declarations(self):
+        self._addCallback(None)
+        self.router.compile([[self.plugin]])
+
+        self.assertEqual(self._getEventFields(), shotgunEventDaemon.EVENT_FIELDS)
+
+
+if __name__ == "__main__":
+    unittest.main()
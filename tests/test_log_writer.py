@@ -0,0 +1,101 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import logHandlers
+
+
+class ThreadFormatter(logging.Formatter):
+    """
+    Records the threads it formats records on.
+    """
+
+    def __init__(self):
+        logging.Formatter.__init__(self, "%(levelname)s %(message)s")
+        self.threadNames = set()
+
+    def format(self, record):
+        self.threadNames.add(threading.current_thread().name)
+        return logging.Formatter.format(self, record)
+
+
+class LogWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.writer = logHandlers.LogWriter(maxOpenFiles=2)
+        self.logger = logging.getLogger("test.logWriter")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        self.writer.stop()
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _addHandler(self, name):
+        handler = logHandlers.QueuedLogHandler(
+            self.writer, os.path.join(self.path, name)
+        )
+        handler.setFormatter(ThreadFormatter())
+        self.logger.addHandler(handler)
+        return handler
+
+    def _read(self, name):
+        with open(os.path.join(self.path, name)) as fh:
+            return fh.read()
+
+    def test_records_are_formatted_on_the_writer_thread(self):
+        handler = self._addHandler("log")
+        self.writer.start()
+        self.logger.info("Processed %d events", 3)
+        self.writer.stop()
+
+        self.assertEqual(self._read("log"), "INFO Processed 3 events\n")
+        self.assertEqual(handler.formatter.threadNames, set(["log-writer"]))
+
+    def test_mutable_arguments_are_rendered_when_logged(self):
+        self._addHandler("log")
+        ids = [1, 2]
+        self.logger.info("Ids %s", ids)
+        ids.append(3)
+        self.writer.start()
+        self.writer.stop()
+
+        self.assertEqual(self._read("log"), "INFO Ids [1, 2]\n")
+
+    def test_exceptions_are_rendered_when_logged(self):
+        self._addHandler("log")
+        try:
+            raise ValueError("Bad value")
+        except ValueError:
+            self.logger.exception("Failed")
+        self.writer.start()
+        self.writer.stop()
+
+        lines = self._read("log").splitlines()
+        self.assertEqual(lines[0], "ERROR Failed")
+        self.assertEqual(lines[-1], "ValueError: Bad value")
+
+    def test_open_files_stay_under_the_limit(self):
+        handlers = [self._addHandler(name) for name in ("a", "b", "c")]
+        self.logger.info("Written to every file")
+        self.writer._writeQueued()
+
+        openPaths = [
+            path
+            for path, fileHandler in self.writer._openFiles.items()
+            if fileHandler.stream is not None
+        ]
+        self.assertEqual(openPaths, [handlers[1].path, handlers[2].path])
+
+        self.writer.stop()
+        for name in ("a", "b", "c"):
+            self.assertEqual(self._read(name), "INFO Written to every file\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
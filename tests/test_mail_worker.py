@@ -0,0 +1,106 @@
+import logging
+import unittest
+
+import logHandlers
+import shotgunEventDaemon
+
+
+class FakeSMTP(object):
+    """
+    Stands in for an SMTP connection, keeping the emails sent through it.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def sendmail(self, fromAddr, toAddrs, msg):
+        self.sent.append(msg)
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSMTPHandler(shotgunEventDaemon.CustomSMTPHandler):
+    def __init__(self, mailWorker):
+        shotgunEventDaemon.CustomSMTPHandler.__init__(
+            self,
+            ("localhost", 25),
+            "daemon@example.com",
+            ["admin@example.com"],
+            "Event daemon",
+            mailWorker=mailWorker,
+        )
+        self.setFormatter(logging.Formatter("%(message)s"))
+        self.connections = []
+
+    def connect(self):
+        smtp = FakeSMTP()
+        self.connections.append(smtp)
+        return smtp
+
+
+class MailWorkerTest(unittest.TestCase):
+    def _createRecord(self, name, level, msg):
+        return logging.LogRecord(name, level, __file__, 1, msg, None, None)
+
+    def test_records_are_sent_in_digests(self):
+        worker = logHandlers.MailWorker(60, 2)
+        handler = FakeSMTPHandler(worker)
+        worker.start()
+        handler.handle(self._createRecord("plugin.a", logging.ERROR, "first"))
+        handler.handle(self._createRecord("plugin.a", logging.CRITICAL, "second"))
+        handler.handle(self._createRecord("plugin.a", logging.ERROR, "third"))
+        handler.handle(self._createRecord("plugin.b", logging.ERROR, "other"))
+        worker.stop()
+
+        self.assertEqual(len(handler.connections), 1)
+        smtp = handler.connections[0]
+        self.assertTrue(smtp.closed)
+        self.assertEqual(len(smtp.sent), 2)
+
+        digest = smtp.sent[0]
+        self.assertIn("CRITICAL - SG event daemon. (3 messages)", digest)
+        self.assertIn("first", digest)
+        self.assertIn("second", digest)
+        self.assertNotIn("third", digest)
+        self.assertIn("1 more messages were dropped.", digest)
+        self.assertIn("other", smtp.sent[1])
+
+    def test_records_are_sent_right_away_once_stopped(self):
+        worker = logHandlers.MailWorker(60, 10)
+        handler = FakeSMTPHandler(worker)
+        worker.stop()
+        handler.handle(self._createRecord("plugin.a", logging.ERROR, "late"))
+
+        self.assertEqual(len(handler.connections), 1)
+        self.assertIn("late", handler.connections[0].sent[0])
+
+    def test_records_are_sent_as_they_were_logged(self):
+        worker = logHandlers.MailWorker(60, 10)
+        handler = FakeSMTPHandler(worker)
+        logger = logging.getLogger("test.mailWorker")
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            ids = [1, 2]
+            logger.error("Failed on %s", ids)
+            ids.append(3)
+            try:
+                raise ValueError("Bad value")
+            except ValueError:
+                logger.exception("Failed")
+        finally:
+            logger.removeHandler(handler)
+        worker.stop()
+
+        digest = handler.connections[0].sent[0]
+        self.assertIn("Failed on [1, 2]", digest)
+        self.assertIn("ValueError: Bad value", digest)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+import engineMetrics
+from six.moves.urllib.error import HTTPError
+from six.moves.urllib.request import urlopen
+
+
+class MetricTest(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = engineMetrics.Histogram(
+            "duration", "Time taken.", (0.1, 1), ("plugin",)
+        )
+        for value in (0.05, 0.5, 0.5, 2):
+            histogram.observe(value, ("a",))
+
+        self.assertEqual(
+            histogram.render(),
+            [
+                "# HELP duration Time taken.",
+                "# TYPE duration histogram",
+                'duration_bucket{plugin="a",le="0.1"} 1',
+                'duration_bucket{plugin="a",le="1"} 3',
+                'duration_bucket{plugin="a",le="+Inf"} 4',
+                'duration_sum{plugin="a"} 3.05',
+                'duration_count{plugin="a"} 4',
+            ],
+        )
+
+    def test_counter_label_values_are_escaped(self):
+        counter = engineMetrics.Counter("errors", "Errors.", ("plugin",))
+        counter.inc(('say "hi"\n',))
+        counter.inc(('say "hi"\n',), 2)
+
+        self.assertEqual(counter.render()[-1], 'errors{plugin="say \\"hi\\"\\n"} 3')
+
+    def test_recording_histogram_percentiles(self):
+        histogram = engineMetrics.RecordingHistogram("lag", "Lag.", (1,))
+        for value in range(1, 101):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.getPercentile(0.5), 51)
+        self.assertEqual(histogram.getPercentile(0.99), 99)
+        self.assertEqual(len(histogram.getObserved()), 100)
+
+
+class MetricsServerTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = engineMetrics.EngineMetrics()
+        self.server = engineMetrics.MetricsServer(self.metrics, "127.0.0.1", 0)
+        self.server.start()
+        self.url = "http://127.0.0.1:%d" % self.server._server.server_address[1]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_metrics_are_served(self):
+        self.metrics.callbackErrors.inc(("plugin", "callback"))
+
+        response = urlopen(self.url + "/metrics")
+        body = response.read().decode("utf-8")
+
+        self.assertEqual(response.getcode(), 200)
+        self.assertIn(
+            'shotgun_event_daemon_callback_errors_total{plugin="plugin",callback="callback"} 1',
+            body,
+        )
+
+    def test_other_paths_are_not_found(self):
+        with self.assertRaises(HTTPError) as context:
+            urlopen(self.url + "/other")
+        self.assertEqual(context.exception.code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import shotgunEventDaemon
+from helpers import FakeEngine
+
+PLUGIN = """
+def registerCallbacks(reg):
+    reg.registerCallback("script", "key", callback)
+
+
+def callback(sg, logger, event, args):
+    pass
+"""
+
+
+class PluginCollectionTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self._writePlugin("first.py")
+        self._writePlugin("second.py")
+        self.collection = shotgunEventDaemon.PluginCollection(FakeEngine(), self.path)
+        self.collection.load()
+        self.collection.setState(10)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _writePlugin(self, basename, mtime=None):
+        path = os.path.join(self.path, basename)
+        with open(path, "w") as fh:
+            fh.write(PLUGIN)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def _getPlugins(self):
+        return dict((plugin.getName(), plugin) for plugin in self.collection)
+
+    def test_unchanged_plugins_are_not_reloaded(self):
+        plugins = self._getPlugins()
+
+        self.assertFalse(self.collection.load())
+        self.assertFalse(self.collection.reload(set(["first.py"])))
+        self.assertEqual(self._getPlugins(), plugins)
+
+    def test_only_changed_plugins_are_reloaded_and_keep_their_state(self):
+        plugins = self._getPlugins()
+        first = plugins["first"]
+        callbacks = list(first)
+        plugins["second"].setState(20)
+        self._writePlugin("first.py", time.time() + 10)
+
+        self.assertTrue(self.collection.reload(set(["first.py"])))
+
+        self.assertIsNot(list(first)[0], callbacks[0])
+        self.assertIs(self._getPlugins()["first"], first)
+        self.assertEqual(first.getState()[0], 10)
+        self.assertEqual(plugins["second"].getState()[0], 20)
+
+    def test_removed_plugins_are_unloaded_and_their_state_kept(self):
+        os.remove(os.path.join(self.path, "second.py"))
+
+        self.assertTrue(self.collection.reload(set(["second.py"])))
+
+        self.assertEqual(list(self._getPlugins()), ["first"])
+        self.assertIn("second", self.collection.getState())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import pluginLeases
+
+
+class PluginShardTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.store = pluginLeases.PluginLeaseStore(
+            os.path.join(self.tempDir, "leases")
+        )
+        self.shard = pluginLeases.PluginShard(
+            self.store, 1, 1, {}, 10, logging.getLogger("test.shard")
+        )
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tempDir)
+
+    def test_plugins_of_the_same_name_are_leased_apart(self):
+        keys = set([("/plugins/a", "logArgs"), ("/plugins/b", "logArgs")])
+        self.shard.start()
+        try:
+            owned, acquired = self.shard.update(keys, {})
+            self.assertEqual(owned, keys)
+            self.assertEqual(acquired, dict((key, None) for key in keys))
+
+            self.shard.saveStates(
+                {("/plugins/a", "logArgs"): 1, ("/plugins/b", "logArgs"): 2}
+            )
+        finally:
+            self.shard.stop({})
+
+        self.shard.start()
+        try:
+            owned, acquired = self.shard.update(keys, {})
+            self.assertEqual(
+                acquired, {("/plugins/a", "logArgs"): 1, ("/plugins/b", "logArgs"): 2}
+            )
+        finally:
+            self.shard.stop({})
+
+    def test_holds_leases_until_they_expire(self):
+        self.assertFalse(self.shard.holdsLeases())
+        self.shard.start()
+        try:
+            self.assertTrue(self.shard.holdsLeases())
+        finally:
+            self.shard.stop({})
+
+
+if __name__ == "__main__":
+    unittest.main()
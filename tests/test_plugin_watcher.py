@@ -0,0 +1,75 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import pluginWatchers
+
+
+class PluginWatcherTestMixin(object):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self._writePlugin("changed.py")
+        self._writePlugin("removed.py")
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _writePlugin(self, basename):
+        path = os.path.join(self.path, basename)
+        with open(path, "w") as fh:
+            fh.write("# %s\n" % time.time())
+        # Make the change visible to modification time comparisons.
+        mtime = time.time() + len(os.listdir(self.path))
+        os.utime(path, (mtime, mtime))
+
+    def _waitForChanges(self, watcher, expected):
+        changes = set()
+        deadline = time.time() + 5
+        while changes != expected and time.time() < deadline:
+            changes.update(watcher.getChanges().get(self.path) or ())
+            time.sleep(0.05)
+        return changes
+
+    def test_plugin_changes_are_found(self):
+        watcher = self.createWatcher()
+        watcher.start()
+        try:
+            self._writePlugin("added.py")
+            self._writePlugin("changed.py")
+            os.remove(os.path.join(self.path, "removed.py"))
+
+            expected = set(["added.py", "changed.py", "removed.py"])
+            self.assertEqual(self._waitForChanges(watcher, expected), expected)
+        finally:
+            watcher.stop()
+
+
+class PollingPluginWatcherTest(PluginWatcherTestMixin, unittest.TestCase):
+    def createWatcher(self):
+        return pluginWatchers.PollingPluginWatcher([self.path], 0.05)
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+class InotifyPluginWatcherTest(PluginWatcherTestMixin, unittest.TestCase):
+    def createWatcher(self):
+        return pluginWatchers.InotifyPluginWatcher([self.path])
+
+    def test_overflow_rescans_every_path(self):
+        watcher = self.createWatcher()
+        watcher._readEvents(
+            watcher.EVENT_HEADER.pack(-1, watcher.IN_Q_OVERFLOW, 0, 0)
+        )
+        self.assertEqual(watcher.getChanges(), {self.path: None})
+        os.close(watcher._fd)
+
+
+class PluginWatcherTest(unittest.TestCase):
+    def test_watchers_must_find_changes(self):
+        self.assertRaises(TypeError, pluginWatchers.PluginWatcher, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
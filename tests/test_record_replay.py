@@ -0,0 +1,96 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import daemonErrors
+import eventRecording
+import shotgun_api3 as sg
+
+
+class FakeShotgun(object):
+    def find(self, entityType, filters, fields=None):
+        return [{"type": entityType, "id": len(filters)}]
+
+    def update(self, entityType, entityId, data):
+        raise sg.Fault("Permission denied.")
+
+
+class RecordReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.journalPath = os.path.join(self.path, "events.gz")
+        self.log = logging.getLogger("test.recorder")
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _record(self):
+        recorder = eventRecording.EventRecorder(self.journalPath, self.log)
+        recorder.recordEvents([{"id": 2}, {"id": 1}])
+        shotgun = eventRecording.RecordingShotgun(FakeShotgun(), recorder, 1)
+        shotgun.find("Task", [["id", "is", 1]])
+        shotgun.find("Task", [])
+        self.assertRaises(
+            sg.Fault, shotgun.update, "Task", 1, {"content": "a"}
+        )
+        recorder.recordEvents([{"id": 3}, {"id": 2}])
+        recorder.close()
+
+    def test_events_and_responses_are_replayed(self):
+        self._record()
+        events, responses = eventRecording._readEventJournal(
+            self.journalPath, self.log
+        )
+
+        self.assertEqual([event["id"] for event in events], [1, 2, 3])
+        shotgun = eventRecording.ReplayShotgun(responses, 1)
+        self.assertEqual(shotgun.find("Task", [["id", "is", 1]]), [{"type": "Task", "id": 1}])
+        self.assertEqual(shotgun.find("Task", []), [{"type": "Task", "id": 0}])
+        self.assertRaises(
+            sg.Fault, shotgun.update, "Task", 1, {"content": "a"}
+        )
+        self.assertIsNone(shotgun.set_session_uuid("uuid"))
+        self.assertEqual(responses.getMissingCount(), 0)
+
+    def test_calls_that_were_not_recorded_fail(self):
+        self._record()
+        events, responses = eventRecording._readEventJournal(
+            self.journalPath, self.log
+        )
+
+        for shotgun, filters in (
+            (eventRecording.ReplayShotgun(responses, 1), [["id", "is", 2]]),
+            (eventRecording.ReplayShotgun(responses, 2), []),
+        ):
+            self.assertRaises(
+                daemonErrors.ReplayError, shotgun.find, "Task", filters
+            )
+        self.assertEqual(responses.getMissingCount(), 2)
+
+    def test_responses_are_handed_out_in_order(self):
+        responses = eventRecording.RecordedResponses()
+        responses.add(1, "key", [1], None)
+        responses.add(1, "key", [2], None)
+
+        first = responses.take(1, "key")
+        first.append(3)
+        self.assertEqual(first, [1, 3])
+        self.assertEqual(responses.take(1, "key"), [2])
+        self.assertEqual(responses.take(1, "key"), [2])
+
+    def test_recording_again_appends(self):
+        self._record()
+        recorder = eventRecording.EventRecorder(self.journalPath, self.log)
+        recorder.recordEvents([{"id": 4}])
+        recorder.close()
+
+        events, responses = eventRecording._readEventJournal(
+            self.journalPath, self.log
+        )
+        self.assertEqual([event["id"] for event in events], [1, 2, 3, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
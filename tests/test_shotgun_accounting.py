@@ -0,0 +1,77 @@
+import unittest
+
+import shotgunConnections
+import shotgunEventDaemon
+from helpers import FakeEngine, FakePlugin, makeEvent
+
+
+class FakeShotgun(object):
+    def find(self, entityType, filters, fields=None):
+        return [{"type": entityType, "id": 1}, {"type": entityType, "id": 2}]
+
+    def find_one(self, entityType, filters, fields=None):
+        return None
+
+    def set_session_uuid(self, sessionUuid):
+        pass
+
+
+class AccountedShotgunTest(unittest.TestCase):
+    def test_calls_are_counted_by_method(self):
+        shotgun = shotgunConnections.AccountedShotgun(FakeShotgun())
+        shotgun.find("Task", [])
+        shotgun.find("Shot", [])
+        shotgun.find_one("Task", [])
+        shotgun.set_session_uuid("uuid")
+
+        calls = shotgun.getCalls()
+        self.assertEqual(sorted(calls), ["find", "find_one"])
+        self.assertEqual(calls["find"][0], 2)
+        self.assertEqual(calls["find"][2], 4)
+        self.assertEqual(calls["find_one"][2], 0)
+        self.assertEqual(shotgun.getTotals()[0], 3)
+        self.assertEqual(shotgun.getTotals()[3], "find:2,find_one:1")
+
+    def test_wrap_starts_over_with_another_instance(self):
+        first = FakeShotgun()
+        shotgun = shotgunConnections.AccountedShotgun(first)
+        shotgun.find("Task", [])
+        find = shotgun.find
+
+        second = FakeShotgun()
+        shotgun.wrap(second)
+
+        self.assertIs(shotgun.getShotgun(), second)
+        self.assertEqual(shotgun.getCalls(), {})
+        self.assertIs(shotgun.find, find)
+        shotgun.find("Task", [])
+        self.assertEqual(shotgun.getCalls()["find"][0], 1)
+
+
+class CallbackAccountingTest(unittest.TestCase):
+    def test_wrapper_is_reused_across_calls(self):
+        engine = FakeEngine()
+        engine.settings.shotgunCallAccounting = True
+        received = []
+
+        def callback(sg, logger, event, args):
+            received.append(sg)
+            sg.find("Task", [])
+
+        callback = shotgunEventDaemon.Callback(
+            callback, FakePlugin("accounting"), engine, FakeShotgun()
+        )
+        callback.process(makeEvent(1, 1))
+        callback.process(makeEvent(2, 1))
+
+        self.assertIs(received[0], received[1])
+        self.assertIsInstance(received[0], shotgunConnections.AccountedShotgun)
+        self.assertIsNone(received[0].getShotgun())
+        self.assertIn(
+            'method="find"} 2',
+            engine.metrics.render(),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+import shotgunConnections
+
+
+class FakeShotgun(object):
+    def __init__(self, scriptName):
+        self.scriptName = scriptName
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeShotgunPool(shotgunConnections.ShotgunPool):
+    def __init__(self):
+        shotgunConnections.ShotgunPool.__init__(self, "https://test", None)
+        self.created = []
+
+    def _createShotgun(self, scriptName, scriptKey):
+        shotgun = FakeShotgun(scriptName)
+        self.created.append(shotgun)
+        return shotgun
+
+
+class ShotgunPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = FakeShotgunPool()
+
+    def test_released_connections_are_reused(self):
+        first = self.pool.acquire("script", "key")
+        second = self.pool.acquire("script", "key")
+        self.assertIsNot(first, second)
+
+        self.pool.release(first, "script", "key")
+        self.assertIs(self.pool.acquire("script", "key"), first)
+        self.assertIsNot(self.pool.acquire("other", "key"), first)
+        self.assertEqual(len(self.pool.created), 3)
+
+    def test_retain_closes_the_connections_of_unused_scripts(self):
+        kept = self.pool.acquire("kept", "key")
+        dropped = self.pool.acquire("dropped", "key")
+        self.pool.release(kept, "kept", "key")
+        self.pool.release(dropped, "dropped", "key")
+
+        self.pool.retain(set([("kept", "key")]))
+
+        self.assertFalse(kept.closed)
+        self.assertTrue(dropped.closed)
+        self.assertIs(self.pool.acquire("kept", "key"), kept)
+        self.assertIsNot(self.pool.acquire("dropped", "key"), dropped)
+
+
+if __name__ == "__main__":
+    unittest.main()